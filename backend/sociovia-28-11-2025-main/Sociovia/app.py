@@ -13,6 +13,7 @@ from dotenv import load_dotenv
 from sqlalchemy.orm import DeclarativeBase
 
 from config import Config
+from json_provider import OrjsonProvider
 from models import db, User, Admin, AuditLog
 from mailer import send_mail
 from tokens import make_action_token, load_action_token
@@ -30,6 +31,7 @@ class Base(DeclarativeBase):
 # Create Flask app
 app = Flask(__name__)
 app.config.from_object(Config)
+app.json = OrjsonProvider(app)
 app.secret_key = os.environ.get("SESSION_SECRET", app.config['SECRET_KEY'])
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 CORS(app, resources={r"/*": {"origins": "*"}})
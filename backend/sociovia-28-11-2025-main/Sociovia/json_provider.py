@@ -0,0 +1,80 @@
+"""
+Flask JSON provider backed by orjson.
+
+Drop-in replacement for Flask's DefaultJSONProvider: every jsonify() and
+request.get_json() call goes through orjson.
+"""
+
+import json
+from typing import Any
+
+import orjson
+from flask import Response, current_app
+from flask.json.provider import DefaultJSONProvider
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    JSON provider that serializes with orjson.
+
+    Dates, Decimals and other types orjson does not handle the Flask way
+    are passed through to Flask's default hook, so response bodies keep
+    their existing shape. Pretty-printed output (debug mode) still uses
+    the stdlib encoder.
+    """
+
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs.get("indent") is not None:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._OPTIONS).decode()
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        """
+        Build a jsonify() response straight from orjson's bytes.
+
+        Skips the bytes -> str -> bytes round trip dumps() needs to honour
+        its str return type.
+        """
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        if pretty:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self._OPTIONS | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+def iso_json_response(obj: Any, status: int = 200) -> Response:
+    """
+    jsonify() for payloads that carry raw datetime values.
+
+    Datetimes are written as ISO 8601 (the same text as datetime.isoformat())
+    by orjson itself, so callers can skip per-field isoformat() calls.
+    jsonify() would render them as HTTP dates instead.
+    """
+    body = orjson.dumps(obj, default=current_app.json.default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+    return current_app.response_class(body, status=status, mimetype="application/json")
+
+
+def db_json_serializer(obj: Any) -> str:
+    """
+    SQLAlchemy json_serializer for JSON/JSONB columns.
+    
+    Values orjson rejects (e.g. ints beyond 64 bits) fall back to the
+    stdlib encoder, which is what SQLAlchemy used before.
+    """
+    try:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    except TypeError:
+        return json.dumps(obj)
+
+
+def db_json_deserializer(s: str | bytes) -> Any:
+    """SQLAlchemy json_deserializer for JSON/JSONB columns."""
+    return orjson.loads(s)
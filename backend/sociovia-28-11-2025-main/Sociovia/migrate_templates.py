@@ -15,6 +15,9 @@ ALTER_STATEMENTS = [
     "ALTER TABLE whatsapp_templates ADD COLUMN IF NOT EXISTS validation_flags JSON;",
     "ALTER TABLE whatsapp_templates ADD COLUMN IF NOT EXISTS detected_intent VARCHAR(32);",
     "ALTER TABLE whatsapp_templates ADD COLUMN IF NOT EXISTS approval_path VARCHAR(32);",
+    # JSONB + GIN so analytics can filter on risk flags inside the database
+    "ALTER TABLE whatsapp_templates ALTER COLUMN validation_flags TYPE JSONB USING validation_flags::jsonb;",
+    "CREATE INDEX IF NOT EXISTS ix_whatsapp_templates_validation_flags_gin ON whatsapp_templates USING gin (validation_flags);",
 ]
 
 def run_migration():
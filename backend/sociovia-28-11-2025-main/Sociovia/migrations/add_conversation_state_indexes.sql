@@ -0,0 +1,14 @@
+-- Migration: Composite indexes for active conversation-state lookups
+-- The state engine resolves the active state by (workspace_id, phone_number, is_active)
+-- or (conversation_id, is_active). Partial on is_active so completed states are not indexed.
+
+CREATE INDEX IF NOT EXISTS ix_conv_state_ws_phone_active
+  ON whatsapp_conversation_states(workspace_id, phone_number, is_active)
+  WHERE is_active;
+
+CREATE INDEX IF NOT EXISTS ix_conv_state_conv_active
+  ON whatsapp_conversation_states(conversation_id, is_active)
+  WHERE is_active;
+
+-- Superseded by the two partial indexes above
+DROP INDEX IF EXISTS ix_conv_state_active;
@@ -0,0 +1,13 @@
+-- Migration: Database-side timestamps for visual automation tables
+-- created_at / updated_at are now filled by the database (server_default /
+-- onupdate timezone('utc', now())) instead of Python-side datetime.now()
+-- values. The columns are naive UTC, so the default converts now() to UTC
+-- rather than storing it in the session TimeZone.
+
+ALTER TABLE whatsapp_visual_automations
+  ALTER COLUMN created_at SET DEFAULT timezone('utc', now()),
+  ALTER COLUMN updated_at SET DEFAULT timezone('utc', now());
+
+ALTER TABLE whatsapp_conversation_states
+  ALTER COLUMN created_at SET DEFAULT timezone('utc', now()),
+  ALTER COLUMN updated_at SET DEFAULT timezone('utc', now());
@@ -0,0 +1,11 @@
+-- Migration: Index unfinished webhook receipts
+-- Every webhook is stored as an event_type = 'received' row before Meta gets
+-- its 200 and finished (processed_at set) once its lanes are done. The replay
+-- loop looks for receipts left unfinished by a dead worker; partial so the
+-- index only holds the handful in flight.
+-- partition_webhook_logs.sql rebuilds this index on the partitioned table,
+-- so the two can run in either order.
+
+CREATE INDEX IF NOT EXISTS ix_whatsapp_webhook_logs_unfinished
+  ON whatsapp_webhook_logs(received_at)
+  WHERE event_type = 'received' AND processed_at IS NULL;
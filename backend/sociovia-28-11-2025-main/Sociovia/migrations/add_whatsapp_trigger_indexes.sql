@@ -0,0 +1,9 @@
+-- Migration: Composite index for the trigger listing query
+-- list_triggers filters on (account_id, workspace_id) and orders by created_at DESC;
+-- delete_trigger adds the primary key to the same filter.
+
+CREATE INDEX IF NOT EXISTS ix_whatsapp_triggers_acct_ws_created
+  ON whatsapp_triggers(account_id, workspace_id, created_at DESC);
+
+-- account_id alone is now a prefix of the composite index (and of uq_account_trigger_slug)
+DROP INDEX IF EXISTS ix_whatsapp_triggers_account_id;
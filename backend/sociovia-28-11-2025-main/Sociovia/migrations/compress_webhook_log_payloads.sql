@@ -0,0 +1,5 @@
+-- Migration: Store webhook log payloads gzip-compressed
+-- New rows write raw_json_gz (BYTEA); raw_json stays readable for older rows.
+
+ALTER TABLE whatsapp_webhook_logs ADD COLUMN IF NOT EXISTS raw_json_gz BYTEA;
+ALTER TABLE whatsapp_webhook_logs ALTER COLUMN raw_json DROP NOT NULL;
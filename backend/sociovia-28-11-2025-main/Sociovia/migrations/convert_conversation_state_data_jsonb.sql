@@ -0,0 +1,6 @@
+-- Migration: Store conversation state_data as JSONB
+-- Lets set_state_data update a single key with jsonb_set instead of
+-- rewriting the whole blob on every collected input.
+
+ALTER TABLE whatsapp_conversation_states
+  ALTER COLUMN state_data TYPE JSONB USING state_data::jsonb;
@@ -0,0 +1,11 @@
+-- Migration: Store visual automation flow data as JSONB
+-- trigger_config is read for every inbound message; nodes/edges for every flow step.
+-- JSONB is stored pre-parsed and supports GIN indexing of trigger_config.
+
+ALTER TABLE whatsapp_visual_automations
+  ALTER COLUMN trigger_config TYPE JSONB USING trigger_config::jsonb,
+  ALTER COLUMN nodes TYPE JSONB USING nodes::jsonb,
+  ALTER COLUMN edges TYPE JSONB USING edges::jsonb;
+
+CREATE INDEX IF NOT EXISTS ix_va_trigger_cfg_gin
+  ON whatsapp_visual_automations USING gin (trigger_config);
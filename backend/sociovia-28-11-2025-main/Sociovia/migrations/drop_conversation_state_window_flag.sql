@@ -0,0 +1,6 @@
+-- Migration: Derive the 24h window flag instead of storing it
+-- WhatsAppConversationState.is_within_24h_window is now a hybrid property over
+-- last_user_message_at (SQL: last_user_message_at > (now() AT TIME ZONE 'utc') - interval '24 hours').
+-- A STORED generated column cannot use now(), so the column is simply dropped.
+
+ALTER TABLE whatsapp_conversation_states DROP COLUMN IF EXISTS is_within_24h_window;
@@ -0,0 +1,78 @@
+-- Migration: Range-partition whatsapp_webhook_logs by month on received_at
+-- The log is append-only and nothing references it, so it can be rebuilt as a
+-- partitioned table: each month's indexes stay small, queries filtered on
+-- received_at touch only the matching partitions, and old months are removed
+-- with DETACH/DROP PARTITION instead of DELETE.
+--
+-- Partitioned tables need the partition key in the primary key, hence
+-- PRIMARY KEY (id, received_at). Run inside a maintenance window.
+--
+-- Order: run compress_webhook_log_payloads.sql first (this copies
+-- raw_json_gz). add_webhook_receipt_index.sql may run before or after;
+-- the index is rebuilt here either way.
+--
+-- Future months: the app keeps this month and the next 3 partitioned
+-- (ensure_webhook_log_partitions in whatsapp/webhook.py, run daily by the
+-- webhook log drainer). Rows that reach the DEFAULT partition meanwhile are
+-- moved into their month's partition when it is created. If the app is
+-- not running, call ensure_webhook_log_partitions() from a flask shell
+-- once a month instead.
+
+BEGIN;
+
+ALTER TABLE whatsapp_webhook_logs RENAME TO whatsapp_webhook_logs_unpartitioned;
+ALTER INDEX IF EXISTS ix_whatsapp_webhook_logs_event RENAME TO ix_whatsapp_webhook_logs_event_old;
+ALTER INDEX IF EXISTS ix_whatsapp_webhook_logs_received RENAME TO ix_whatsapp_webhook_logs_received_old;
+ALTER INDEX IF EXISTS ix_whatsapp_webhook_logs_unfinished RENAME TO ix_whatsapp_webhook_logs_unfinished_old;
+
+CREATE TABLE whatsapp_webhook_logs (
+    id SERIAL NOT NULL,
+    raw_json TEXT,
+    raw_json_gz BYTEA,
+    event_type VARCHAR(64),
+    phone_number_id VARCHAR(64),
+    processed BOOLEAN NOT NULL DEFAULT FALSE,
+    error_message TEXT,
+    received_at TIMESTAMP NOT NULL,
+    processed_at TIMESTAMP,
+    PRIMARY KEY (id, received_at)
+) PARTITION BY RANGE (received_at);
+
+CREATE INDEX ix_whatsapp_webhook_logs_event ON whatsapp_webhook_logs (event_type);
+CREATE INDEX ix_whatsapp_webhook_logs_received ON whatsapp_webhook_logs (received_at);
+CREATE INDEX ix_whatsapp_webhook_logs_unfinished ON whatsapp_webhook_logs (received_at)
+  WHERE event_type = 'received' AND processed_at IS NULL;
+
+-- Rows outside every monthly range land here
+CREATE TABLE whatsapp_webhook_logs_default PARTITION OF whatsapp_webhook_logs DEFAULT;
+
+-- Monthly partitions from the oldest stored log through 3 months ahead;
+-- later months are added by the app (see the header).
+DO $$
+DECLARE
+    month_start DATE := date_trunc('month', COALESCE(
+        (SELECT min(received_at) FROM whatsapp_webhook_logs_unpartitioned), now()))::date;
+    last_month DATE := (date_trunc('month', now()) + interval '3 months')::date;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF whatsapp_webhook_logs FOR VALUES FROM (%L) TO (%L)',
+            'whatsapp_webhook_logs_' || to_char(month_start, 'YYYY_MM'),
+            month_start,
+            (month_start + interval '1 month')::date
+        );
+        month_start := (month_start + interval '1 month')::date;
+    END LOOP;
+END $$;
+
+INSERT INTO whatsapp_webhook_logs
+    (id, raw_json, raw_json_gz, event_type, phone_number_id, processed, error_message, received_at, processed_at)
+SELECT id, raw_json, raw_json_gz, event_type, phone_number_id, processed, error_message, received_at, processed_at
+FROM whatsapp_webhook_logs_unpartitioned;
+
+SELECT setval(pg_get_serial_sequence('whatsapp_webhook_logs', 'id'),
+              COALESCE((SELECT max(id) FROM whatsapp_webhook_logs), 0) + 1, false);
+
+DROP TABLE whatsapp_webhook_logs_unpartitioned;
+
+COMMIT;
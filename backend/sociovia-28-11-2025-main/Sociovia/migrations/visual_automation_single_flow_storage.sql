@@ -0,0 +1,8 @@
+-- Migration: Keep visual automation flows in one place
+-- nodes/edges live only as JSONB on whatsapp_visual_automations; the normalized
+-- whatsapp_automation_nodes table was never written to and is dropped.
+-- nodes_hash lets unchanged canvas saves skip rewriting the JSON.
+
+ALTER TABLE whatsapp_visual_automations ADD COLUMN IF NOT EXISTS nodes_hash VARCHAR(64);
+
+DROP TABLE IF EXISTS whatsapp_automation_nodes;
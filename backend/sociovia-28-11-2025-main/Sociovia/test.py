@@ -12,6 +12,7 @@ from sqlalchemy.orm import DeclarativeBase
 from flask_session import Session
 from flask_cors import CORS, cross_origin
 from config import Config
+from json_provider import OrjsonProvider, db_json_serializer, db_json_deserializer
 from models import db, User, Admin,SocialAccount ,AIUsage,AIUsageDailySummary,AssistantThread, AssistantMessage
 from mailer import send_mail
 from tokens import make_action_token, load_action_token
@@ -69,6 +70,7 @@ class Base(DeclarativeBase):
 
 app = Flask(__name__)
 app.config.from_object(Config)
+app.json = OrjsonProvider(app)
 
 # Security key for sessions
 app.secret_key = os.environ.get("SESSION_SECRET", app.config.get("SECRET_KEY", "dev-secret"))
@@ -100,10 +102,21 @@ app.config.update({
 })
 
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_size": 5,        # max open connections per process
-    "max_overflow": 2,     # extra temporary connections
-    "pool_pre_ping": True, # check connections before using
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "20")),        # max open connections per process (webhook bursts)
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),  # extra temporary connections
+    # Pre-ping costs a round-trip per checkout; TCP keepalives below catch dead
+    # connections instead. Set DB_POOL_PRE_PING=1 on flaky networks.
+    "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "0") == "1",
     "pool_recycle": 1800,  # recycle every 30 mins
+    "insertmanyvalues_page_size": 1000,  # rows per multi-row INSERT batch (webhook logs)
+    "json_serializer": db_json_serializer,      # orjson for JSON/JSONB columns
+    "json_deserializer": db_json_deserializer,
+    "connect_args": {      # libpq TCP keepalives
+        "keepalives": 1,
+        "keepalives_idle": 30,
+        "keepalives_interval": 10,
+        "keepalives_count": 3,
+    },
 }
 
 
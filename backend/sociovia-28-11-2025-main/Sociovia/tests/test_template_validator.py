@@ -0,0 +1,36 @@
+"""Pins how the template validator scans header, body and footer."""
+
+from whatsapp.template_validator import TemplateValidator
+
+
+def _validate(**kwargs):
+    return TemplateValidator().validate(category="UTILITY", **kwargs)
+
+
+def test_keyword_inside_a_segment_is_flagged():
+    result = _validate(
+        header="Shipping update",
+        body="Your parcel ships today only",
+        footer="Thanks",
+    )
+    assert "PROMOTIONAL_LANGUAGE" in result.risk_flags
+
+
+def test_phrase_split_across_body_and_footer_is_not_flagged():
+    # "today" ends the body and "only" starts the footer. Segments are
+    # scanned separately, so this is not the promotional "today only".
+    result = _validate(
+        header="Shipping update",
+        body="Your parcel ships today",
+        footer="only members can reply",
+    )
+    assert "PROMOTIONAL_LANGUAGE" not in result.risk_flags
+    assert result.confidence_score == 100
+
+
+def test_phrase_split_across_header_and_body_is_not_flagged():
+    result = _validate(
+        header="Order",
+        body="now ready for pickup at the store",
+    )
+    assert "PROMOTIONAL_LANGUAGE" not in result.risk_flags
@@ -18,19 +18,108 @@ Usage:
 
 import logging
 import re
+from dataclasses import dataclass
 from datetime import datetime, timezone, timedelta
 from typing import Dict, Any, Optional, List, Tuple
 
+import ahocorasick
+from sqlalchemy import insert
+
 from models import db
 from .automation_models import (
     WhatsAppAutomationRule,
     WhatsAppAutomationLog,
     WhatsAppBusinessHours,
 )
+from .utils import evict_oldest
 
 logger = logging.getLogger(__name__)
 
 
+# ============================================================
+# Keyword Rule Index
+# ============================================================
+
+# (rule position, keywords, case_sensitive) for each "contains" keyword rule
+KeywordRuleSpec = Tuple[int, Tuple[Any, ...], bool]
+
+
+@dataclass(frozen=True)
+class KeywordIndex:
+    """
+    Every "contains" keyword of an account's keyword rules, in one
+    case-insensitive and one case-sensitive Aho-Corasick automaton.
+    
+    A message is scanned once for all rules instead of once per keyword;
+    hits() reports, per rule, the first keyword in the rule's own order
+    that occurs in the text - the keyword the per-rule loop would return.
+    """
+    caseless: Optional["ahocorasick.Automaton"]
+    cased: Optional["ahocorasick.Automaton"]
+    always: Dict[int, int]  # Rules with an empty keyword (contained in any text)
+    
+    @classmethod
+    def build(cls, specs: Tuple[KeywordRuleSpec, ...]) -> "KeywordIndex":
+        entries: Dict[bool, Dict[str, List[Tuple[int, int]]]] = {False: {}, True: {}}
+        always: Dict[int, int] = {}
+        for position, keywords, case_sensitive in specs:
+            for keyword_index, keyword in enumerate(keywords):
+                if not isinstance(keyword, str):
+                    continue
+                word = keyword if case_sensitive else keyword.lower()
+                if word:
+                    entries[case_sensitive].setdefault(word, []).append((position, keyword_index))
+                else:
+                    always.setdefault(position, keyword_index)
+        
+        automata = {}
+        for case_sensitive, words in entries.items():
+            automaton = None
+            if words:
+                automaton = ahocorasick.Automaton()
+                for word, targets in words.items():
+                    automaton.add_word(word, tuple(targets))
+                automaton.make_automaton()
+            automata[case_sensitive] = automaton
+        return cls(caseless=automata[False], cased=automata[True], always=always)
+    
+    def hits(self, message_text: str) -> Dict[int, int]:
+        """rule position -> index of its first keyword found in the text."""
+        found = dict(self.always)
+        for automaton, text in ((self.caseless, message_text.lower()), (self.cased, message_text)):
+            if automaton is None:
+                continue
+            for _, targets in automaton.iter(text):
+                for position, keyword_index in targets:
+                    if keyword_index < found.get(position, keyword_index + 1):
+                        found[position] = keyword_index
+        return found
+
+
+# Keyed by the keyword specs themselves, so an edited rule gets a new index
+_KEYWORD_INDEX_CACHE: Dict[Tuple[KeywordRuleSpec, ...], KeywordIndex] = {}
+KEYWORD_INDEX_CACHE_MAX = 1_000
+
+
+def get_keyword_index(rules: List[WhatsAppAutomationRule]) -> KeywordIndex:
+    """Return the keyword index for these rules (positions follow the list)."""
+    specs = []
+    for position, rule in enumerate(rules):
+        trigger_config = rule.trigger_config or {}
+        if rule.rule_type != "keyword" or trigger_config.get("match_type", "contains") in ("exact", "starts_with"):
+            continue
+        keywords = tuple(trigger_config.get("keywords", []))
+        specs.append((position, keywords, bool(trigger_config.get("case_sensitive", False))))
+    key = tuple(specs)
+    
+    index = _KEYWORD_INDEX_CACHE.get(key)
+    if index is None:
+        index = KeywordIndex.build(key)
+        evict_oldest(_KEYWORD_INDEX_CACHE, KEYWORD_INDEX_CACHE_MAX)
+        _KEYWORD_INDEX_CACHE[key] = index
+    return index
+
+
 class AutomationEngine:
     """
     Processes incoming messages against automation rules.
@@ -84,13 +173,17 @@ class AutomationEngine:
                 logger.debug(f"No automation rules for account {self.account_id}")
                 return None
             
+            # One pass over the text for every "contains" keyword rule
+            keyword_hits = get_keyword_index(rules).hits(message_text)
+            
             # Check rules in priority order
-            for rule in rules:
+            for position, rule in enumerate(rules):
                 match_result = self._check_rule_match(
                     rule, 
                     message_text, 
                     is_first_message,
-                    conversation_id
+                    conversation_id,
+                    keyword_hit=keyword_hits.get(position),
                 )
                 
                 if match_result["matched"]:
@@ -168,11 +261,15 @@ class AutomationEngine:
         rule: WhatsAppAutomationRule,
         message_text: str,
         is_first_message: bool,
-        conversation_id: int
+        conversation_id: int,
+        keyword_hit: Optional[int] = None,
     ) -> Dict[str, Any]:
         """
         Check if a rule matches the incoming message.
         
+        keyword_hit is the index of the rule's first keyword found by the
+        KeywordIndex scan ("contains" keyword rules only).
+        
         Returns:
             {"matched": bool, "matched_keyword": str or None}
         """
@@ -216,6 +313,12 @@ class AutomationEngine:
             match_type = trigger_config.get("match_type", "contains")  # contains, exact, starts_with
             case_sensitive = trigger_config.get("case_sensitive", False)
             
+            if match_type not in ("exact", "starts_with"):
+                # contains - already matched by the KeywordIndex scan
+                if keyword_hit is not None:
+                    return {"matched": True, "matched_keyword": keywords[keyword_hit]}
+                return {"matched": False}
+            
             text_to_check = message_text if case_sensitive else message_text.lower()
             
             for keyword in keywords:
@@ -340,9 +443,12 @@ class AutomationEngine:
     ):
         """
         Log automation trigger for audit and analytics.
+        
+        The row is write-only, so it is a Core INSERT rather than an ORM
+        object tracked by the unit of work.
         """
         try:
-            log = WhatsAppAutomationLog(
+            db.session.execute(insert(WhatsAppAutomationLog).values(
                 workspace_id=self.workspace_id,
                 rule_id=rule.id,
                 conversation_id=conversation_id,
@@ -350,8 +456,7 @@ class AutomationEngine:
                 trigger_text=trigger_text,
                 matched_keyword=matched_keyword,
                 response_success=True,  # Will be updated after response sent
-            )
-            db.session.add(log)
+            ))
             # Don't commit here - let caller handle transaction
         except Exception as e:
             logger.exception(f"Failed to log automation trigger: {e}")
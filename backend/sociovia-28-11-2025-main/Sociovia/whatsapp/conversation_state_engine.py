@@ -64,12 +64,7 @@ class ConversationStateEngine:
             is_active=True
         ).order_by(WhatsAppConversationState.created_at.desc()).first()
         
-        if state:
-            # Check if still within 24h window
-            if not self._is_within_24h_window(state):
-                state.is_within_24h_window = False
-                db.session.commit()
-        
+        # is_within_24h_window is derived from last_user_message_at, no write needed
         return state
     
     def get_or_create_state(
@@ -102,7 +97,6 @@ class ConversationStateEngine:
             automation_id=automation_id,
             current_node_id=start_node_id,
             last_user_message_at=datetime.now(timezone.utc),
-            is_within_24h_window=True,
             is_active=True,
             state_data={}
         )
@@ -121,7 +115,6 @@ class ConversationStateEngine:
     def advance_to_node(self, state: WhatsAppConversationState, node_id: str) -> None:
         """Move the conversation to a new node."""
         state.current_node_id = node_id
-        state.updated_at = datetime.now(timezone.utc)
         db.session.commit()
         
         logger.info(f"[State Engine] Advanced {state.phone_number} to node: {node_id}")
@@ -129,8 +122,6 @@ class ConversationStateEngine:
     def record_user_message(self, state: WhatsAppConversationState) -> None:
         """Record that user sent a message (resets 24h window)."""
         state.last_user_message_at = datetime.now(timezone.utc)
-        state.is_within_24h_window = True
-        state.updated_at = datetime.now(timezone.utc)
         db.session.commit()
     
     def record_button_click(
@@ -145,11 +136,9 @@ class ConversationStateEngine:
             The next node ID based on the button's configuration, or None.
         """
         state.last_button_clicked = button_id
-        state.updated_at = datetime.now(timezone.utc)
         
         # Also counts as user interaction for 24h window
         state.last_user_message_at = datetime.now(timezone.utc)
-        state.is_within_24h_window = True
         
         db.session.commit()
         
@@ -164,7 +153,6 @@ class ConversationStateEngine:
         """Mark the automation as completed for this conversation."""
         state.is_active = False
         state.completed_at = datetime.now(timezone.utc)
-        state.updated_at = datetime.now(timezone.utc)
         db.session.commit()
         
         logger.info(f"[State Engine] Completed automation for {state.phone_number}")
@@ -345,11 +333,8 @@ class ConversationStateEngine:
         key: str, 
         value: Any
     ) -> None:
-        """Store a value in the conversation state data."""
-        state_data = state.state_data or {}
-        state_data[key] = value
-        state.state_data = state_data
-        state.updated_at = datetime.now(timezone.utc)
+        """Store a value in the conversation state data (partial JSONB update)."""
+        WhatsAppConversationState.set_state_key(db.session, state.id, key, value)
         db.session.commit()
     
     def get_state_data(
@@ -365,7 +350,6 @@ class ConversationStateEngine:
     def clear_state_data(self, state: WhatsAppConversationState) -> None:
         """Clear all state data."""
         state.state_data = {}
-        state.updated_at = datetime.now(timezone.utc)
         db.session.commit()
     
     # =========================================
@@ -11,7 +11,6 @@ Endpoints:
 """
 
 import os
-import json
 import base64
 import hashlib
 import time
@@ -19,6 +18,7 @@ from datetime import datetime, timezone
 from functools import wraps
 from typing import Optional, Dict, Any, Tuple
 
+import orjson
 from flask import Blueprint, request, jsonify, current_app
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
@@ -28,6 +28,7 @@ from cryptography.hazmat.backends import default_backend
 # Import models
 from models import db
 from .models import WhatsAppAccount, WhatsAppFlow
+from .utils import verify_signature
 
 # Create blueprint
 flow_endpoint_bp = Blueprint("flow_endpoint", __name__, url_prefix="/api/whatsapp/flows")
@@ -126,24 +127,10 @@ def verify_meta_signature(payload: bytes, signature_header: str, app_secret: str
     Verify X-Hub-Signature-256 header from Meta.
     
     Meta signs all webhook/endpoint requests with HMAC-SHA256.
-    This prevents spoofed requests.
+    This prevents spoofed requests. Shares the webhook's verifier, which
+    compares raw digest bytes and encodes the secret once per process.
     """
-    if not signature_header:
-        return False
-    
-    if not signature_header.startswith("sha256="):
-        return False
-    
-    expected_signature = signature_header[7:]  # Remove "sha256=" prefix
-    
-    import hmac
-    computed = hmac.new(
-        app_secret.encode('utf-8'),
-        payload,
-        hashlib.sha256
-    ).hexdigest()
-    
-    return hmac.compare_digest(computed, expected_signature)
+    return verify_signature(payload, signature_header, app_secret)
 
 
 def require_meta_signature(f):
@@ -375,7 +362,8 @@ def decrypt_request(
     decrypted_data = decryptor.update(ciphertext) + decryptor.finalize()
     
     # Return decrypted data AND the keys needed for response encryption
-    return json.loads(decrypted_data.decode('utf-8')), aes_key, iv_bytes
+    payload = orjson.loads(decrypted_data)
+    return payload, aes_key, iv_bytes
 
 
 def encrypt_response(response_data: dict, aes_key: bytes, iv: bytes) -> str:
@@ -390,7 +378,7 @@ def encrypt_response(response_data: dict, aes_key: bytes, iv: bytes) -> str:
     # Flip all bits of the IV as Meta requires
     flipped_iv = bytes(b ^ 0xFF for b in iv)
     
-    plaintext = json.dumps(response_data).encode('utf-8')
+    plaintext = orjson.dumps(response_data, option=orjson.OPT_NON_STR_KEYS)
     
     cipher = Cipher(
         algorithms.AES(aes_key),
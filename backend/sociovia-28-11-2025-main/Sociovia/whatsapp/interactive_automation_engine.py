@@ -11,33 +11,326 @@ This engine:
 4. Handles button click responses and navigates to the next node
 """
 
+import json
 import logging
+import threading
+import time
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Dict, Any, Optional, Tuple, List
+from typing import TYPE_CHECKING, Dict, Any, Optional, Tuple, List
+
+import ahocorasick
+from sqlalchemy import DateTime, event, inspect, select
+from sqlalchemy.orm import make_transient_to_detached
 
 from models import db
 from .visual_automation_models import WhatsAppVisualAutomation, WhatsAppConversationState
 from .models import WhatsAppAccount, WhatsAppConversation
 from .services import WhatsAppService
+from .utils import evict_oldest, get_redis_client
+
+if TYPE_CHECKING:
+    from .webhook import AccountSpec
 
 logger = logging.getLogger(__name__)
 
 
+# ============================================================
+# Compiled Trigger Matchers
+# ============================================================
+
+@dataclass(frozen=True, slots=True)
+class TriggerMatcher:
+    """
+    Pre-parsed trigger_config for one automation version.
+    
+    keywords are lowercased for TriggerIndex's Aho-Corasick automaton, which
+    matches keyword triggers; matches() covers the other trigger types.
+    """
+    trigger_type: str
+    keywords: Tuple[str, ...]
+    exact_message: str
+    
+    @classmethod
+    def from_automation(cls, automation: WhatsAppVisualAutomation) -> "TriggerMatcher":
+        trigger_config = automation.trigger_config or {}
+        
+        keywords = trigger_config.get("keywords", [])
+        if isinstance(keywords, str):
+            keywords = [k.strip() for k in keywords.split(",")]
+        keywords = [k.lower() for k in keywords if isinstance(k, str)]
+        
+        return cls(
+            trigger_type=automation.trigger_type,
+            keywords=tuple(keywords),
+            exact_message=trigger_config.get("message", "").lower(),
+        )
+    
+    def matches(self, message_text: str, is_button_reply: bool) -> bool:
+        if self.trigger_type == "any_reply":
+            # Matches any message (but not button replies in the middle of a flow)
+            return not is_button_reply
+        if self.trigger_type == "exact_match":
+            return message_text.lower() == self.exact_message
+        return False
+
+
+# Keyed by (automation id, version); saving an automation bumps its version
+_MATCHER_CACHE: Dict[Tuple[int, int], TriggerMatcher] = {}
+MATCHER_CACHE_MAX = 10_000
+
+
+def get_trigger_matcher(automation: WhatsAppVisualAutomation) -> TriggerMatcher:
+    """Return the compiled matcher for this automation version."""
+    key = (automation.id, automation.version or 1)
+    matcher = _MATCHER_CACHE.get(key)
+    if matcher is None:
+        matcher = TriggerMatcher.from_automation(automation)
+        evict_oldest(_MATCHER_CACHE, MATCHER_CACHE_MAX)
+        _MATCHER_CACHE[key] = matcher
+    return matcher
+
+
+@dataclass(frozen=True, slots=True)
+class TriggerIndex:
+    """
+    Trigger matching for a whole list of automations.
+    
+    Every keyword of every keyword-triggered automation sits in one
+    Aho-Corasick automaton, so a message is scanned once no matter how many
+    automations or keywords there are. The first automation in list order
+    that matches wins, as with checking each matcher in turn.
+    """
+    matchers: Tuple[TriggerMatcher, ...]
+    keyword_ac: Optional["ahocorasick.Automaton"]
+    always_keyword: frozenset  # Keyword automations with an empty keyword (matches any text)
+    
+    @classmethod
+    def build(cls, automations: List[WhatsAppVisualAutomation]) -> "TriggerIndex":
+        matchers = tuple(get_trigger_matcher(a) for a in automations)
+        positions_by_keyword: Dict[str, List[int]] = {}
+        always_keyword = set()
+        for position, matcher in enumerate(matchers):
+            if matcher.trigger_type != "keyword":
+                continue
+            for keyword in matcher.keywords:
+                if keyword:
+                    positions_by_keyword.setdefault(keyword, []).append(position)
+                else:
+                    always_keyword.add(position)
+        
+        keyword_ac = None
+        if positions_by_keyword:
+            keyword_ac = ahocorasick.Automaton()
+            for keyword, positions in positions_by_keyword.items():
+                keyword_ac.add_word(keyword, tuple(positions))
+            keyword_ac.make_automaton()
+        
+        return cls(matchers, keyword_ac, frozenset(always_keyword))
+    
+    def first_match(self, message_text: str, is_button_reply: bool) -> Optional[int]:
+        """Position of the first matching automation, or None."""
+        keyword_hits = set(self.always_keyword)
+        if self.keyword_ac is not None:
+            for _, positions in self.keyword_ac.iter(message_text.lower()):
+                keyword_hits.update(positions)
+        
+        for position, matcher in enumerate(self.matchers):
+            if matcher.trigger_type == "keyword":
+                if position in keyword_hits:
+                    return position
+            elif matcher.matches(message_text, is_button_reply):
+                return position
+        return None
+
+
+# Keyed by the (id, version) of every automation in the list, in order
+_TRIGGER_INDEX_CACHE: Dict[Tuple[Tuple[int, int], ...], TriggerIndex] = {}
+TRIGGER_INDEX_CACHE_MAX = 1_000
+
+
+def get_trigger_index(automations: List[WhatsAppVisualAutomation]) -> TriggerIndex:
+    """Return the trigger index for this list of automation versions."""
+    key = tuple((a.id, a.version or 1) for a in automations)
+    index = _TRIGGER_INDEX_CACHE.get(key)
+    if index is None:
+        index = TriggerIndex.build(automations)
+        evict_oldest(_TRIGGER_INDEX_CACHE, TRIGGER_INDEX_CACHE_MAX)
+        _TRIGGER_INDEX_CACHE[key] = index
+    return index
+
+
+# ============================================================
+# Active Conversation State Cache
+# ============================================================
+
+# (workspace_id, conversation_id) -> (snapshot of the active state, cached_at).
+# Process-local and write-through: every state change made by this engine
+# refreshes the entry, so a user who keeps chatting needs no state SELECT.
+# Only active states are cached - "no flow" is always re-read - and any ORM
+# flush of a state from elsewhere drops its entry. The short TTL bounds what
+# the flush hook cannot see (bulk UPDATEs, other processes).
+_STATE_CACHE: Dict[Tuple[str, int], Tuple[Dict[str, Any], float]] = {}
+_STATE_CACHE_LOCK = threading.Lock()
+STATE_CACHE_TTL = 60
+STATE_CACHE_MAX = 50_000
+
+_STATE_SNAPSHOT_FIELDS = (
+    "id", "workspace_id", "conversation_id", "phone_number", "automation_id",
+    "current_node_id", "last_button_clicked", "state_data",
+    "last_user_message_at", "is_active",
+)
+
+
+def _snapshot_state(state: Optional[WhatsAppConversationState]) -> Optional[Dict[str, Any]]:
+    """Column values of an active state, or None if it is inactive/incomplete."""
+    if state is None or not state.is_active:
+        return None
+    # Reading an expired attribute would issue the SELECT the cache is meant to save
+    if not inspect(state).expired_attributes.isdisjoint(_STATE_SNAPSHOT_FIELDS):
+        return None
+    return {field: getattr(state, field) for field in _STATE_SNAPSHOT_FIELDS}
+
+
+def _cache_state(workspace_id: str, conversation_id: int, snapshot: Optional[Dict[str, Any]]):
+    with _STATE_CACHE_LOCK:
+        if snapshot is None:
+            _STATE_CACHE.pop((workspace_id, conversation_id), None)
+            return
+        evict_oldest(_STATE_CACHE, STATE_CACHE_MAX)
+        _STATE_CACHE[(workspace_id, conversation_id)] = (snapshot, time.monotonic())
+
+
+def invalidate_conversation_state_cache(workspace_id: Optional[str] = None, conversation_id: Optional[int] = None):
+    """Drop one cached state, or the whole cache when no key is given."""
+    with _STATE_CACHE_LOCK:
+        if workspace_id is None or conversation_id is None:
+            _STATE_CACHE.clear()
+        else:
+            _STATE_CACHE.pop((str(workspace_id), conversation_id), None)
+
+
+@event.listens_for(WhatsAppConversationState, "after_insert")
+@event.listens_for(WhatsAppConversationState, "after_update")
+@event.listens_for(WhatsAppConversationState, "after_delete")
+def _invalidate_flushed_state(mapper, connection, target):
+    # Covers writers outside this engine (ConversationStateEngine, routes);
+    # the engine's own _commit_state re-caches after its commit
+    invalidate_conversation_state_cache(target.workspace_id, target.conversation_id)
+
+
+
+# ============================================================
+# Active Automations Cache (Redis)
+# ============================================================
+
+# Active automations of an account, stored as column dicts under a version
+# tag. Saving an automation INCRs the account's version, so every worker
+# moves to a fresh key at once; the TTL only reclaims superseded versions.
+AUTOMATIONS_CACHE_PREFIX = "wa:automations:"
+AUTOMATIONS_CACHE_TTL = 86400
+
+_AUTOMATION_COLUMNS = tuple(
+    getattr(WhatsAppVisualAutomation, attr.key).label(attr.key)
+    for attr in inspect(WhatsAppVisualAutomation).column_attrs
+)
+_AUTOMATION_DATETIME_KEYS = tuple(
+    attr.key for attr in inspect(WhatsAppVisualAutomation).column_attrs
+    if isinstance(attr.columns[0].type, DateTime)
+)
+
+
+def _automation_version_key(account_id: int) -> str:
+    return f"{AUTOMATIONS_CACHE_PREFIX}ver:{account_id}"
+
+
+def _detached_automation(values: Dict[str, Any]) -> WhatsAppVisualAutomation:
+    """Rebuild an automation from cached column values, outside any session."""
+    automation = WhatsAppVisualAutomation(**values)
+    make_transient_to_detached(automation)
+    return automation
+
+
+def load_active_automations(account_id: int) -> List[WhatsAppVisualAutomation]:
+    """
+    Return the account's active automations, from Redis when possible.
+    
+    The automations are detached, fully loaded objects, so a commit later in
+    the webhook does not expire them into per-attribute reloads. Without
+    Redis this is the plain SELECT.
+    """
+    client = get_redis_client()
+    cache_key = None
+    rows = None
+    if client is not None:
+        try:
+            version = int(client.get(_automation_version_key(account_id)) or 0)
+            cache_key = f"{AUTOMATIONS_CACHE_PREFIX}{account_id}:v{version}"
+            cached = client.get(cache_key)
+            if cached is not None:
+                rows = json.loads(cached)
+                for row in rows:
+                    for key in _AUTOMATION_DATETIME_KEYS:
+                        if row[key] is not None:
+                            row[key] = datetime.fromisoformat(row[key])
+        except Exception as e:
+            logger.warning(f"Automations cache read failed, querying: {e}")
+            cache_key = None
+    
+    if rows is None:
+        rows = [
+            dict(row._mapping)
+            for row in db.session.execute(
+                select(*_AUTOMATION_COLUMNS).where(
+                    WhatsAppVisualAutomation.account_id == account_id,
+                    WhatsAppVisualAutomation.is_active == True,
+                    WhatsAppVisualAutomation.status == "active",
+                )
+            )
+        ]
+        if cache_key is not None:
+            try:
+                client.set(cache_key, json.dumps(rows, default=datetime.isoformat), nx=True, ex=AUTOMATIONS_CACHE_TTL)
+            except Exception as e:
+                logger.warning(f"Automations cache write failed: {e}")
+    
+    return [_detached_automation(row) for row in rows]
+
+
+def invalidate_automations_cache(account_id: int) -> None:
+    """Move the account to a new cache version. Call after the save commits."""
+    client = get_redis_client()
+    if client is None:
+        return
+    try:
+        client.incr(_automation_version_key(account_id))
+    except Exception as e:
+        logger.error(f"Failed to invalidate automations cache for account {account_id}: {e}")
+
+
 class InteractiveAutomationEngine:
     """
     Executes interactive automation flows for WhatsApp conversations.
     """
     
-    def __init__(self, account_id: int, workspace_id: str):
+    def __init__(
+        self,
+        account_id: int,
+        workspace_id: str,
+        automations: Optional[List[WhatsAppVisualAutomation]] = None,
+    ):
         """
         Initialize the engine for a specific account.
         
         Args:
             account_id: WhatsApp account ID
             workspace_id: Workspace ID for multi-tenant isolation
+            automations: Already-loaded automations for the account (optional).
+                When given, trigger matching filters these instead of querying.
         """
         self.account_id = account_id
         self.workspace_id = str(workspace_id)
+        self.automations = automations
     
     def process_incoming_message(
         self,
@@ -61,44 +354,64 @@ class InteractiveAutomationEngine:
             Dict with automation result or None if no automation triggered
         """
         try:
-            print(f"🔍 InteractiveAutomation: Processing message for account={self.account_id}, workspace={self.workspace_id}")
-            print(f"   Message: '{message_text}', is_button={is_button_reply}")
+            logger.debug("InteractiveAutomation: Processing message for account=%s, workspace=%s", self.account_id, self.workspace_id)
+            logger.debug("Message: '%s', is_button=%s", message_text, is_button_reply)
             
             # First, check if user has an active conversation state (mid-flow)
             active_state = self._get_active_conversation_state(conversation_id)
             
             if active_state:
-                print(f"   ✓ Found active state: {active_state.id}, continuing flow")
+                logger.debug("Found active state: %s, continuing flow", active_state.id)
                 # User is already in a flow - handle button click or text input
                 return self._handle_flow_continuation(
                     active_state, message_text, from_phone, is_button_reply, button_payload
                 )
             
             # No active state - check if message triggers a new automation
-            print(f"   ⌕ No active state, searching for matching automation...")
+            logger.debug("No active state, searching for matching automation...")
             automation = self._find_matching_automation(message_text, is_button_reply)
             
             if automation:
-                print(f"   ✓ Found matching automation: {automation.id} - {automation.name}")
+                logger.debug("Found matching automation: %s - %s", automation.id, automation.name)
                 return self._start_automation_flow(
                     automation, conversation_id, from_phone
                 )
             
-            print(f"   ✗ No matching automation found")
+            logger.debug("No matching automation found")
             return None
             
         except Exception as e:
-            print(f"   ⚠️ Interactive automation error: {e}")
             logger.exception(f"Interactive automation error (non-fatal): {e}")
             return None
     
     def _get_active_conversation_state(self, conversation_id: int) -> Optional[WhatsAppConversationState]:
-        """Get active conversation state if user is mid-flow."""
-        return WhatsAppConversationState.query.filter_by(
+        """
+        Get active conversation state if user is mid-flow.
+        
+        Served from the state cache when possible; a cached snapshot is
+        attached to the session as a persistent object without a SELECT.
+        """
+        cached = _STATE_CACHE.get((self.workspace_id, conversation_id))
+        if cached and time.monotonic() - cached[1] < STATE_CACHE_TTL:
+            state = WhatsAppConversationState(**cached[0])
+            make_transient_to_detached(state)
+            return db.session.merge(state, load=False)
+        
+        state = WhatsAppConversationState.query.filter_by(
             conversation_id=conversation_id,
             workspace_id=self.workspace_id,
             is_active=True
         ).first()
+        _cache_state(self.workspace_id, conversation_id, _snapshot_state(state))
+        return state
+    
+    def _commit_state(self, state: WhatsAppConversationState):
+        """Commit pending changes and write the state through to the cache."""
+        db.session.flush()
+        snapshot = _snapshot_state(state)
+        conversation_id = state.conversation_id
+        db.session.commit()
+        _cache_state(self.workspace_id, conversation_id, snapshot)
     
     def _find_matching_automation(
         self, message_text: str, is_button_reply: bool
@@ -107,53 +420,24 @@ class InteractiveAutomationEngine:
         Find an active automation that matches the incoming message.
         """
         # Get all active automations for this account
-        print(f"   Querying automations: account_id={self.account_id}, workspace_id='{self.workspace_id}'")
-        
-        automations = WhatsAppVisualAutomation.query.filter_by(
-            account_id=self.account_id,
-            workspace_id=self.workspace_id,
-            is_active=True,
-            status="active"
-        ).all()
-        
-        print(f"   Found {len(automations)} active automations")
-        
-        # Also check if there are any automations at all for this workspace (for debugging)
-        all_automations = WhatsAppVisualAutomation.query.filter_by(
-            workspace_id=self.workspace_id
-        ).all()
-        print(f"   Total automations in workspace: {len(all_automations)}")
-        for a in all_automations:
-            print(f"     - ID:{a.id} '{a.name}' account={a.account_id} status={a.status} is_active={a.is_active}")
-        
-        for automation in automations:
-            trigger_type = automation.trigger_type
-            trigger_config = automation.trigger_config or {}
-            
-            # Check trigger matching
-            if trigger_type == "any_reply":
-                # Matches any message (but not button replies in the middle of a flow)
-                if not is_button_reply:
-                    return automation
-                    
-            elif trigger_type == "keyword":
-                # Check if message contains any of the keywords
-                keywords = trigger_config.get("keywords", [])
-                if isinstance(keywords, str):
-                    keywords = [k.strip() for k in keywords.split(",")]
-                    
-                message_lower = message_text.lower()
-                for keyword in keywords:
-                    if keyword.lower() in message_lower:
-                        return automation
-                        
-            elif trigger_type == "exact_match":
-                # Exact message match
-                expected = trigger_config.get("message", "").lower()
-                if message_text.lower() == expected:
-                    return automation
-        
-        return None
+        if self.automations is not None:
+            automations = [
+                a for a in self.automations
+                if a.is_active and a.status == "active" and a.workspace_id == self.workspace_id
+            ]
+        else:
+            logger.debug("Querying automations: account_id=%s, workspace_id='%s'", self.account_id, self.workspace_id)
+            automations = WhatsAppVisualAutomation.query.filter_by(
+                account_id=self.account_id,
+                workspace_id=self.workspace_id,
+                is_active=True,
+                status="active"
+            ).all()
+        
+        logger.debug("Found %s active automations", len(automations))
+        
+        position = get_trigger_index(automations).first_match(message_text, is_button_reply)
+        return automations[position] if position is not None else None
     
     def _start_automation_flow(
         self,
@@ -208,8 +492,8 @@ class InteractiveAutomationEngine:
         db.session.add(state)
         
         # Increment automation trigger count
-        automation.increment_trigger_count()
-        db.session.commit()
+        WhatsAppVisualAutomation.bump_trigger(db.session, automation.id)
+        self._commit_state(state)
         
         # Send the first message
         return self._send_node_message(
@@ -227,9 +511,9 @@ class InteractiveAutomationEngine:
         """
         Handle continuation of an active flow (button click or text).
         """
-        print(f"   -> Flow continuation: state_id={state.id}, automation_id={state.automation_id}")
-        print(f"      Current node: {state.current_node_id}")
-        print(f"      is_button_reply={is_button_reply}, button_payload={button_payload}")
+        logger.debug("Flow continuation: state_id=%s, automation_id=%s", state.id, state.automation_id)
+        logger.debug("Current node: %s", state.current_node_id)
+        logger.debug("is_button_reply=%s, button_payload=%s", is_button_reply, button_payload)
         
         # Check if this state is stale (older than 24 hours)
         if state.last_user_message_at:
@@ -238,22 +522,24 @@ class InteractiveAutomationEngine:
             if last_msg_at.tzinfo is None:
                 last_msg_at = last_msg_at.replace(tzinfo=timezone.utc)
             age_hours = (datetime.now(timezone.utc) - last_msg_at).total_seconds() / 3600
-            print(f"      State age: {age_hours:.1f} hours")
+            logger.debug("State age: %.1f hours", age_hours)
             if age_hours > 24:
-                print(f"      ⚠️ State is stale (>24h), completing it")
+                logger.debug("State is stale (>24h), completing it")
                 state.complete()
-                db.session.commit()
+                self._commit_state(state)
                 # Now search for a new automation match
                 return None
         
-        automation = WhatsAppVisualAutomation.query.get(state.automation_id)
+        automation = next(
+            (a for a in self.automations or () if a.id == state.automation_id), None
+        ) or WhatsAppVisualAutomation.query.get(state.automation_id)
         if not automation:
-            print(f"      ⚠️ Automation {state.automation_id} not found, completing state")
+            logger.debug("Automation %s not found, completing state", state.automation_id)
             state.complete()
-            db.session.commit()
+            self._commit_state(state)
             return None
         
-        print(f"      Automation: '{automation.name}' (active={automation.is_active})")
+        logger.debug("Automation: '%s' (active=%s)", automation.name, automation.is_active)
         
         nodes = automation.nodes or []
         edges = automation.edges or []
@@ -265,16 +551,16 @@ class InteractiveAutomationEngine:
         
         if is_button_reply and button_payload:
             # Button payload is the button ID - find edge with this sourceHandle
-            print(f"      Looking for edge with sourceHandle={button_payload}")
+            logger.debug("Looking for edge with sourceHandle=%s", button_payload)
             for edge in edges:
                 if edge.get("sourceHandle") == button_payload:
                     next_node_id = edge.get("target")
-                    print(f"      ✓ Found edge -> {next_node_id}")
+                    logger.debug("Found edge -> %s", next_node_id)
                     break
         else:
             # Text response - check if current node has any "any_reply" type button
             # or if there's a default continuation
-            print(f"      Text response: looking for current node {current_node_id}")
+            logger.debug("Text response: looking for current node %s", current_node_id)
             current_node = None
             for node in nodes:
                 if node.get("id") == current_node_id:
@@ -283,11 +569,11 @@ class InteractiveAutomationEngine:
             
             if current_node and current_node.get("type") == "message":
                 buttons = current_node.get("data", {}).get("buttons", [])
-                print(f"      Current node has {len(buttons)} buttons")
+                logger.debug("Current node has %s buttons", len(buttons))
                 for button in buttons:
                     # Check if any button has quick_reply type and matches text
                     label = button.get("label", "")
-                    print(f"        Button: '{label}' (checking vs '{message_text}')")
+                    logger.debug("Button: '%s' (checking vs '%s')", label, message_text)
                     if button.get("action", {}).get("type") == "quick_reply":
                         if label.lower() == message_text.lower():
                             # Text matched a button label - treat as button click
@@ -295,21 +581,21 @@ class InteractiveAutomationEngine:
                             for edge in edges:
                                 if edge.get("sourceHandle") == button_id:
                                     next_node_id = edge.get("target")
-                                    print(f"      ✓ Text matched button, going to {next_node_id}")
+                                    logger.debug("Text matched button, going to %s", next_node_id)
                                     break
                             break
             else:
-                print(f"      ⚠️ Current node not found or not a message node")
+                logger.debug("Current node not found or not a message node")
         
         if not next_node_id:
             # No matching next node - user may have sent unexpected input
             # Clear the state and send a helpful message
-            print(f"      ✗ No matching next node found. User sent unexpected input: '{message_text}'")
-            print(f"      🧹 Clearing state and sending help message")
+            logger.debug("No matching next node found. User sent unexpected input: '%s'", message_text)
+            logger.debug("Clearing state and sending help message")
             
             # Complete/clear the state so user can start fresh
             state.complete()
-            db.session.commit()
+            self._commit_state(state)
             
             # Send a helpful message to the user
             help_message = "Sorry, I didn't understand that response, you have to select from the options displayed only. The conversation has been reset. You can start again by sending your command."
@@ -346,7 +632,7 @@ class InteractiveAutomationEngine:
         # Check if this is an end node
         if next_node.get("type") == "end":
             state.complete()
-            db.session.commit()
+            self._commit_state(state)
             
             # Send end message if configured
             end_message = next_node.get("data", {}).get("message")
@@ -354,7 +640,7 @@ class InteractiveAutomationEngine:
                 return self._send_text_message(from_phone, end_message)
             return {"completed": True, "message": "Flow completed"}
         
-        db.session.commit()
+        self._commit_state(state)
         
         # Send the next message node
         return self._send_node_message(automation, next_node, from_phone, state)
@@ -392,9 +678,9 @@ class InteractiveAutomationEngine:
         call_buttons = []
         url_buttons = []
         
-        print(f"      Buttons in node: {len(buttons)}")
+        logger.debug("Buttons in node: %s", len(buttons))
         for idx, button in enumerate(buttons):
-            print(f"        Button {idx}: {button}")
+            logger.debug("Button %s: %s", idx, button)
             
             # Handle different button data structures from the flow builder
             # The frontend might store action differently
@@ -411,7 +697,7 @@ class InteractiveAutomationEngine:
             )
             button_id = button.get("id", f"btn_{idx}")
             
-            print(f"          action_type={action_type}, label='{button_label}', id={button_id}")
+            logger.debug("action_type=%s, label='%s', id=%s", action_type, button_label, button_id)
             
             if action_type in ("quick_reply", "reply", None):
                 # Only include if button has a target node connected
@@ -426,29 +712,29 @@ class InteractiveAutomationEngine:
                                 "title": title[:20]  # Max 20 chars for WhatsApp
                             }
                         })
-                        print(f"          ✓ Added interactive button: {title[:20]}")
+                        logger.debug("Added interactive button: %s", title[:20])
                         break
             elif action_type == "call":
                 # Call buttons - append phone number to message body
                 phone_number = action.get("phoneNumber") or action.get("phone") or action.get("value")
                 if phone_number:
                     call_buttons.append({"label": button_label, "phone": phone_number})
-                    print(f"          📞 Call button: {button_label} -> {phone_number}")
+                    logger.debug("Call button: %s -> %s", button_label, phone_number)
             elif action_type == "url":
                 # URL buttons - append URL to message body
                 url = action.get("url") or action.get("value")
                 if url:
                     url_buttons.append({"label": button_label, "url": url})
-                    print(f"          🔗 URL button: {button_label} -> {url}")
+                    logger.debug("URL button: %s -> %s", button_label, url)
         
-        print(f"      Interactive buttons to send: {interactive_buttons}")
+        logger.debug("Interactive buttons to send: %s", interactive_buttons)
         
         # If no interactive buttons but has call/URL buttons, append them to body
         if not interactive_buttons and (call_buttons or url_buttons):
             # This is a terminal node with action buttons - clear the state
-            print(f"      🏁 Terminal node with action buttons, completing state")
+            logger.debug("Terminal node with action buttons, completing state")
             state.complete()
-            db.session.commit()
+            self._commit_state(state)
         
         if not body:
             body = "Please select an option:"
@@ -480,7 +766,7 @@ class InteractiveAutomationEngine:
             # If this was a message with call/URL buttons (no interactive buttons),
             # auto-continue to the next connected node
             if not interactive_buttons and (call_buttons or url_buttons):
-                print(f"      ⏩ Auto-continuing to next node after call/URL buttons...")
+                logger.debug("Auto-continuing to next node after call/URL buttons...")
                 # Find any edge from this node (could be from any button or the node itself)
                 next_node_id = None
                 current_node_id = node.get("id")
@@ -508,13 +794,13 @@ class InteractiveAutomationEngine:
                             break
                     
                     if next_node:
-                        print(f"      ⏩ Found next node: {next_node_id} (type={next_node.get('type')})")
+                        logger.debug("Found next node: %s (type=%s)", next_node_id, next_node.get('type'))
                         
                         # If it's an end node, send the end message
                         if next_node.get("type") == "end":
                             end_message = next_node.get("data", {}).get("message")
                             if end_message:
-                                print(f"      🏁 Sending end node message: {end_message[:50]}...")
+                                logger.debug("Sending end node message: %s...", end_message[:50])
                                 self._send_text_message(to_phone, end_message)
                             return {"success": True, "completed": True, "message": "Flow completed"}
                         else:
@@ -550,12 +836,13 @@ class InteractiveAutomationEngine:
 
 
 def process_interactive_automation(
-    account: WhatsAppAccount,
+    account: "AccountSpec",
     conversation: WhatsAppConversation,
     message_text: str,
     from_phone: str,
     is_button_reply: bool = False,
     button_payload: Optional[str] = None,
+    automations: Optional[List[WhatsAppVisualAutomation]] = None,
 ) -> Optional[Dict[str, Any]]:
     """
     Convenience function to process a message against interactive automations.
@@ -563,12 +850,13 @@ def process_interactive_automation(
     Called from the webhook handler.
     
     Args:
-        account: WhatsApp account
+        account: Resolved account (id and workspace_id)
         conversation: Conversation object
         message_text: Text content of the message
         from_phone: Sender's phone number
         is_button_reply: True if this is a button reply
         button_payload: Button ID/payload if button reply
+        automations: Preloaded active automations, see load_active_automations (optional)
         
     Returns:
         Dict with result or None if no automation triggered
@@ -576,7 +864,8 @@ def process_interactive_automation(
     try:
         engine = InteractiveAutomationEngine(
             account_id=account.id,
-            workspace_id=account.workspace_id
+            workspace_id=account.workspace_id,
+            automations=automations,
         )
         
         return engine.process_incoming_message(
@@ -15,12 +15,13 @@ Endpoints:
 """
 
 import logging
-from datetime import datetime, timezone
 from functools import wraps
 from flask import Blueprint, request, jsonify, g
 from models import db
+from json_provider import iso_json_response
 from .visual_automation_models import WhatsAppVisualAutomation
 from .models import WhatsAppAccount
+from .interactive_automation_engine import invalidate_automations_cache, invalidate_conversation_state_cache
 
 logger = logging.getLogger(__name__)
 
@@ -73,9 +74,10 @@ def list_interactive_automations(workspace_id: str):
             
         automations = query.order_by(WhatsAppVisualAutomation.updated_at.desc()).all()
         
-        return jsonify({
+        # Datetimes stay native and are encoded by orjson in one pass
+        return iso_json_response({
             "success": True,
-            "automations": [a.to_dict() for a in automations]
+            "automations": [a.to_dict(serialize_dates=False) for a in automations]
         })
         
     except Exception as e:
@@ -131,14 +133,14 @@ def create_interactive_automation():
             description=data.get("description"),
             trigger_type=trigger_type,
             trigger_config=trigger,
-            nodes=data.get("nodes", []),
-            edges=data.get("edges", []),
             status="draft",
             is_active=False,
         )
+        automation.set_flow(data.get("nodes", []), data.get("edges", []))
         
         db.session.add(automation)
         db.session.commit()
+        invalidate_automations_cache(automation.account_id)
         
         logger.info(f"Created interactive automation {automation.id} for workspace {workspace_id}")
         
@@ -192,10 +194,11 @@ def update_interactive_automation(automation_id: int):
             automation.name = data["name"]
         if "description" in data:
             automation.description = data["description"]
-        if "nodes" in data:
-            automation.nodes = data["nodes"]
-        if "edges" in data:
-            automation.edges = data["edges"]
+        if "nodes" in data or "edges" in data:
+            automation.set_flow(
+                data.get("nodes", automation.nodes or []),
+                data.get("edges", automation.edges or []),
+            )
         if "trigger" in data:
             trigger = data["trigger"]
             automation.trigger_type = trigger.get("type", automation.trigger_type)
@@ -204,9 +207,9 @@ def update_interactive_automation(automation_id: int):
             automation.viewport = data["viewport"]
             
         automation.version = (automation.version or 1) + 1
-        automation.updated_at = datetime.now(timezone.utc)
         
         db.session.commit()
+        invalidate_automations_cache(automation.account_id)
         
         logger.info(f"Updated interactive automation {automation_id}")
         
@@ -230,8 +233,10 @@ def delete_interactive_automation(automation_id: int):
         if not automation:
             return jsonify({"success": False, "error": "Automation not found"}), 404
             
+        account_id = automation.account_id
         db.session.delete(automation)
         db.session.commit()
+        invalidate_automations_cache(account_id)
         
         logger.info(f"Deleted interactive automation {automation_id}")
         
@@ -261,6 +266,7 @@ def publish_interactive_automation(automation_id: int):
             
         automation.activate()
         db.session.commit()
+        invalidate_automations_cache(automation.account_id)
         
         logger.info(f"Published interactive automation {automation_id}")
         
@@ -291,6 +297,7 @@ def pause_interactive_automation(automation_id: int):
             
         automation.pause()
         db.session.commit()
+        invalidate_automations_cache(automation.account_id)
         
         logger.info(f"Paused interactive automation {automation_id}")
         
@@ -349,6 +356,7 @@ def clear_conversation_states():
             state.is_active = False
         
         db.session.commit()
+        invalidate_conversation_state_cache()
         
         logger.info(f"Cleared {count} conversation states")
         
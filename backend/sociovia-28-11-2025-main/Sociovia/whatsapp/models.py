@@ -14,10 +14,12 @@ Tables:
 from datetime import datetime, timezone
 from typing import Optional, Dict, Any
 import enum
+import gzip
 import json
 
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Enum, Text, JSON, UniqueConstraint, Index
+from sqlalchemy import DDL, Enum, Text, JSON, UniqueConstraint, Index, event, inspect, text
+from sqlalchemy.dialects.postgresql import JSONB
 
 # Import db from main models to share the same instance
 from models import db
@@ -159,6 +161,30 @@ class WhatsAppAccount(db.Model):
         self.access_token_encrypted = encrypt_token(token)
         self.token_type = token_type
         self.token_expires_at = expires_at
+        
+        # Token rotated: every cached send credential may now be stale (the
+        # cache also holds fallbacks resolved to this account)
+        from .token_helper import invalidate_account_cache
+        invalidate_account_cache()
+
+
+# Cached send credentials (token_helper) may resolve to any account as a
+# fallback, so clear them all when an account is deactivated, re-pointed or
+# deleted - however the change is made
+def _invalidate_account_credentials(mapper, connection, target) -> None:
+    from .token_helper import invalidate_account_cache
+    invalidate_account_cache()
+
+
+def _invalidate_changed_account_credentials(mapper, connection, target) -> None:
+    state = inspect(target)
+    if any(state.attrs[field].history.has_changes()
+           for field in ("is_active", "phone_number_id", "access_token_encrypted")):
+        _invalidate_account_credentials(mapper, connection, target)
+
+
+event.listen(WhatsAppAccount, "after_update", _invalidate_changed_account_credentials)
+event.listen(WhatsAppAccount, "after_delete", _invalidate_account_credentials)
 
 
 # ============================================================
@@ -311,33 +337,59 @@ class WhatsAppWebhookLog(db.Model):
     Raw webhook payloads for debugging and audit.
     
     Stores every webhook received from Meta for troubleshooting.
+    
+    On Postgres the table is range-partitioned by month on received_at
+    (see migrations/partition_webhook_logs.sql), so the primary key
+    includes received_at.
     """
     __tablename__ = "whatsapp_webhook_logs"
     __table_args__ = (
         Index("ix_whatsapp_webhook_logs_event", "event_type"),
         Index("ix_whatsapp_webhook_logs_received", "received_at"),
-        {"extend_existing": True},
+        # Webhooks stored but not finished, scanned by the replay loop
+        Index(
+            "ix_whatsapp_webhook_logs_unfinished",
+            "received_at",
+            postgresql_where=text("event_type = 'received' AND processed_at IS NULL"),
+        ),
+        {"extend_existing": True, "postgresql_partition_by": "RANGE (received_at)"},
     )
 
-    id = db.Column(db.Integer, primary_key=True)
-    raw_json = db.Column(db.Text, nullable=False)  # Complete raw JSON payload
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    raw_json = db.Column(db.Text, nullable=True)  # Uncompressed payload (rows written before raw_json_gz)
+    raw_json_gz = db.Column(db.LargeBinary, nullable=True)  # Gzip-compressed raw JSON payload
     event_type = db.Column(db.String(64), nullable=True)  # messages, statuses, errors, etc.
     phone_number_id = db.Column(db.String(64), nullable=True)  # For filtering
     processed = db.Column(db.Boolean, default=False, nullable=False)  # Whether successfully processed
     error_message = db.Column(db.Text, nullable=True)  # Processing error if any
     
     # Timestamps
-    received_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    received_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False, primary_key=True)
     processed_at = db.Column(db.DateTime, nullable=True)
 
     def __repr__(self):
         return f"<WhatsAppWebhookLog {self.id} ({self.event_type})>"
 
+    @staticmethod
+    def compress_payload(raw_json: str | bytes) -> bytes:
+        """Gzip a raw payload for raw_json_gz (mtime=0 keeps output deterministic)."""
+        if isinstance(raw_json, str):
+            raw_json = raw_json.encode("utf-8")
+        return gzip.compress(raw_json, compresslevel=6, mtime=0)
+
+    @property
+    def payload_text(self) -> Optional[str]:
+        """Raw JSON payload, from whichever column holds it."""
+        if self.raw_json_gz is not None:
+            return gzip.decompress(self.raw_json_gz).decode("utf-8")
+        return self.raw_json
+
     def to_dict(self) -> Dict[str, Any]:
-        # Parse raw_json safely
+        # Parse raw payload safely
         try:
-            parsed = json.loads(self.raw_json) if self.raw_json else None
-        except (json.JSONDecodeError, TypeError):
+            raw = self.payload_text
+            parsed = json.loads(raw) if raw else None
+        except (json.JSONDecodeError, TypeError, OSError, EOFError):
             parsed = None
 
         return {
@@ -355,7 +407,7 @@ class WhatsAppWebhookLog(db.Model):
     def log_webhook(cls, raw_json: str, event_type: Optional[str] = None, phone_number_id: Optional[str] = None) -> "WhatsAppWebhookLog":
         """Create a webhook log entry."""
         log = cls(
-            raw_json=raw_json,
+            raw_json_gz=cls.compress_payload(raw_json),
             event_type=event_type,
             phone_number_id=phone_number_id,
         )
@@ -369,6 +421,46 @@ class WhatsAppWebhookLog(db.Model):
         self.processed_at = datetime.now(timezone.utc)
 
 
+# create_all() only makes the partitioned parent; give it a catch-all child so
+# inserts work before monthly partitions exist
+event.listen(
+    WhatsAppWebhookLog.__table__,
+    "after_create",
+    DDL(
+        "CREATE TABLE IF NOT EXISTS whatsapp_webhook_logs_default "
+        "PARTITION OF whatsapp_webhook_logs DEFAULT"
+    ).execute_if(dialect="postgresql"),
+)
+
+
+class MessageStatusEvent(db.Model):
+    """
+    Delivery status history for outbound messages.
+
+    One row per status webhook (sent, delivered, read, failed), kept even
+    when the wamid does not match a stored message.
+    """
+    __tablename__ = "whatsapp_message_status_events"
+    __table_args__ = (
+        Index("ix_status_events_wamid", "wamid"),
+        Index("ix_status_events_timestamp", "timestamp"),
+        Index("ix_status_events_created", "created_at"),
+        {"extend_existing": True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    wamid = db.Column(db.String(128), nullable=False)
+    status = db.Column(db.String(16), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    error_code = db.Column(db.String(16), nullable=True)
+    error_message = db.Column(db.Text, nullable=True)
+    raw_event = db.Column(JSON().with_variant(JSONB(), "postgresql"), nullable=True)  # Full status object from Meta
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    def __repr__(self):
+        return f"<MessageStatusEvent {self.wamid} {self.status}>"
+
+
 # ============================================================
 # TABLE 5: WhatsApp Templates
 # ============================================================
@@ -396,6 +488,7 @@ class WhatsAppTemplate(db.Model):
     __table_args__ = (
         UniqueConstraint("account_id", "name", "language", name="uq_template_name_lang"),
         Index("ix_whatsapp_templates_name", "name"),
+        Index("ix_whatsapp_templates_validation_flags_gin", "validation_flags", postgresql_using="gin"),
         {"extend_existing": True},
     )
 
@@ -437,6 +530,17 @@ class WhatsAppTemplate(db.Model):
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     synced_at = db.Column(db.DateTime, nullable=True)  # Last synced from Meta API
+    
+    # Approval acceleration tracking (columns added by migrate_templates.py)
+    confidence_initial = db.Column(db.Integer, nullable=True)  # Pre-submit confidence score
+    confidence_post_submit = db.Column(db.Integer, nullable=True)  # Drifted score while pending
+    submitted_at = db.Column(db.DateTime, nullable=True)
+    approved_at = db.Column(db.DateTime, nullable=True)
+    approval_duration_seconds = db.Column(db.Integer, nullable=True)
+    approval_outcome_reason = db.Column(db.String(100), nullable=True)
+    validation_flags = db.Column(JSON().with_variant(JSONB(), "postgresql"), nullable=True)  # Risk flags from TemplateValidator
+    detected_intent = db.Column(db.String(32), nullable=True)
+    approval_path = db.Column(db.String(32), nullable=True)  # AUTOMATED_FAST, AUTOMATED_SLOW, ...
 
     def __repr__(self):
         return f"<WhatsAppTemplate {self.name} ({self.language})>"
@@ -25,11 +25,27 @@ Endpoints:
 """
 
 import os
+import json
 import logging
+import time
+import zlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
-from flask import Blueprint, request, jsonify, g
+from typing import Dict, Optional, Tuple
 
-from .webhook import verify_webhook_signature, verify_webhook_challenge, WebhookProcessor
+import orjson
+from flask import Blueprint, Flask, current_app, request, jsonify, g
+
+from .webhook import (
+    verify_webhook_signature,
+    verify_webhook_challenge,
+    WebhookProcessor,
+    WebhookReceipt,
+    store_webhook_receipt,
+    mark_webhook_receipt,
+    claim_lost_webhook_receipts,
+)
 from .services import WhatsAppService, ConversationService
 from .validators import (
     ValidationError,
@@ -45,6 +61,38 @@ logger = logging.getLogger(__name__)
 
 whatsapp_bp = Blueprint("whatsapp", __name__)
 
+# Webhook side-effects (logging, state updates, automations) run off the
+# request thread. Each lane is a single worker, and a phone number always
+# maps to the same lane, so one number's events keep their delivery order.
+WEBHOOK_LANES = int(os.getenv("WHATSAPP_WEBHOOK_LANES", "8"))
+_WEBHOOK_EXECUTORS = [
+    ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"wa-webhook-{i}")
+    for i in range(WEBHOOK_LANES)
+]
+
+# Webhooks a lane may hold (queued + running). A full lane answers 503 so
+# Meta retries later, instead of queueing without limit in memory.
+WEBHOOK_LANE_QUEUE_MAX = int(os.getenv("WHATSAPP_WEBHOOK_LANE_QUEUE_MAX", "500"))
+_WEBHOOK_LANE_SLOTS = [threading.BoundedSemaphore(WEBHOOK_LANE_QUEUE_MAX) for _ in range(WEBHOOK_LANES)]
+
+# Delivery receipts outnumber inbound messages several times over but can
+# afford to be late, so they get their own smaller set of lanes and a
+# status backlog never delays message ingest and automations.
+WEBHOOK_STATUS_LANES = int(os.getenv("WHATSAPP_WEBHOOK_STATUS_LANES", "2"))
+_WEBHOOK_STATUS_EXECUTORS = [
+    ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"wa-webhook-status-{i}")
+    for i in range(WEBHOOK_STATUS_LANES)
+]
+_WEBHOOK_STATUS_LANE_SLOTS = [
+    threading.BoundedSemaphore(WEBHOOK_LANE_QUEUE_MAX) for _ in range(WEBHOOK_STATUS_LANES)
+]
+
+# Every webhook is stored before it is acknowledged; receipts left
+# unfinished by a dead process are picked up and replayed by this loop.
+WEBHOOK_REPLAY_INTERVAL = int(os.getenv("WHATSAPP_WEBHOOK_REPLAY_INTERVAL", "60"))
+_webhook_replayer_started = False
+_webhook_replayer_lock = threading.Lock()
+
 
 # ============================================================
 # Helpers
@@ -146,37 +194,247 @@ def webhook_receive():
     
     POST /api/whatsapp/webhook
     
-    IMPORTANT: Always respond 200 OK immediately, then process.
+    IMPORTANT: Always respond 200 OK immediately, then process. The raw
+    body is stored first, so an acknowledged webhook survives a restart.
+    The only exception is 503 when the processing lanes are full or the
+    webhook could not be stored, so Meta retries.
     """
+    # Read the body once; the same bytes are verified, parsed and logged
+    raw_body = request.get_data(cache=False)
+    
     # Verify signature if app secret is configured
     signature = request.headers.get("X-Hub-Signature-256", "")
     app_secret = os.getenv("WHATSAPP_APP_SECRET", "")
     
     if app_secret:
-        if not verify_webhook_signature(request.data, signature, app_secret):
+        if not verify_webhook_signature(raw_body, signature, app_secret):
             logger.warning("Invalid webhook signature")
             # Still return 200 to prevent retries, but log the issue
             return "OK", 200
     
-    payload = request.get_json(silent=True)
+    try:
+        payload = orjson.loads(raw_body)
+    except ValueError:
+        payload = None
     
-    if not payload:
+    if not payload or not isinstance(payload, dict):
         return "OK", 200
     
-    # Process webhook (synchronous for Phase 1)
+    # Hand each entry to its phone number's lane; Meta only needs the 200
+    lane_payloads = _lane_payloads(payload)
+    if not _reserve_lanes(lane_payloads):
+        logger.warning("Webhook lanes full, asking Meta to retry")
+        return "Busy", 503
+    
     try:
-        processor = WebhookProcessor(get_db())
-        success, message = processor.process_webhook(payload)
-        
-        if not success:
-            logger.error(f"Webhook processing error: {message}")
+        receipt = store_webhook_receipt(raw_body)
     except Exception as e:
-        logger.exception(f"Webhook exception: {e}")
+        get_db().rollback()
+        _release_lanes(lane_payloads)
+        logger.exception(f"Failed to store webhook, asking Meta to retry: {e}")
+        return "Error", 503
+    
+    app = current_app._get_current_object()
+    _dispatch_webhook(app, lane_payloads, raw_body, receipt)
     
-    # Always return 200 OK
     return "OK", 200
 
 
+class _ReceiptTracker:
+    """Finishes a webhook receipt once every lane it fanned out to is done."""
+    
+    def __init__(self, receipt: WebhookReceipt, lanes: int):
+        self.receipt = receipt
+        self.remaining = lanes
+        self.errors: list = []
+        self.lock = threading.Lock()
+    
+    def lane_done(self, error: Optional[str]) -> None:
+        """Called inside the lane's app context."""
+        with self.lock:
+            if error:
+                self.errors.append(error)
+            self.remaining -= 1
+            if self.remaining:
+                return
+        try:
+            mark_webhook_receipt(self.receipt, "; ".join(self.errors) or None)
+        except Exception as e:
+            get_db().rollback()
+            logger.exception(f"Failed to mark webhook {self.receipt[0]} processed: {e}")
+
+
+def _dispatch_webhook(
+    app: Flask,
+    lane_payloads: Dict[Tuple[bool, int], dict],
+    raw_body: bytes,
+    receipt: WebhookReceipt,
+) -> None:
+    """Submit per-lane payloads whose slots were already reserved."""
+    tracker = _ReceiptTracker(receipt, len(lane_payloads))
+    for (is_status, lane), lane_payload in lane_payloads.items():
+        executors = _WEBHOOK_STATUS_EXECUTORS if is_status else _WEBHOOK_EXECUTORS
+        future = executors[lane].submit(_process_webhook_in_background, app, lane_payload, raw_body, tracker)
+        future.add_done_callback(lambda _future, slot=_lane_slot(is_status, lane): slot.release())
+
+
+def _lane_payloads(payload: dict) -> Dict[Tuple[bool, int], dict]:
+    """
+    Split a webhook into per-lane payloads, keyed by (is_status, lane).
+    
+    Malformed or empty webhooks go whole to message lane 0, where the
+    processor logs and rejects them.
+    """
+    entries = payload.get("entry")
+    if payload.get("object") != "whatsapp_business_account" or not entries:
+        return {(False, 0): payload}
+    
+    entries_by_lane: Dict[Tuple[bool, int], list] = {}
+    for entry in entries:
+        key = zlib.crc32(_entry_phone_number_id(entry).encode())
+        message_entry, status_entry = _split_entry(entry)
+        if message_entry is not None:
+            entries_by_lane.setdefault((False, key % WEBHOOK_LANES), []).append(message_entry)
+        if status_entry is not None:
+            entries_by_lane.setdefault((True, key % WEBHOOK_STATUS_LANES), []).append(status_entry)
+    return {lane: {**payload, "entry": lane_entries} for lane, lane_entries in entries_by_lane.items()}
+
+
+def _lane_slot(is_status: bool, lane: int) -> threading.BoundedSemaphore:
+    return (_WEBHOOK_STATUS_LANE_SLOTS if is_status else _WEBHOOK_LANE_SLOTS)[lane]
+
+
+def _reserve_lanes(lane_payloads: Dict[Tuple[bool, int], dict], blocking: bool = False) -> bool:
+    """Take a queue slot on every lane, or none of them if any lane is full."""
+    taken = []
+    for is_status, lane in lane_payloads:
+        slot = _lane_slot(is_status, lane)
+        if not slot.acquire(blocking=blocking):
+            for held in taken:
+                held.release()
+            return False
+        taken.append(slot)
+    return True
+
+
+def _release_lanes(lane_payloads: Dict[Tuple[bool, int], dict]) -> None:
+    for is_status, lane in lane_payloads:
+        _lane_slot(is_status, lane).release()
+
+
+def _entry_phone_number_id(entry: dict) -> str:
+    """phone_number_id of the entry's first change ("" if absent)."""
+    for change in entry.get("changes") or ():
+        metadata = (change.get("value") or {}).get("metadata") or {}
+        if metadata.get("phone_number_id"):
+            return str(metadata["phone_number_id"])
+    return ""
+
+
+def _split_entry(entry: dict) -> Tuple[Optional[dict], Optional[dict]]:
+    """
+    Split an entry into its message part and its status-receipt part.
+    
+    Either side is None when the entry carries nothing of that kind.
+    """
+    message_changes = []
+    status_changes = []
+    for change in entry.get("changes") or ():
+        value = change.get("value") or {}
+        if change.get("field") != "messages" or not value.get("statuses"):
+            message_changes.append(change)
+            continue
+        status_changes.append({**change, "value": {
+            "metadata": value.get("metadata") or {},
+            "statuses": value["statuses"],
+        }})
+        rest = {k: v for k, v in value.items() if k != "statuses"}
+        if rest.get("messages") or rest.get("errors"):
+            message_changes.append({**change, "value": rest})
+    
+    if not status_changes:
+        return entry, None
+    message_entry = {**entry, "changes": message_changes} if message_changes else None
+    return message_entry, {**entry, "changes": status_changes}
+
+
+def _process_webhook_in_background(
+    app: Flask,
+    payload: dict,
+    raw_body: bytes,
+    tracker: _ReceiptTracker,
+) -> None:
+    with app.app_context():
+        error = None
+        try:
+            session = get_db()
+            # This session is removed when the webhook is done, so nothing
+            # outlives it: skip expiring (and re-SELECTing) rows after commit
+            session().expire_on_commit = False
+            processor = WebhookProcessor(session)
+            success, message = processor.process_webhook(payload, raw_body=raw_body)
+            
+            if not success:
+                error = message
+                logger.error(f"Webhook processing error: {message}")
+        except Exception as e:
+            error = str(e)
+            logger.exception(f"Webhook exception: {e}")
+        finally:
+            tracker.lane_done(error)
+            get_db().remove()
+
+
+def _replay_lost_webhooks(app: Flask) -> None:
+    """Re-dispatch stored webhooks whose processing never finished."""
+    with app.app_context():
+        try:
+            claimed = claim_lost_webhook_receipts()
+        except Exception as e:
+            get_db().rollback()
+            logger.exception(f"Failed to claim lost webhooks: {e}")
+            return
+        finally:
+            get_db().remove()
+    
+    for receipt, raw_body in claimed:
+        logger.warning(f"Replaying unfinished webhook {receipt[0]}")
+        try:
+            payload = orjson.loads(raw_body)
+        except ValueError:
+            payload = None
+        if not payload or not isinstance(payload, dict):
+            payload = {}
+        lane_payloads = _lane_payloads(payload)
+        # Nothing waits on the replay loop, so it waits for lane room
+        _reserve_lanes(lane_payloads, blocking=True)
+        _dispatch_webhook(app, lane_payloads, raw_body, receipt)
+
+
+def _ensure_webhook_replayer(app: Flask) -> None:
+    global _webhook_replayer_started
+    if _webhook_replayer_started:
+        return
+    with _webhook_replayer_lock:
+        if _webhook_replayer_started:
+            return
+        _webhook_replayer_started = True
+    
+    def _loop():
+        while True:
+            time.sleep(WEBHOOK_REPLAY_INTERVAL)
+            _replay_lost_webhooks(app)
+    
+    threading.Thread(target=_loop, name="webhook-replayer", daemon=True).start()
+
+
+@whatsapp_bp.record_once
+def _start_webhook_replayer(state) -> None:
+    # Start with the app, not on the first webhook: receipts lost in a crash
+    # or deploy must be replayed even if Meta sends nothing else
+    _ensure_webhook_replayer(state.app)
+
+
 # ============================================================
 # Send Message Endpoints
 # ============================================================
@@ -24,9 +24,11 @@ import os
 import logging
 import json
 from datetime import datetime, timezone
-from typing import Optional, Dict, Any, List, Tuple
+from typing import Optional, Dict, Any, List, Sequence, Tuple
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 
 from models import db
 from .models import (
@@ -41,6 +43,22 @@ logger = logging.getLogger(__name__)
 WHATSAPP_API_BASE = "https://graph.facebook.com"
 
 
+def _build_shared_session() -> requests.Session:
+    """Keep-alive session reused by every service instance, so sends skip the TCP/TLS handshake."""
+    session = requests.Session()
+    session.mount(WHATSAPP_API_BASE, HTTPAdapter(pool_connections=32, pool_maxsize=100))
+    session.headers["Connection"] = "keep-alive"
+    return session
+
+
+_SHARED_SESSION = _build_shared_session()
+
+
+def _encode_payload(payload: Dict[str, Any]) -> bytes:
+    """Serialise an API payload once, with orjson."""
+    return orjson.dumps(payload)
+
+
 class WhatsAppService:
     """
     WhatsApp Cloud API messaging service.
@@ -55,6 +73,7 @@ class WhatsAppService:
         access_token: Optional[str] = None,
         waba_id: Optional[str] = None,
         workspace_id: Optional[str] = None,
+        session: Optional[requests.Session] = None,
     ):
         """
         Initialize WhatsApp service.
@@ -65,8 +84,10 @@ class WhatsAppService:
             access_token: Access token (falls back to stored account or env var)
             waba_id: WhatsApp Business Account ID (falls back to stored account or env var)
             workspace_id: Workspace ID to look up stored account (Phase-2)
+            session: HTTP session (optional, defaults to the shared pooled session)
         """
         self.db_session = db_session or db.session
+        self.http = session or _SHARED_SESSION
         self.api_version = os.getenv("WHATSAPP_API_VERSION", "v22.0")
         
         # Phase-2: Try to get stored account for workspace first
@@ -121,18 +142,22 @@ class WhatsAppService:
             API response dict with success status
         """
         try:
+            debug = logger.isEnabledFor(logging.DEBUG)
             logger.info(f"Sending WhatsApp API request to {self.api_url}")
-            logger.debug(f"Payload: {json.dumps(payload, indent=2)}")
+            if debug:
+                logger.debug(f"Payload: {json.dumps(payload, indent=2)}")
             
-            response = requests.post(
+            # Pre-encoded body; headers already carry Content-Type: application/json
+            response = self.http.post(
                 self.api_url,
                 headers=self.headers,
-                json=payload,
+                data=_encode_payload(payload),
                 timeout=30,
             )
             
             response_data = response.json()
-            logger.debug(f"Response: {json.dumps(response_data, indent=2)}")
+            if debug:
+                logger.debug(f"Response: {json.dumps(response_data, indent=2)}")
             
             if response.status_code == 200:
                 return {
@@ -336,6 +361,7 @@ class WhatsAppService:
         language_code: str = "en",
         components: Optional[List[Dict]] = None,
         waba_id: Optional[str] = None,
+        body_variables: Optional[Sequence[Any]] = None,
     ) -> Dict[str, Any]:
         """
         Send a template message.
@@ -351,12 +377,19 @@ class WhatsAppService:
             language_code: Language code (default: en)
             components: Template components (header, body, button params) - ONLY if template has variables
             waba_id: Optional WABA ID override
+            body_variables: Shortcut for body-only text parameters; ignored when components is given
             
         Returns:
             Response dict with success status
         """
         to = self._normalize_phone(to)
         
+        if body_variables and not components:
+            components = [{
+                "type": "body",
+                "parameters": [{"type": "text", "text": str(v)} for v in body_variables],
+            }]
+        
         # Build template object - EXACTLY matching Meta API format
         template_obj = {
             "name": template_name,
@@ -381,7 +414,8 @@ class WhatsAppService:
         
         # Log the exact payload being sent for debugging
         logger.info(f"Sending template '{template_name}' to {to}")
-        logger.debug(f"Template payload: {json.dumps(payload, indent=2)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Template payload: {json.dumps(payload, indent=2)}")
         
         # Get or create conversation
         conversation = self._get_or_create_conversation(to)
@@ -494,7 +528,8 @@ class WhatsAppService:
         
         # Log for debugging
         logger.info(f"Sending template '{template_name}' via builder to {to}")
-        logger.debug(f"Builder payload: {json.dumps(payload, indent=2)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Builder payload: {json.dumps(payload, indent=2)}")
         
         # Get or create conversation
         conversation = self._get_or_create_conversation(to)
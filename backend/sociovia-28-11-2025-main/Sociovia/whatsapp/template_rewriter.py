@@ -12,9 +12,37 @@ Includes "Explain Why" mode for transparency.
 
 import re
 import os
+import time
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import Future
 from dataclasses import dataclass, field
 from typing import List, Optional, Dict, Any
 import google.generativeai as genai
+from google.api_core.exceptions import DeadlineExceeded, ServiceUnavailable
+
+logger = logging.getLogger(__name__)
+
+# Gemini call limits - a hung call must not pin a worker
+GEMINI_TIMEOUT = 8.0        # Seconds per generate_content call
+GEMINI_RETRY_DELAY = 0.25   # Pause before the single retry on a transient error
+
+
+# Template placeholders: {{1}}, {{2}}, ...
+_VAR_RE = re.compile(r'\{\{\d+\}\}')
+
+# Promotional phrases that block a Marketing -> Utility rewrite
+PROMO_KEYWORDS = ("sale", "discount", "offer", "deal", "buy now", "limited time")
+
+# Single case-insensitive alternation: one scan instead of one per keyword
+_PROMO_RE = re.compile("|".join(re.escape(k) for k in PROMO_KEYWORDS), re.IGNORECASE)
+
+# In-flight Gemini calls: {prompt: Future}. Identical concurrent rewrites
+# wait on the first caller's result instead of issuing their own call.
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+INFLIGHT_WAIT_TIMEOUT = 30  # Max seconds a follower waits for the leader's call
 
 
 @dataclass
@@ -45,6 +73,88 @@ class RewriteMode:
     STRICT_AUTHENTICATION = "strict_authentication"  # OTP-only format
 
 
+# ==============================================================
+# Prompt Skeletons
+# ==============================================================
+
+CATEGORY_GUIDELINES = {
+    "UTILITY": """UTILITY templates must:
+- Be transactional/operational only (order updates, confirmations, reminders)
+- Have neutral, professional tone
+- NO promotional language (no "sale", "offer", "discount", "buy now")
+- NO emojis
+- NO call-to-action marketing verbs""",
+    "MARKETING": """MARKETING templates should:
+- Have clear, engaging promotional content
+- Include appropriate call-to-action
+- Can use emojis sparingly (1-3)
+- Be compelling but not spammy""",
+    "AUTHENTICATION": '''AUTHENTICATION templates must:
+- Focus ONLY on verification/OTP
+- Be extremely concise
+- NO promotional content
+- NO emojis
+- Format: "[Brand] Your code is {{1}}. Valid for X minutes."''',
+}
+
+MODE_INSTRUCTIONS = {
+    RewriteMode.NEUTRAL_UTILITY: "Rewrite to remove ALL promotional language while preserving the core informational content.",
+    RewriteMode.CLEAR_MARKETING: "Rewrite to be more engaging with a clear call-to-action.",
+    RewriteMode.STRICT_AUTHENTICATION: "Rewrite to focus ONLY on the verification code, removing any extra content.",
+}
+
+# Filled twice: category/guidelines/instruction at import, body/variables per call
+_PROMPT_TEMPLATE = """You are a WhatsApp template optimization expert. Rewrite this template for {category} category.
+
+ORIGINAL TEMPLATE:
+{{body}}
+
+CATEGORY REQUIREMENTS:
+{guidelines}
+
+REWRITE INSTRUCTION:
+{instruction}
+
+CRITICAL RULES:
+1. PRESERVE ALL VARIABLES EXACTLY: {{variables}}
+2. DO NOT add any markdown formatting (**, __, ~~, *, _)
+3. Keep the same language as the original
+4. Preserve the core informational content
+5. Do NOT change the fundamental purpose/intent
+
+RESPOND IN THIS EXACT FORMAT:
+REWRITTEN:
+[Your rewritten template here]
+
+CHANGES:
+- [Change 1]
+- [Change 2]
+- [Change 3]
+"""
+
+
+def _escape_braces(text: str) -> str:
+    """Escape literal braces so they survive the per-call str.format()."""
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+def _make_prompt_skeleton(target_category: str, mode: str) -> str:
+    """Render the static part of a prompt, leaving {body} and {variables} open."""
+    instruction = MODE_INSTRUCTIONS.get(mode, MODE_INSTRUCTIONS[RewriteMode.NEUTRAL_UTILITY])
+    return _PROMPT_TEMPLATE.format(
+        category=_escape_braces(str(target_category)),
+        guidelines=_escape_braces(CATEGORY_GUIDELINES.get(target_category, "")),
+        instruction=_escape_braces(instruction),
+    )
+
+
+_PROMPT_SKELETONS = {
+    (category, mode): _make_prompt_skeleton(category, mode)
+    for category in CATEGORY_GUIDELINES
+    for mode in MODE_INSTRUCTIONS
+}
+
+
 class TemplateRewriter:
     """
     AI-powered template rewriter using Gemini.
@@ -91,15 +201,14 @@ class TemplateRewriter:
                 error="AI service not configured. Set GEMINI_API_KEY environment variable."
             )
         
-        # Extract variables to preserve
-        variables = re.findall(r'\{\{\d+\}\}', body)
-        preserved_variables = list(set(variables))
+        # Extract variables to preserve (one pass, discovery order kept)
+        variable_counts = Counter(_VAR_RE.findall(body))
+        preserved_variables = list(variable_counts)
         
         # Check for intent mismatch that can't be fixed
         if current_category == "MARKETING" and target_category == "UTILITY":
             # Analyze if this is truly promotional
-            promo_keywords = ["sale", "discount", "offer", "deal", "buy now", "limited time"]
-            has_promo = any(k in body.lower() for k in promo_keywords)
+            has_promo = _PROMO_RE.search(body) is not None
             if has_promo:
                 return RewriteResult(
                     rewritten_body=body,
@@ -116,15 +225,13 @@ class TemplateRewriter:
         prompt = self._build_prompt(body, target_category, mode, preserved_variables)
         
         try:
-            response = self.model.generate_content(prompt)
-            result_text = response.text.strip()
+            result_text = self._generate(prompt)
             
             # Parse the response
             rewritten_body, changes_made = self._parse_response(result_text, body)
             
-            # Verify variables are preserved
-            new_variables = re.findall(r'\{\{\d+\}\}', rewritten_body)
-            if set(new_variables) != set(preserved_variables):
+            # Verify variables are preserved (including how often each appears)
+            if Counter(_VAR_RE.findall(rewritten_body)) != variable_counts:
                 # Variables were modified - restore original
                 return RewriteResult(
                     rewritten_body=body,
@@ -151,6 +258,47 @@ class TemplateRewriter:
                 error=f"AI rewrite failed: {str(e)}"
             )
     
+    def _generate(self, prompt: str) -> str:
+        """Call Gemini once per distinct in-flight prompt and share the text."""
+        with _inflight_lock:
+            future = _inflight.get(prompt)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                _inflight[prompt] = future
+        
+        if not is_leader:
+            return future.result(timeout=INFLIGHT_WAIT_TIMEOUT)
+        
+        try:
+            text = self._call_gemini(prompt)
+            future.set_result(text)
+            return text
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with _inflight_lock:
+                _inflight.pop(prompt, None)
+    
+    def _call_gemini(self, prompt: str) -> str:
+        """Call Gemini with a timeout, retrying once on a transient error."""
+        for attempt in range(2):
+            started = time.perf_counter()
+            try:
+                response = self.model.generate_content(
+                    prompt,
+                    request_options={"timeout": GEMINI_TIMEOUT},
+                )
+                return response.text.strip()
+            except (DeadlineExceeded, ServiceUnavailable):
+                if attempt:
+                    raise
+                logger.warning("Gemini rewrite call failed transiently, retrying once")
+                time.sleep(GEMINI_RETRY_DELAY)
+            finally:
+                logger.debug("Gemini rewrite attempt %d took %.3fs", attempt + 1, time.perf_counter() - started)
+    
     def _build_prompt(
         self,
         body: str,
@@ -158,68 +306,14 @@ class TemplateRewriter:
         mode: str,
         variables: List[str],
     ) -> str:
-        """Build the prompt for Gemini."""
-        
-        category_guidelines = {
-            "UTILITY": """
-UTILITY templates must:
-- Be transactional/operational only (order updates, confirmations, reminders)
-- Have neutral, professional tone
-- NO promotional language (no "sale", "offer", "discount", "buy now")
-- NO emojis
-- NO call-to-action marketing verbs
-""",
-            "MARKETING": """
-MARKETING templates should:
-- Have clear, engaging promotional content
-- Include appropriate call-to-action
-- Can use emojis sparingly (1-3)
-- Be compelling but not spammy
-""",
-            "AUTHENTICATION": """
-AUTHENTICATION templates must:
-- Focus ONLY on verification/OTP
-- Be extremely concise
-- NO promotional content
-- NO emojis
-- Format: "[Brand] Your code is {{1}}. Valid for X minutes."
-""",
-        }
-        
-        mode_instructions = {
-            RewriteMode.NEUTRAL_UTILITY: "Rewrite to remove ALL promotional language while preserving the core informational content.",
-            RewriteMode.CLEAR_MARKETING: "Rewrite to be more engaging with a clear call-to-action.",
-            RewriteMode.STRICT_AUTHENTICATION: "Rewrite to focus ONLY on the verification code, removing any extra content.",
-        }
-        
-        prompt = f"""You are a WhatsApp template optimization expert. Rewrite this template for {target_category} category.
-
-ORIGINAL TEMPLATE:
-{body}
-
-CATEGORY REQUIREMENTS:
-{category_guidelines.get(target_category, "")}
-
-REWRITE INSTRUCTION:
-{mode_instructions.get(mode, mode_instructions[RewriteMode.NEUTRAL_UTILITY])}
-
-CRITICAL RULES:
-1. PRESERVE ALL VARIABLES EXACTLY: {', '.join(variables) if variables else 'None'}
-2. DO NOT add any markdown formatting (**, __, ~~, *, _)
-3. Keep the same language as the original
-4. Preserve the core informational content
-5. Do NOT change the fundamental purpose/intent
-
-RESPOND IN THIS EXACT FORMAT:
-REWRITTEN:
-[Your rewritten template here]
-
-CHANGES:
-- [Change 1]
-- [Change 2]
-- [Change 3]
-"""
-        return prompt
+        """Build the prompt for Gemini from the precomputed skeleton."""
+        skeleton = _PROMPT_SKELETONS.get((target_category, mode))
+        if skeleton is None:
+            skeleton = _make_prompt_skeleton(target_category, mode)
+        return skeleton.format(
+            body=body,
+            variables=', '.join(variables) if variables else 'None',
+        )
     
     def _parse_response(self, response: str, original: str) -> tuple:
         """Parse Gemini response into rewritten body and changes."""
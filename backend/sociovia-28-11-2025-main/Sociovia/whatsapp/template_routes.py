@@ -13,20 +13,57 @@ Endpoints:
 """
 
 import logging
+import threading
+import time
+from bisect import bisect_right
+from collections import defaultdict
 from datetime import datetime, timezone
+from statistics import median
+from typing import Dict, Optional, Tuple
 from flask import Blueprint, request, jsonify
-from sqlalchemy import func
+from sqlalchemy import cast, func, select, update
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import load_only
 
 from models import db
 from .models import WhatsAppTemplate, WhatsAppAccount
 from .template_validator import validate_template, TemplateValidator, ApprovalPath
 from .template_rewriter import rewrite_template, RewriteMode
+from .utils import evict_oldest
 
 logger = logging.getLogger(__name__)
 
 # Blueprint for template routes
 template_bp = Blueprint("template_routes", __name__, url_prefix="/api/whatsapp/templates")
 
+# ============================================================
+# In-Memory Analytics Cache (Use Redis in Production)
+# ============================================================
+
+# Analytics cache: {(account_id, days, flag): (response_payload, timestamp)}
+# Keys come from query params, so the cache is capped; writers hold the lock.
+analytics_cache: Dict[Tuple[Optional[int], int, Optional[str]], Tuple[dict, float]] = {}
+_analytics_cache_lock = threading.Lock()
+
+# Configuration
+ANALYTICS_CACHE_TTL = 60      # Seconds a computed analytics payload is reused
+ANALYTICS_CACHE_MAX = 256     # Cached payloads before the oldest are dropped
+ANALYTICS_CLIENT_MAX_AGE = 30  # Cache-Control max-age sent to dashboards
+ANALYTICS_MAX_DAYS = 365       # Longest look-back the endpoint accepts
+
+
+def _cache_analytics(key: Tuple[Optional[int], int, Optional[str]], payload: dict, now: float) -> None:
+    with _analytics_cache_lock:
+        evict_oldest(analytics_cache, ANALYTICS_CACHE_MAX)
+        analytics_cache[key] = (payload, now)
+
+
+def _invalidate_analytics_cache(account_id: Optional[int]) -> None:
+    """Drop cached analytics for an account and for the all-accounts view."""
+    with _analytics_cache_lock:
+        for key in [k for k in analytics_cache if k[0] in (account_id, None)]:
+            analytics_cache.pop(key, None)
+
 
 # ==============================================================
 # POST /templates/validate
@@ -287,6 +324,9 @@ def create_template_endpoint():
         db.session.add(template)
         db.session.commit()
         
+        # New template changes the totals - drop stale analytics
+        _invalidate_analytics_cache(account_id)
+        
         # TODO: Actually submit to Meta API here
         # For now, we create the record and let polling check status
         
@@ -308,6 +348,26 @@ def create_template_endpoint():
 # GET /templates/<id>/status
 # ==============================================================
 
+APPROVED_STATUS_MESSAGE = "Template approved! Ready to send."
+REJECTED_STATUS_PREFIX = "Template rejected: "
+
+# Pending messages, longest threshold first: (min pending seconds, message)
+PENDING_STATUS_MESSAGES = (
+    (60, "Meta is performing extended automated checks. This is normal for new or modified templates."),
+    (30, "Under automated review (usually completes shortly)"),
+)
+PENDING_DEFAULT_MESSAGE = "Running automated approval checks..."
+
+
+def _pending_status_message(pending_seconds: Optional[float]) -> str:
+    """Pick the status message for a template still awaiting review."""
+    if pending_seconds:
+        for threshold, message in PENDING_STATUS_MESSAGES:
+            if pending_seconds > threshold:
+                return message
+    return PENDING_DEFAULT_MESSAGE
+
+
 @template_bp.route("/<int:template_id>/status", methods=["GET"])
 def get_template_status(template_id):
     """
@@ -323,7 +383,23 @@ def get_template_status(template_id):
     }
     """
     try:
-        template = WhatsAppTemplate.query.get(template_id)
+        # Polled every few seconds - only load the columns we report
+        template = db.session.execute(
+            select(WhatsAppTemplate)
+            .options(load_only(
+                WhatsAppTemplate.id,
+                WhatsAppTemplate.status,
+                WhatsAppTemplate.rejection_reason,
+                WhatsAppTemplate.confidence_initial,
+                WhatsAppTemplate.confidence_post_submit,
+                WhatsAppTemplate.submitted_at,
+                WhatsAppTemplate.approved_at,
+                WhatsAppTemplate.approval_duration_seconds,
+                WhatsAppTemplate.approval_path,
+                WhatsAppTemplate.approval_outcome_reason,
+            ))
+            .where(WhatsAppTemplate.id == template_id)
+        ).scalar_one_or_none()
         if not template:
             return jsonify({"error": "Template not found"}), 404
         
@@ -333,31 +409,37 @@ def get_template_status(template_id):
             pending_seconds = (datetime.now(timezone.utc) - template.submitted_at).total_seconds()
         
         # Update confidence_post_submit if still pending
+        confidence_post_submit = template.confidence_post_submit
         if template.status == "PENDING" and pending_seconds:
             # Recalculate confidence based on pending duration
             if pending_seconds > 30 and template.confidence_initial:
                 # Slightly lower confidence if taking longer than expected
                 drift = min(15, int(pending_seconds / 30) * 5)
-                template.confidence_post_submit = max(50, template.confidence_initial - drift)
-                db.session.commit()
+                drifted = max(50, template.confidence_initial - drift)
+                if drifted != confidence_post_submit:
+                    # Direct UPDATE - skips the ORM flush on the polling path
+                    db.session.execute(
+                        update(WhatsAppTemplate)
+                        .where(WhatsAppTemplate.id == template_id)
+                        .values(confidence_post_submit=drifted)
+                        .execution_options(synchronize_session=False)
+                    )
+                    db.session.commit()
+                    confidence_post_submit = drifted
         
         # Build response message based on status and duration
         if template.status == "APPROVED":
-            message = "Template approved! Ready to send."
+            message = APPROVED_STATUS_MESSAGE
         elif template.status == "REJECTED":
-            message = f"Template rejected: {template.rejection_reason or 'Unknown reason'}"
-        elif pending_seconds and pending_seconds > 60:
-            message = "Meta is performing extended automated checks. This is normal for new or modified templates."
-        elif pending_seconds and pending_seconds > 30:
-            message = "Under automated review (usually completes shortly)"
+            message = REJECTED_STATUS_PREFIX + (template.rejection_reason or "Unknown reason")
         else:
-            message = "Running automated approval checks..."
+            message = _pending_status_message(pending_seconds)
         
         return jsonify({
             "id": template.id,
             "status": template.status,
             "confidence_initial": template.confidence_initial,
-            "confidence_post_submit": template.confidence_post_submit,
+            "confidence_post_submit": confidence_post_submit,
             "pending_seconds": int(pending_seconds) if pending_seconds else None,
             "approval_duration_seconds": template.approval_duration_seconds,
             "approval_path": template.approval_path,
@@ -383,7 +465,8 @@ def get_template_analytics():
     
     Query Params:
     - account_id (optional): Filter by account
-    - days (optional): Days to look back (default 30)
+    - days (optional): Days to look back (default 30, 1-365)
+    - flag (optional): Only templates whose validation_flags contain this risk flag
     
     Response:
     {
@@ -398,115 +481,143 @@ def get_template_analytics():
     """
     try:
         account_id = request.args.get("account_id", type=int)
-        days = request.args.get("days", 30, type=int)
-        
-        # Base query
-        query = WhatsAppTemplate.query
+        days = min(max(request.args.get("days", 30, type=int), 1), ANALYTICS_MAX_DAYS)
         
-        if account_id:
-            query = query.filter_by(account_id=account_id)
+        flag = request.args.get("flag") or None
         
-        # Date filter
-        cutoff = datetime.now(timezone.utc) - timedelta(days=days)
-        query = query.filter(WhatsAppTemplate.created_at >= cutoff)
+        # Serve from cache while fresh - dashboards poll this endpoint
+        cache_key = (account_id, days, flag)
+        now = time.monotonic()
+        cached = analytics_cache.get(cache_key)
+        if cached and now - cached[1] < ANALYTICS_CACHE_TTL:
+            return _analytics_response(cached[0])
         
-        templates = query.all()
+        payload = _compute_template_analytics(account_id, days, flag)
+        _cache_analytics(cache_key, payload, now)
         
-        if not templates:
-            return jsonify({
-                "total_templates": 0,
-                "message": "No templates found in the specified period"
-            }), 200
-        
-        # Calculate metrics
-        total = len(templates)
-        approved = [t for t in templates if t.status == "APPROVED"]
-        rejected = [t for t in templates if t.status == "REJECTED"]
-        pending = [t for t in templates if t.status == "PENDING"]
-        
-        approval_rate = len(approved) / total if total > 0 else 0
-        
-        # Average approval time
-        approval_times = [t.approval_duration_seconds for t in approved if t.approval_duration_seconds]
-        avg_approval_seconds = sum(approval_times) / len(approval_times) if approval_times else None
-        
-        # Fast vs slow approvals
-        fast_approvals = len([t for t in approved if t.approval_duration_seconds and t.approval_duration_seconds <= 60])
-        slow_approvals = len([t for t in approved if t.approval_duration_seconds and t.approval_duration_seconds > 120])
-        
-        # By category
-        by_category = {}
-        for cat in ["UTILITY", "MARKETING", "AUTHENTICATION"]:
-            cat_templates = [t for t in templates if t.category == cat]
-            cat_approved = [t for t in cat_templates if t.status == "APPROVED"]
-            by_category[cat] = {
-                "total": len(cat_templates),
-                "approved": len(cat_approved),
-                "approval_rate": len(cat_approved) / len(cat_templates) if cat_templates else 0,
-            }
-        
-        # By outcome reason
-        by_outcome_reason = {}
-        for t in templates:
-            reason = t.approval_outcome_reason or "UNKNOWN"
-            if reason not in by_outcome_reason:
-                by_outcome_reason[reason] = 0
-            by_outcome_reason[reason] += 1
-        
-        # Median approval time
-        median_approval_seconds = None
-        if approval_times:
-            sorted_times = sorted(approval_times)
-            mid = len(sorted_times) // 2
-            if len(sorted_times) % 2 == 0:
-                median_approval_seconds = (sorted_times[mid - 1] + sorted_times[mid]) / 2
-            else:
-                median_approval_seconds = sorted_times[mid]
-        
-        # Percentile breakdown (sales gold)
-        percentile_breakdown = {
-            "under_10s": 0,
-            "under_30s": 0,
-            "under_2min": 0,
-            "over_2min": 0,
-        }
-        for t in approved:
-            if t.approval_duration_seconds:
-                if t.approval_duration_seconds < 10:
-                    percentile_breakdown["under_10s"] += 1
-                elif t.approval_duration_seconds < 30:
-                    percentile_breakdown["under_30s"] += 1
-                elif t.approval_duration_seconds < 120:
-                    percentile_breakdown["under_2min"] += 1
-                else:
-                    percentile_breakdown["over_2min"] += 1
-        
-        # Calculate percentages
-        approved_count = len(approved)
-        percentile_percent = {}
-        for key, count in percentile_breakdown.items():
-            percentile_percent[key] = round((count / approved_count * 100), 1) if approved_count > 0 else 0
-        
-        return jsonify({
-            "total_templates": total,
-            "approved": len(approved),
-            "rejected": len(rejected),
-            "pending": len(pending),
-            "approval_rate": round(approval_rate, 2),
-            "avg_approval_seconds": int(avg_approval_seconds) if avg_approval_seconds else None,
-            "median_approval_seconds": int(median_approval_seconds) if median_approval_seconds else None,
-            "fast_approvals": fast_approvals,
-            "slow_approvals": slow_approvals,
-            "percentile_breakdown": percentile_breakdown,
-            "percentile_percent": percentile_percent,
-            "by_category": by_category,
-            "by_outcome_reason": by_outcome_reason,
-        }), 200
+        return _analytics_response(payload)
         
     except Exception as e:
         logger.exception("Template analytics error")
         return jsonify({"error": str(e)}), 500
 
 
+def _analytics_response(payload: dict):
+    """Serialize an analytics payload with client-side cache headers."""
+    response = jsonify(payload)
+    response.headers["Cache-Control"] = f"private, max-age={ANALYTICS_CLIENT_MAX_AGE}"
+    return response, 200
+
+
+# Approval-time buckets: exclusive upper bounds in seconds, and one key per bucket
+PERCENTILE_BOUNDS = (10, 30, 120)
+PERCENTILE_KEYS = ("under_10s", "under_30s", "under_2min", "over_2min")
+
+
+def _compute_template_analytics(account_id: Optional[int], days: int, flag: Optional[str] = None) -> dict:
+    """Run the analytics query and aggregate the results."""
+    # Base query
+    query = WhatsAppTemplate.query
+    
+    if account_id:
+        query = query.filter_by(account_id=account_id)
+    
+    # Date filter
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    query = query.filter(WhatsAppTemplate.created_at >= cutoff)
+    
+    # Risk flag filter - JSONB containment, served by the GIN index
+    if flag:
+        query = query.filter(WhatsAppTemplate.validation_flags.op("@>")(cast([flag], JSONB)))
+    
+    templates = query.all()
+    
+    if not templates:
+        return {
+            "total_templates": 0,
+            "message": "No templates found in the specified period"
+        }
+    
+    # Calculate metrics in a single pass over the templates
+    total = len(templates)
+    approved_count = 0
+    rejected_count = 0
+    pending_count = 0
+    fast_approvals = 0
+    slow_approvals = 0
+    approval_times = []
+    category_counts = {cat: {"total": 0, "approved": 0} for cat in ["UTILITY", "MARKETING", "AUTHENTICATION"]}
+    by_outcome_reason = defaultdict(int)
+    
+    # Percentile breakdown (sales gold), indexed like PERCENTILE_KEYS
+    bucket_counts = [0] * len(PERCENTILE_KEYS)
+    
+    for t in templates:
+        status = t.status
+        cat_counts = category_counts.get(t.category)
+        if cat_counts is not None:
+            cat_counts["total"] += 1
+        by_outcome_reason[t.approval_outcome_reason or "UNKNOWN"] += 1
+        
+        if status == "APPROVED":
+            approved_count += 1
+            if cat_counts is not None:
+                cat_counts["approved"] += 1
+            
+            duration = t.approval_duration_seconds
+            if duration:
+                approval_times.append(duration)
+                if duration <= 60:
+                    fast_approvals += 1
+                elif duration > 120:
+                    slow_approvals += 1
+                bucket_counts[bisect_right(PERCENTILE_BOUNDS, duration)] += 1
+        elif status == "REJECTED":
+            rejected_count += 1
+        elif status == "PENDING":
+            pending_count += 1
+    
+    approval_rate = approved_count / total if total > 0 else 0
+    
+    # Average approval time
+    avg_approval_seconds = sum(approval_times) / len(approval_times) if approval_times else None
+    
+    # By category
+    by_category = {
+        cat: {
+            "total": counts["total"],
+            "approved": counts["approved"],
+            "approval_rate": counts["approved"] / counts["total"] if counts["total"] else 0,
+        }
+        for cat, counts in category_counts.items()
+    }
+    
+    # Median approval time
+    median_approval_seconds = median(approval_times) if approval_times else None
+    
+    percentile_breakdown = dict(zip(PERCENTILE_KEYS, bucket_counts))
+    
+    # Calculate percentages
+    percentile_percent = {}
+    for key, count in percentile_breakdown.items():
+        percentile_percent[key] = round((count / approved_count * 100), 1) if approved_count > 0 else 0
+    
+    return {
+        "total_templates": total,
+        "approved": approved_count,
+        "rejected": rejected_count,
+        "pending": pending_count,
+        "approval_rate": round(approval_rate, 2),
+        "avg_approval_seconds": int(avg_approval_seconds) if avg_approval_seconds else None,
+        "median_approval_seconds": int(median_approval_seconds) if median_approval_seconds else None,
+        "fast_approvals": fast_approvals,
+        "slow_approvals": slow_approvals,
+        "percentile_breakdown": percentile_breakdown,
+        "percentile_percent": percentile_percent,
+        "by_category": by_category,
+        "by_outcome_reason": dict(by_outcome_reason),
+    }
+
+
 # Import timedelta for analytics
 from datetime import timedelta
@@ -12,10 +12,13 @@ Rules based on Meta's automated approval criteria:
 """
 
 import re
-from dataclasses import dataclass, field
-from typing import List, Optional, Dict, Any
+from dataclasses import dataclass, field, fields
+from operator import attrgetter
+from typing import List, Optional, Dict, Any, Set
 from enum import Enum
 
+import ahocorasick
+
 
 class ApprovalPath(str, Enum):
     """Predicted approval path from Meta."""
@@ -40,7 +43,7 @@ class DetectedIntent(str, Enum):
     UNCLEAR = "UNCLEAR"
 
 
-@dataclass
+@dataclass(slots=True)
 class ValidationResult:
     """Result of template validation."""
     confidence_score: int  # 0-100
@@ -53,16 +56,12 @@ class ValidationResult:
     intent_mismatch_message: Optional[str] = None
     
     def to_dict(self) -> Dict[str, Any]:
-        return {
-            "confidence_score": self.confidence_score,
-            "risk_flags": self.risk_flags,
-            "approval_path": self.approval_path,
-            "detected_intent": self.detected_intent,
-            "suggestions": self.suggestions,
-            "show_fast_path_badge": self.show_fast_path_badge,
-            "intent_mismatch": self.intent_mismatch,
-            "intent_mismatch_message": self.intent_mismatch_message,
-        }
+        return dict(zip(_RESULT_FIELDS, _get_result_fields(self)))
+
+
+# Serialised field order for ValidationResult.to_dict()
+_RESULT_FIELDS = tuple(f.name for f in fields(ValidationResult))
+_get_result_fields = attrgetter(*_RESULT_FIELDS)
 
 
 # ==============================================================
@@ -70,27 +69,147 @@ class ValidationResult:
 # ==============================================================
 
 # Promotional/Marketing keywords that should NOT appear in Utility
-PROMOTIONAL_KEYWORDS = [
+PROMOTIONAL_KEYWORDS = (
     "limited time", "don't miss", "hurry", "act now", "exclusive",
     "sale", "discount", "offer", "deal", "promo", "save", "free",
     "buy now", "shop now", "order now", "get yours", "grab",
     "special", "bonus", "reward", "gift", "win", "prize",
     "% off", "half price", "clearance", "flash", "today only",
-]
+)
 
 # CTA verbs that trigger marketing intent
-CTA_VERBS = [
+CTA_VERBS = (
     "buy", "shop", "order", "subscribe", "sign up", "register",
     "download", "get started", "try", "claim", "redeem",
     "explore", "discover", "learn more", "find out",
-]
+)
+
+# Utility indicators used for intent detection
+UTILITY_KEYWORDS = (
+    "order status", "tracking", "invoice", "receipt", "appointment",
+    "booking confirmed", "shipment", "delivery update", "payment received",
+    "reminder", "scheduled", "confirmation",
+)
+
+# Non-verification content that should NOT appear in Authentication
+NON_AUTH_KEYWORDS = ("order", "delivery", "payment", "invoice", "product")
 
 # OTP/Authentication patterns
-AUTH_PATTERNS = [
+AUTH_PATTERNS = (
     r'\b\d{4,6}\b',  # 4-6 digit codes
     r'otp', r'verification code', r'one.?time.?password',
     r'verify', r'confirm your', r'security code',
-]
+)
+
+# Button types allowed in Authentication templates
+AUTH_BUTTON_TYPES = frozenset({"COPY_CODE"})
+
+# Precompiled patterns (compiled once at import, not per validate() call)
+VAR_RE = re.compile(r'\{\{(\d+)\}\}')
+MARKDOWN_RE = re.compile(r'\*\*|__|~~')
+EMOJI_RE = re.compile(
+    "["
+    "\U0001F600-\U0001F64F"  # emoticons
+    "\U0001F300-\U0001F5FF"  # symbols & pictographs
+    "\U0001F680-\U0001F6FF"  # transport & map symbols
+    "\U0001F1E0-\U0001F1FF"  # flags
+    "]+"
+)
+# One alternation instead of a search per pattern; matched against lowercased text
+AUTH_COMBINED = re.compile("|".join(AUTH_PATTERNS))
+
+# Keyword groups matched by a single Aho-Corasick pass over the text
+KEYWORD_GROUPS = {
+    "promo": PROMOTIONAL_KEYWORDS,
+    "cta": CTA_VERBS,
+    "utility": UTILITY_KEYWORDS,
+    "nonauth": NON_AUTH_KEYWORDS,
+}
+
+
+def _build_keyword_automaton() -> "ahocorasick.Automaton":
+    """Build one automaton for every keyword, tagged with its groups."""
+    groups_by_keyword: Dict[str, List[str]] = {}
+    for group, keywords in KEYWORD_GROUPS.items():
+        for keyword in keywords:
+            groups_by_keyword.setdefault(keyword, []).append(group)
+    
+    automaton = ahocorasick.Automaton()
+    for keyword, groups in groups_by_keyword.items():
+        automaton.add_word(keyword, (keyword, tuple(groups)))
+    automaton.make_automaton()
+    return automaton
+
+
+KEYWORD_AC = _build_keyword_automaton()
+
+
+@dataclass
+class ScanResult:
+    """Everything the validators need from one pre-pass over the template text."""
+    promo_hits: Set[str]      # Promotional keywords in header/body/footer
+    cta_hits: Set[str]        # CTA verbs in header/body/footer
+    utility_hits: Set[str]    # Utility indicators in header/body/footer
+    nonauth_hits: Set[str]    # Non-auth keywords in the body
+    auth_hit: bool            # OTP/verification pattern in header/body/footer
+    body_auth_hit: bool       # OTP/verification pattern in the body
+    emoji_runs: int           # Runs of consecutive emojis in the body
+    markdown_present: bool    # **, __ or ~~ in the body
+    variables: List[int]      # {{N}} placeholder numbers in the body, in order
+    var_at_start: bool        # Stripped body starts with "{{" (only set when variables exist)
+    var_at_end: bool          # Stripped body ends with "}}" (only set when variables exist)
+
+
+def _scan_once(body: str, header: Optional[str], footer: Optional[str]) -> ScanResult:
+    """Run every keyword/regex scan the validators need exactly once."""
+    body_lower = body.lower()
+    
+    # Keyword hits - each segment is scanned on its own, so no joined copy of
+    # header/body/footer is built; non-auth keywords only count in the body.
+    # Phrases only form inside a segment: body "... today" + footer "only ..."
+    # is not "today only" (the old joined full_text scan counted those).
+    hits: Dict[str, Set[str]] = {group: set() for group in KEYWORD_GROUPS}
+    for _, (keyword, groups) in KEYWORD_AC.iter(body_lower):
+        for group in groups:
+            hits[group].add(keyword)
+    
+    body_auth_hit = AUTH_COMBINED.search(body_lower) is not None
+    auth_hit = body_auth_hit
+    
+    for segment in (header, footer):
+        if not segment:
+            continue
+        segment_lower = segment.lower()
+        for _, (keyword, groups) in KEYWORD_AC.iter(segment_lower):
+            for group in groups:
+                if group != "nonauth":
+                    hits[group].add(keyword)
+        if not auth_hit:
+            auth_hit = AUTH_COMBINED.search(segment_lower) is not None
+    
+    # Placeholders - plain substring check skips the regex for variable-free bodies
+    variables: List[int] = []
+    var_at_start = var_at_end = False
+    if "{{" in body:
+        variables = [int(v) for v in VAR_RE.findall(body)]
+        if variables:
+            stripped = body.strip()
+            var_at_start = stripped.startswith("{{")
+            var_at_end = stripped.endswith("}}")
+    
+    return ScanResult(
+        promo_hits=hits["promo"],
+        cta_hits=hits["cta"],
+        utility_hits=hits["utility"],
+        nonauth_hits=hits["nonauth"],
+        auth_hit=auth_hit,
+        body_auth_hit=body_auth_hit,
+        emoji_runs=len(EMOJI_RE.findall(body)),
+        markdown_present=MARKDOWN_RE.search(body) is not None,
+        variables=variables,
+        var_at_start=var_at_start,
+        var_at_end=var_at_end,
+    )
 
 
 class TemplateValidator:
@@ -129,14 +248,22 @@ class TemplateValidator:
         suggestions: List[str] = []
         
         category = category.upper()
-        full_text = f"{header or ''} {body} {footer or ''}".lower()
+        scan = _scan_once(body, header, footer)
+        
+        if self._is_fast_path(scan, body, category, buttons, urls):
+            return ValidationResult(
+                confidence_score=100,
+                approval_path=ApprovalPath.AUTOMATED_FAST.value,
+                detected_intent=self._detect_intent(scan, buttons),
+                show_fast_path_badge=True,
+            )
         
         # ============================================================
         # UNIVERSAL RULES (All Categories)
         # ============================================================
         
         # 1. Check variable format (must be sequential {{1}}, {{2}})
-        var_score, var_flags, var_suggestions = self._check_variables(body)
+        var_score, var_flags, var_suggestions = self._check_variables(scan)
         score += var_score
         flags.extend(var_flags)
         suggestions.extend(var_suggestions)
@@ -154,7 +281,7 @@ class TemplateValidator:
             score += 5
         
         # 4. Check for markdown (not allowed)
-        if re.search(r'\*\*|__|~~', body):
+        if scan.markdown_present:
             score -= 15
             flags.append("MARKDOWN_DETECTED")
             suggestions.append("Remove markdown formatting (**, __, ~~)")
@@ -165,7 +292,7 @@ class TemplateValidator:
         
         if category == TemplateCategory.UTILITY.value:
             cat_score, cat_flags, cat_suggestions = self._validate_utility(
-                body, full_text, buttons
+                scan, buttons
             )
             score += cat_score
             flags.extend(cat_flags)
@@ -173,7 +300,7 @@ class TemplateValidator:
             
         elif category == TemplateCategory.MARKETING.value:
             cat_score, cat_flags, cat_suggestions = self._validate_marketing(
-                body, full_text, buttons
+                scan, buttons
             )
             score += cat_score
             flags.extend(cat_flags)
@@ -181,7 +308,7 @@ class TemplateValidator:
             
         elif category == TemplateCategory.AUTHENTICATION.value:
             cat_score, cat_flags, cat_suggestions = self._validate_authentication(
-                body, buttons, urls
+                scan, buttons, urls
             )
             score += cat_score
             flags.extend(cat_flags)
@@ -191,7 +318,7 @@ class TemplateValidator:
         # INTENT DETECTION & MISMATCH CHECK
         # ============================================================
         
-        detected_intent = self._detect_intent(full_text, buttons)
+        detected_intent = self._detect_intent(scan, buttons)
         intent_mismatch = False
         intent_mismatch_message = None
         
@@ -242,51 +369,74 @@ class TemplateValidator:
             intent_mismatch_message=intent_mismatch_message,
         )
     
-    def _check_variables(self, body: str) -> tuple:
+    def _is_fast_path(
+        self,
+        scan: ScanResult,
+        body: str,
+        category: str,
+        buttons: Optional[List],
+        urls: Optional[List],
+    ) -> bool:
+        """
+        True when no rule can deduct or flag, so the full pipeline would end at
+        score 100 / AUTOMATED_FAST with no flags or suggestions.
+        
+        Clean Utility content can never be detected as Marketing (no promo/CTA
+        hits), so the intent mismatch check cannot fire either.
+        """
+        if scan.variables or scan.markdown_present or len(body) > 300:
+            return False
+        
+        if category == TemplateCategory.UTILITY.value:
+            return not (scan.promo_hits or scan.cta_hits or scan.emoji_runs)
+        
+        if category == TemplateCategory.AUTHENTICATION.value:
+            return (
+                scan.body_auth_hit
+                and not scan.nonauth_hits
+                and not urls
+                and not (buttons and any(b.get("type", "").upper() not in AUTH_BUTTON_TYPES for b in buttons))
+            )
+        
+        return False
+    
+    def _check_variables(self, scan: ScanResult) -> tuple:
         """Check variable format and placement."""
         score = 0
         flags = []
         suggestions = []
         
-        # Find all variables
-        variables = re.findall(r'\{\{(\d+)\}\}', body)
+        variables = scan.variables
         
         if variables:
             # Check if sequential (1, 2, 3...)
-            expected = list(range(1, len(variables) + 1))
-            actual = [int(v) for v in variables]
-            
-            if actual != expected:
+            if any(number != position for position, number in enumerate(variables, 1)):
                 score -= 20
                 flags.append("NON_SEQUENTIAL_VARIABLES")
-                suggestions.append(f"Variables must be sequential: {{{{1}}}}, {{{{2}}}}, etc. Found: {actual}")
+                suggestions.append(f"Variables must be sequential: {{{{1}}}}, {{{{2}}}}, etc. Found: {variables}")
             
             # CRITICAL: Variable at start (Meta rejects this)
-            stripped = body.strip()
-            if stripped.startswith("{{"):
+            if scan.var_at_start:
                 score -= 50  # Critical - blocks submission
                 flags.append("VARIABLE_AT_START")
                 suggestions.append("⚠️ BLOCKED: Variables cannot be at the start of the template (Meta rejects this)")
             
             # CRITICAL: Variable at end (Meta rejects this)
-            if stripped.endswith("}}"):
+            if scan.var_at_end:
                 score -= 50  # Critical - blocks submission
                 flags.append("VARIABLE_AT_END")
                 suggestions.append("⚠️ BLOCKED: Variables cannot be at the end of the template (Meta rejects this). Add text after the variable, e.g. 'Reference: {{1}}.'")
         
         return score, flags, suggestions
     
-    def _validate_utility(self, body: str, full_text: str, buttons: Optional[List]) -> tuple:
+    def _validate_utility(self, scan: ScanResult, buttons: Optional[List]) -> tuple:
         """Validate Utility template rules."""
         score = 0
         flags = []
         suggestions = []
         
         # Check for promotional keywords (NOT allowed in Utility)
-        found_promo = []
-        for keyword in PROMOTIONAL_KEYWORDS:
-            if keyword in full_text:
-                found_promo.append(keyword)
+        found_promo = [k for k in PROMOTIONAL_KEYWORDS if k in scan.promo_hits]
         
         if found_promo:
             score -= 30
@@ -294,22 +444,13 @@ class TemplateValidator:
             suggestions.append(f"Remove promotional words for Utility: {', '.join(found_promo[:3])}")
         
         # Check for emojis (discouraged in Utility)
-        emoji_pattern = re.compile(
-            "["
-            "\U0001F600-\U0001F64F"  # emoticons
-            "\U0001F300-\U0001F5FF"  # symbols & pictographs
-            "\U0001F680-\U0001F6FF"  # transport & map symbols
-            "\U0001F1E0-\U0001F1FF"  # flags
-            "]+", 
-            flags=re.UNICODE
-        )
-        if emoji_pattern.search(body):
+        if scan.emoji_runs:
             score -= 25
             flags.append("EMOJI_IN_UTILITY")
             suggestions.append("Remove emojis from Utility templates for faster approval")
         
         # Check for CTA verbs
-        found_cta = [v for v in CTA_VERBS if v in full_text]
+        found_cta = [v for v in CTA_VERBS if v in scan.cta_hits]
         if found_cta:
             score -= 20
             flags.append("CTA_IN_UTILITY")
@@ -317,7 +458,7 @@ class TemplateValidator:
         
         return score, flags, suggestions
     
-    def _validate_marketing(self, body: str, full_text: str, buttons: Optional[List]) -> tuple:
+    def _validate_marketing(self, scan: ScanResult, buttons: Optional[List]) -> tuple:
         """Validate Marketing template rules."""
         score = 0
         flags = []
@@ -325,106 +466,69 @@ class TemplateValidator:
         
         # Marketing templates are more lenient
         # Check for required elements
-        has_cta = any(v in full_text for v in CTA_VERBS)
+        has_cta = bool(scan.cta_hits)
         
         if not has_cta and not buttons:
             suggestions.append("Consider adding a clear call-to-action for better engagement")
         
         # Excessive emojis warning
-        emoji_pattern = re.compile(
-            "["
-            "\U0001F600-\U0001F64F"
-            "\U0001F300-\U0001F5FF"
-            "\U0001F680-\U0001F6FF"
-            "\U0001F1E0-\U0001F1FF"
-            "]+"
-        )
-        emoji_count = len(emoji_pattern.findall(body))
-        if emoji_count > 5:
+        if scan.emoji_runs > 5:
             score -= 10
             flags.append("EXCESSIVE_EMOJIS")
             suggestions.append("Reduce emoji count for professional appearance")
         
         return score, flags, suggestions
     
-    def _validate_authentication(self, body: str, buttons: Optional[List], urls: Optional[List]) -> tuple:
+    def _validate_authentication(self, scan: ScanResult, buttons: Optional[List], urls: Optional[List]) -> tuple:
         """Validate Authentication template rules."""
         score = 0
         flags = []
         suggestions = []
         
-        body_lower = body.lower()
-        
         # Must contain OTP/verification pattern
-        has_auth_pattern = any(re.search(p, body_lower) for p in AUTH_PATTERNS)
-        if not has_auth_pattern:
+        if not scan.body_auth_hit:
             score -= 40
             flags.append("MISSING_OTP_PATTERN")
             suggestions.append("Authentication templates must contain verification code or OTP")
         
-        # No buttons allowed
-        if buttons and len(buttons) > 0:
-            # Only copy-code button is allowed
-            non_copy_buttons = [b for b in buttons if b.get("type", "").upper() != "COPY_CODE"]
-            if non_copy_buttons:
+        # No buttons allowed (only copy-code button is allowed)
+        if buttons:
+            if any(b.get("type", "").upper() not in AUTH_BUTTON_TYPES for b in buttons):
                 score -= 30
                 flags.append("BUTTONS_IN_AUTH")
                 suggestions.append("Remove buttons from Authentication templates (only Copy Code allowed)")
         
         # No URLs allowed
-        if urls and len(urls) > 0:
+        if urls:
             score -= 30
             flags.append("URLS_IN_AUTH")
             suggestions.append("Remove URLs from Authentication templates")
         
         # Check for non-auth content
-        non_auth_keywords = ["order", "delivery", "payment", "invoice", "product"]
-        found = [k for k in non_auth_keywords if k in body_lower]
-        if found:
+        if scan.nonauth_hits:
             score -= 20
             flags.append("NON_AUTH_CONTENT")
             suggestions.append("Authentication templates should only contain verification/OTP content")
         
         return score, flags, suggestions
     
-    def _detect_intent(self, full_text: str, buttons: Optional[List]) -> str:
+    def _detect_intent(self, scan: ScanResult, buttons: Optional[List]) -> str:
         """Detect the actual intent of the template content."""
-        scores = {
-            DetectedIntent.UTILITY.value: 0,
-            DetectedIntent.MARKETING.value: 0,
-            DetectedIntent.AUTHENTICATION.value: 0,
-        }
-        
-        # Check for auth patterns
-        if any(re.search(p, full_text) for p in AUTH_PATTERNS):
-            scores[DetectedIntent.AUTHENTICATION.value] += 50
-        
-        # Check for promotional keywords
-        promo_count = sum(1 for k in PROMOTIONAL_KEYWORDS if k in full_text)
-        if promo_count > 0:
-            scores[DetectedIntent.MARKETING.value] += promo_count * 15
-        
-        # Check for CTA verbs
-        cta_count = sum(1 for v in CTA_VERBS if v in full_text)
-        if cta_count > 0:
-            scores[DetectedIntent.MARKETING.value] += cta_count * 10
-        
-        # Utility indicators
-        utility_keywords = [
-            "order status", "tracking", "invoice", "receipt", "appointment",
-            "booking confirmed", "shipment", "delivery update", "payment received",
-            "reminder", "scheduled", "confirmation",
-        ]
-        utility_count = sum(1 for k in utility_keywords if k in full_text)
-        if utility_count > 0:
-            scores[DetectedIntent.UTILITY.value] += utility_count * 12
-        
-        # Get highest score
-        max_intent = max(scores.items(), key=lambda x: x[1])
+        # Auth patterns, promotional keywords + CTA verbs, utility indicators
+        auth_score = 50 if scan.auth_hit else 0
+        marketing_score = len(scan.promo_hits) * 15 + len(scan.cta_hits) * 10
+        utility_score = len(scan.utility_hits) * 12
+        
+        # Highest score wins; ties go to Utility, then Marketing
+        intent, best = DetectedIntent.UTILITY.value, utility_score
+        if marketing_score > best:
+            intent, best = DetectedIntent.MARKETING.value, marketing_score
+        if auth_score > best:
+            intent, best = DetectedIntent.AUTHENTICATION.value, auth_score
         
         # Return if confident, else unclear
-        if max_intent[1] >= 20:
-            return max_intent[0]
+        if best >= 20:
+            return intent
         return DetectedIntent.UNCLEAR.value
 
 
@@ -432,6 +536,11 @@ class TemplateValidator:
 # Convenience Function for Routes
 # ==============================================================
 
+# TemplateValidator holds no per-call state, so the wrapper reuses one per WABA age
+_VALIDATOR_NEW_WABA = TemplateValidator(is_new_waba=True)
+_VALIDATOR_ESTABLISHED_WABA = TemplateValidator(is_new_waba=False)
+
+
 def validate_template(
     body: str,
     category: str,
@@ -447,7 +556,7 @@ def validate_template(
     
     Convenience wrapper for API routes.
     """
-    validator = TemplateValidator(is_new_waba=is_new_waba)
+    validator = _VALIDATOR_NEW_WABA if is_new_waba else _VALIDATOR_ESTABLISHED_WABA
     result = validator.validate(
         body=body,
         category=category,
@@ -18,11 +18,25 @@ Usage:
 """
 
 import logging
-from typing import Tuple, Optional
+import time
+from typing import Dict, Tuple, Optional
 from datetime import datetime, timezone
 
+from .utils import evict_oldest
+
 logger = logging.getLogger(__name__)
 
+def _find_alternative_account(workspace_id: Optional[str]) -> Optional['WhatsAppAccount']:
+    """Return the first active account with a stored token in the workspace."""
+    from .models import WhatsAppAccount
+    
+    return WhatsAppAccount.query.filter_by(
+        workspace_id=workspace_id,
+        is_active=True
+    ).filter(
+        WhatsAppAccount.access_token_encrypted.isnot(None)
+    ).first()
+
 
 def get_account_with_token(account_id: int) -> Tuple[Optional['WhatsAppAccount'], Optional[str]]:
     """
@@ -43,14 +57,13 @@ def get_account_with_token(account_id: int) -> Tuple[Optional['WhatsAppAccount']
     if not account:
         return None, "Account not found"
     
+    # The fallback lookup is shared by the inactive and missing-token paths,
+    # so it is issued at most once per call.
+    alt_account = None
+    
     if not account.is_active:
         # Try to find an alternative active account in the same workspace
-        alt_account = WhatsAppAccount.query.filter_by(
-            workspace_id=account.workspace_id,
-            is_active=True
-        ).filter(
-            WhatsAppAccount.access_token_encrypted.isnot(None)
-        ).first()
+        alt_account = _find_alternative_account(account.workspace_id)
         
         if alt_account:
             logger.info(f"Account {account_id} is inactive, using alternative account {alt_account.id}")
@@ -61,12 +74,8 @@ def get_account_with_token(account_id: int) -> Tuple[Optional['WhatsAppAccount']
     access_token = account.get_access_token()
     if not access_token:
         # Try to find an alternative account with token
-        alt_account = WhatsAppAccount.query.filter_by(
-            workspace_id=account.workspace_id,
-            is_active=True
-        ).filter(
-            WhatsAppAccount.access_token_encrypted.isnot(None)
-        ).first()
+        if alt_account is None:
+            alt_account = _find_alternative_account(account.workspace_id)
         
         if alt_account:
             logger.info(f"Account {account_id} has no token, using alternative account {alt_account.id}")
@@ -93,15 +102,7 @@ def get_valid_account_for_workspace(workspace_id: str) -> Tuple[Optional['WhatsA
     Returns:
         Tuple of (account, error_message)
     """
-    from .models import WhatsAppAccount
-    
-    account = WhatsAppAccount.query.filter_by(
-        workspace_id=workspace_id,
-        is_active=True
-    ).filter(
-        WhatsAppAccount.access_token_encrypted.isnot(None)
-    ).first()
-    
+    account = _find_alternative_account(workspace_id)
     if not account:
         return None, "No active WhatsApp account found for this workspace. Please connect a WhatsApp Business Account."
     
@@ -112,6 +113,58 @@ def get_valid_account_for_workspace(workspace_id: str) -> Tuple[Optional['WhatsA
     return account, None
 
 
+# account_id -> ((phone_number_id, access_token), cached_at). Saves the DB read
+# and token decryption on hot send paths such as trigger hooks.
+_CREDENTIALS_CACHE: Dict[int, Tuple[Tuple[str, str], float]] = {}
+CREDENTIALS_CACHE_TTL = 300  # Seconds resolved credentials are reused
+CREDENTIALS_CACHE_MAX = 10_000  # Entries kept before the oldest are evicted
+
+
+def get_account_credentials(account_id: int) -> Tuple[Optional[Tuple[str, str]], Optional[str]]:
+    """
+    Get the (phone_number_id, access_token) to send from for an account.
+    
+    Resolves the account exactly like get_account_with_token (including the
+    fallback to another active account) and caches the result per process.
+    
+    Args:
+        account_id: The account ID
+        
+    Returns:
+        Tuple of (credentials, error_message)
+    """
+    now = time.monotonic()
+    cached = _CREDENTIALS_CACHE.get(account_id)
+    if cached and now - cached[1] < CREDENTIALS_CACHE_TTL:
+        return cached[0], None
+    
+    account, error = get_account_with_token(account_id)
+    if error:
+        return None, error
+    
+    credentials = (account.phone_number_id, account.get_access_token())
+    
+    # Never serve a cached token past its expiry
+    expires_at = account.token_expires_at
+    if expires_at is not None:
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        if (expires_at - datetime.now(timezone.utc)).total_seconds() <= CREDENTIALS_CACHE_TTL:
+            return credentials, None
+    
+    evict_oldest(_CREDENTIALS_CACHE, CREDENTIALS_CACHE_MAX)
+    _CREDENTIALS_CACHE[account_id] = (credentials, now)
+    return credentials, None
+
+
+def invalidate_account_cache(account_id: Optional[int] = None) -> None:
+    """Drop cached credentials for an account (or all accounts) after an account change."""
+    if account_id is None:
+        _CREDENTIALS_CACHE.clear()
+    else:
+        _CREDENTIALS_CACHE.pop(account_id, None)
+
+
 def get_token_for_account(account_id: int) -> Tuple[Optional[str], Optional[str]]:
     """
     Get just the access token for an account (convenience method).
@@ -156,14 +209,18 @@ def migrate_resources_to_active_account(old_account_id: int, workspace_id: str)
     if active_account.id == old_account_id:
         return {"success": True, "message": "Account is already active", "migrated_flows": 0, "migrated_templates": 0}
     
+    # Both bulk UPDATEs share the transaction opened by the lookup above and
+    # commit once. Nothing in the session needs reconciling, so skip the
+    # identity-map synchronisation pass.
+    
     # Migrate flows
     flows_migrated = WhatsAppFlow.query.filter_by(account_id=old_account_id).update(
-        {"account_id": active_account.id}
+        {"account_id": active_account.id}, synchronize_session=False
     )
     
     # Migrate templates
     templates_migrated = WhatsAppTemplate.query.filter_by(account_id=old_account_id).update(
-        {"account_id": active_account.id}
+        {"account_id": active_account.id}, synchronize_session=False
     )
     
     db.session.commit()
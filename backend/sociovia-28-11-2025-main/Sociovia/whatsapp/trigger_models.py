@@ -12,7 +12,7 @@ class WhatsAppTrigger(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     workspace_id = db.Column(db.String(255), nullable=False, index=True)
-    account_id = db.Column(db.Integer, db.ForeignKey("whatsapp_accounts.id"), nullable=False, index=True)
+    account_id = db.Column(db.Integer, db.ForeignKey("whatsapp_accounts.id"), nullable=False)  # prefix of ix_whatsapp_triggers_acct_ws_created
     
     name = db.Column(db.String(255), nullable=False)
     slug = db.Column(db.String(255), nullable=False)  # URL-friendly identifier
@@ -38,6 +38,8 @@ class WhatsAppTrigger(db.Model):
     
     __table_args__ = (
         db.UniqueConstraint('account_id', 'slug', name='uq_account_trigger_slug'),
+        # Serves list_triggers (account_id, workspace_id ORDER BY created_at DESC) as one ordered range scan
+        db.Index('ix_whatsapp_triggers_acct_ws_created', 'account_id', 'workspace_id', created_at.desc()),
         {"extend_existing": True},
     )
     
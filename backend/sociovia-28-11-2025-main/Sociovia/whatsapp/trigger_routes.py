@@ -1,13 +1,23 @@
+import atexit
+import hmac
 import secrets
 import logging
-from datetime import datetime, timezone
-from flask import Blueprint, request, jsonify, url_for
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from flask import Blueprint, Flask, current_app, request, jsonify, url_for
+from sqlalchemy import bindparam, func, update
+from sqlalchemy.orm import load_only
 
 from models import db
 from .models import WhatsAppAccount
 from .trigger_models import WhatsAppTrigger
 from .services import WhatsAppService
-from .token_helper import get_account_with_token
+from .token_helper import get_account_credentials
+from .utils import evict_oldest, utcnow
 # decorators
 from .flow_access import require_account_access
 
@@ -15,6 +25,173 @@ logger = logging.getLogger(__name__)
 
 trigger_bp = Blueprint("triggers", __name__, url_prefix="/api/whatsapp")
 
+TRIGGER_LIST_COLUMNS = (
+    WhatsAppTrigger.id,
+    WhatsAppTrigger.workspace_id,
+    WhatsAppTrigger.account_id,
+    WhatsAppTrigger.name,
+    WhatsAppTrigger.slug,
+    WhatsAppTrigger.description,
+    WhatsAppTrigger.template_name,
+    WhatsAppTrigger.language,
+    WhatsAppTrigger.is_active,
+    WhatsAppTrigger.trigger_count,
+    WhatsAppTrigger.last_triggered_at,
+    WhatsAppTrigger.created_at,
+)
+
+SLUG_SEPARATORS = str.maketrans({" ": "-", "_": "-"})
+TRIGGER_SECRET_BYTES = 24  # 192 bits; encodes to 32 chars
+MAX_TRIGGER_RECIPIENTS = 50  # Per invoke_trigger call
+
+# Workers for hooks called with "async": Graph API sends run off the request thread.
+# Queued calls are capped; when full the hook answers 503 and the caller retries.
+_SEND_EXECUTOR = ThreadPoolExecutor(max_workers=32, thread_name_prefix="trigger-send")
+TRIGGER_ASYNC_QUEUE_MAX = 1000  # Async calls queued or running per process
+_send_slots = threading.BoundedSemaphore(TRIGGER_ASYNC_QUEUE_MAX)
+
+# Multi-recipient calls send concurrently and give up waiting after the
+# deadline, so one call can't hold a request worker for minutes
+_FANOUT_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix="trigger-fanout")
+TRIGGER_SEND_DEADLINE = 25  # Seconds a call waits for all of its sends
+
+
+# ============================================================
+# Trigger Registry Cache (per process)
+# ============================================================
+
+@dataclass(frozen=True)
+class TriggerSpec:
+    """The fields invoke_trigger needs, detached from the session."""
+    id: int
+    account_id: int
+    name: str
+    template_name: str
+    language: str
+    secret_key: bytes
+    is_active: bool
+
+
+TRIGGER_SPEC_COLUMNS = (
+    WhatsAppTrigger.id,
+    WhatsAppTrigger.account_id,
+    WhatsAppTrigger.name,
+    WhatsAppTrigger.template_name,
+    WhatsAppTrigger.language,
+    WhatsAppTrigger.secret_key,
+    WhatsAppTrigger.is_active,
+)
+
+# trigger_id -> (spec, cached_at). The TTL bounds staleness across workers,
+# since delete_trigger can only evict the entry in its own process.
+_TRIGGER_CACHE: Dict[int, Tuple[TriggerSpec, float]] = {}
+TRIGGER_CACHE_TTL = 60
+TRIGGER_CACHE_MAX = 10_000
+
+
+def _get_trigger_spec(trigger_id: int) -> Optional[TriggerSpec]:
+    """Return the trigger spec from the cache, loading it on a miss."""
+    now = time.monotonic()
+    cached = _TRIGGER_CACHE.get(trigger_id)
+    if cached and now - cached[1] < TRIGGER_CACHE_TTL:
+        return cached[0]
+    
+    # Plain row of just the spec columns - no ORM object or identity-map entry
+    row = db.session.query(*TRIGGER_SPEC_COLUMNS).filter(WhatsAppTrigger.id == trigger_id).one_or_none()
+    if row is None:
+        _TRIGGER_CACHE.pop(trigger_id, None)
+        return None
+    
+    spec = TriggerSpec(
+        id=row.id,
+        account_id=row.account_id,
+        name=row.name,
+        template_name=row.template_name,
+        language=row.language,
+        secret_key=row.secret_key.encode(),
+        is_active=bool(row.is_active),
+    )
+    evict_oldest(_TRIGGER_CACHE, TRIGGER_CACHE_MAX)
+    _TRIGGER_CACHE[trigger_id] = (spec, now)
+    return spec
+
+
+def invalidate_trigger_cache(trigger_id: int) -> None:
+    _TRIGGER_CACHE.pop(trigger_id, None)
+
+# ============================================================
+# Batched Trigger Stats
+# ============================================================
+
+# trigger_id -> (pending fires, latest fire time). Drained by a background
+# thread so hook requests don't pay a commit just to bump counters.
+_pending_trigger_stats: Dict[int, Tuple[int, datetime]] = {}
+_pending_stats_lock = threading.Lock()
+_stats_flusher_started = False
+TRIGGER_STATS_FLUSH_INTERVAL = 2.0  # Seconds between flushes
+
+_TRIGGER_STATS_UPDATE = (
+    update(WhatsAppTrigger.__table__)
+    .where(WhatsAppTrigger.__table__.c.id == bindparam("b_id"))
+    .values(
+        trigger_count=func.coalesce(WhatsAppTrigger.__table__.c.trigger_count, 0) + bindparam("b_delta"),
+        last_triggered_at=bindparam("b_last"),
+    )
+)
+
+
+def _record_trigger_fires(trigger_id: int, fires: int) -> None:
+    """Queue a trigger_count increment for the next flush."""
+    with _pending_stats_lock:
+        pending, _ = _pending_trigger_stats.get(trigger_id, (0, None))
+        _pending_trigger_stats[trigger_id] = (pending + fires, utcnow())
+    _ensure_stats_flusher(current_app._get_current_object())
+
+
+def _flush_trigger_stats(app: Flask) -> None:
+    """Write all queued increments in one executemany UPDATE."""
+    with _pending_stats_lock:
+        if not _pending_trigger_stats:
+            return
+        batch = dict(_pending_trigger_stats)
+        _pending_trigger_stats.clear()
+    
+    with app.app_context():
+        try:
+            db.session.execute(_TRIGGER_STATS_UPDATE, [
+                {"b_id": trigger_id, "b_delta": fires, "b_last": last}
+                for trigger_id, (fires, last) in batch.items()
+            ])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.exception(f"Failed to flush trigger stats, requeueing: {e}")
+            with _pending_stats_lock:
+                for trigger_id, (fires, last) in batch.items():
+                    pending, newer = _pending_trigger_stats.get(trigger_id, (0, None))
+                    _pending_trigger_stats[trigger_id] = (pending + fires, newer or last)
+        finally:
+            db.session.remove()
+
+
+def _ensure_stats_flusher(app: Flask) -> None:
+    global _stats_flusher_started
+    if _stats_flusher_started:
+        return
+    with _pending_stats_lock:
+        if _stats_flusher_started:
+            return
+        _stats_flusher_started = True
+    
+    def _loop():
+        while True:
+            time.sleep(TRIGGER_STATS_FLUSH_INTERVAL)
+            _flush_trigger_stats(app)
+    
+    threading.Thread(target=_loop, name="trigger-stats-flusher", daemon=True).start()
+    atexit.register(_flush_trigger_stats, app)
+
+
 # ============================================================
 # Management Endpoints (Requires Auth)
 # ============================================================
@@ -24,7 +201,9 @@ trigger_bp = Blueprint("triggers", __name__, url_prefix="/api/whatsapp")
 def list_triggers(account_id: int, account: WhatsAppAccount, workspace_id: str):
     """List all triggers for an account."""
     try:
-        triggers = WhatsAppTrigger.query.filter_by(
+        # Only the columns to_dict() serialises; secret_key and the
+        # housekeeping columns are never sent to the listing.
+        triggers = WhatsAppTrigger.query.options(load_only(*TRIGGER_LIST_COLUMNS)).filter_by(
             account_id=account_id,
             workspace_id=workspace_id
         ).order_by(WhatsAppTrigger.created_at.desc()).all()
@@ -51,11 +230,10 @@ def create_trigger(account_id: int, account: WhatsAppAccount, workspace_id: str)
         
     try:
         # Generate slug and secret
-        slug = name.lower().replace(" ", "-").replace("_", "-")
-        # Ensure alphanumeric slug
-        slug = "".join(c for c in slug if c.isalnum() or c == '-')
+        # Spaces/underscores become dashes, anything else non-alphanumeric is dropped
+        slug = "".join(c for c in name.lower().translate(SLUG_SEPARATORS) if c.isalnum() or c == '-')
         
-        secret_key = secrets.token_urlsafe(32)
+        secret_key = secrets.token_urlsafe(TRIGGER_SECRET_BYTES)
         
         trigger = WhatsAppTrigger(
             workspace_id=workspace_id,
@@ -99,6 +277,7 @@ def delete_trigger(account_id: int, trigger_id: int, account: WhatsAppAccount, w
             
         db.session.delete(trigger)
         db.session.commit()
+        invalidate_trigger_cache(trigger_id)
         
         return jsonify({"success": True, "message": "Trigger deleted"})
         
@@ -123,6 +302,21 @@ def invoke_trigger(trigger_id: int):
         "to": "1234567890",
         "variables": ["var1", "var2"] // Optional, if template has variables
     }
+    
+    or, to fan out to several recipients in one call (up to 50, sent
+    concurrently; sends not started after TRIGGER_SEND_DEADLINE seconds are
+    cancelled, and ones still in flight are reported as "pending"):
+    {
+        "recipients": [
+            {"to": "1234567890", "variables": ["var1"]},
+            {"to": "0987654321", "variables": ["var2"]}
+        ]
+    }
+    
+    Add "async": true (or ?async=1) to get 202 right away while the
+    messages are sent in the background. Async sends are best-effort: there
+    is no job status to poll, failures are only logged, and sends still
+    queued are lost on restart. 503 means the queue is full.
     """
     secret = request.args.get("secret") or request.headers.get("X-Trigger-Secret")
     data = request.get_json(silent=True) or {}
@@ -131,56 +325,76 @@ def invoke_trigger(trigger_id: int):
         return jsonify({"error": "Missing secret"}), 401
         
     try:
-        trigger = WhatsAppTrigger.query.get(trigger_id)
+        trigger = _get_trigger_spec(trigger_id)
         
-        if not trigger or trigger.secret_key != secret:
-            # timing attack safe comparison ideally, but standard equality ok for now
+        if not trigger or not hmac.compare_digest(trigger.secret_key, secret.encode()):
             return jsonify({"error": "Invalid trigger or secret"}), 401
             
         if not trigger.is_active:
             return jsonify({"error": "Trigger is inactive"}), 400
             
-        # Get recipient
-        to = data.get("to")
-        if not to:
-             return jsonify({"error": "'to' phone number is required"}), 400
-             
-        # Get variables
-        variables = data.get("variables", [])
-        
-        # Get account to send from
-        account, error = get_account_with_token(trigger.account_id)
-        if error or not account:
+        # Get recipients
+        recipients = data.get("recipients")
+        multi = recipients is not None
+        if multi:
+            if not isinstance(recipients, list) or not recipients:
+                return jsonify({"error": "'recipients' must be a non-empty list"}), 400
+            if len(recipients) > MAX_TRIGGER_RECIPIENTS:
+                return jsonify({"error": f"At most {MAX_TRIGGER_RECIPIENTS} recipients per call"}), 400
+            if not all(isinstance(r, dict) and r.get("to") for r in recipients):
+                return jsonify({"error": "Each recipient needs a 'to' phone number"}), 400
+        else:
+            to = data.get("to")
+            if not to:
+                return jsonify({"error": "'to' phone number is required"}), 400
+            recipients = [{"to": to, "variables": data.get("variables", [])}]
+        
+        # Get account to send from (cached phone_number_id + decrypted token)
+        credentials, error = get_account_credentials(trigger.account_id)
+        if error or not credentials:
             return jsonify({"error": "Configuration error: Account not found or invalid token"}), 500
-            
-        # Send Message
-        service = WhatsAppService(db.session, account.phone_number_id, account.get_access_token())
-        
-        # Determine if we need to wrap variables in components
-        # Simple implementation: assume body variables only for now
-        # Ideally, we should parse the template or allow complex 'components' in payload
-        components = []
-        if variables:
-            components.append({
-                "type": "body",
-                "parameters": [{"type": "text", "text": str(v)} for v in variables]
-            })
-            
-        result = service.send_template(
-            to=to,
-            template_name=trigger.template_name,
-            language_code=trigger.language,
-            components=components
-        )
         
-        if result.get("success"):
-            # Update stats
-            trigger.trigger_count += 1
-            trigger.last_triggered_at = datetime.now(timezone.utc)
-            db.session.commit()
-            
-            logger.info(f"[Automation Source: API TRIGGER] Trigger '{trigger.name}' (ID: {trigger.id}) fired to {to}")
-            
+        # Body variables only for now; components are built by the service
+        recipients = [{"to": r["to"], "variables": r.get("variables")} for r in recipients]
+        
+        # Opt-in: acknowledge now and send from the worker pool
+        if data.get("async") or request.args.get("async") in ("1", "true"):
+            if not _send_slots.acquire(blocking=False):
+                return jsonify({"error": "Send queue is full, retry later"}), 503
+            future = _SEND_EXECUTOR.submit(
+                _send_trigger_in_background,
+                current_app._get_current_object(), trigger, credentials, recipients,
+            )
+            future.add_done_callback(lambda _future: _send_slots.release())
+            return jsonify({
+                "success": True,
+                "queued": True,
+                "recipients": len(recipients),
+            }), 202
+        
+        results, sent = _send_trigger(trigger, credentials, recipients)
+        
+        if multi:
+            pending = sum(1 for result in results if result.get("pending"))
+            return jsonify({
+                "success": sent == len(results),
+                "sent": sent,
+                "pending": pending,
+                "failed": len(results) - sent - pending,
+                "results": [
+                    {
+                        "to": r["to"],
+                        "success": bool(result.get("success")),
+                        "pending": bool(result.get("pending")),
+                        "message_id": result.get("message_id"),
+                        "error": result.get("error"),
+                    }
+                    for r, result in zip(recipients, results)
+                ],
+            }), (200 if sent else 202 if pending else 502)
+        
+        result = results[0]
+        if sent:
             return jsonify({
                 "success": True,
                 "message": "Trigger fired successfully",
@@ -196,3 +410,89 @@ def invoke_trigger(trigger_id: int):
     except Exception as e:
         logger.exception(f"Error invoking trigger {trigger_id}: {e}")
         return jsonify({"error": str(e)}), 500
+
+
+def _send_trigger(trigger: TriggerSpec, credentials: Tuple[str, str], recipients: list) -> Tuple[list, int]:
+    """Send the trigger's template to every recipient and queue the stats bump."""
+    if len(recipients) == 1:
+        results = [_send_trigger_template(trigger, credentials, recipients[0])]
+    else:
+        results = _fan_out_trigger(trigger, credentials, recipients)
+    sent = sum(1 for result in results if result.get("success"))
+    
+    if sent:
+        # Update stats (flushed in batches; eventual consistency is fine here)
+        _record_trigger_fires(trigger.id, sent)
+    
+    if len(recipients) == 1 and sent:
+        logger.info(f"[Automation Source: API TRIGGER] Trigger '{trigger.name}' (ID: {trigger.id}) fired to {recipients[0]['to']}")
+    elif len(recipients) > 1:
+        logger.info(f"[Automation Source: API TRIGGER] Trigger '{trigger.name}' (ID: {trigger.id}) fired to {sent}/{len(results)} recipients")
+    
+    return results, sent
+
+
+def _send_trigger_template(trigger: TriggerSpec, credentials: Tuple[str, str], recipient: dict) -> dict:
+    phone_number_id, access_token = credentials
+    service = WhatsAppService(db.session, phone_number_id, access_token)
+    return service.send_template(
+        to=recipient["to"],
+        template_name=trigger.template_name,
+        language_code=trigger.language,
+        body_variables=recipient.get("variables"),
+    )
+
+
+def _fan_out_trigger(trigger: TriggerSpec, credentials: Tuple[str, str], recipients: list) -> list:
+    """
+    Send to several recipients concurrently, waiting at most
+    TRIGGER_SEND_DEADLINE seconds in total.
+    
+    Sends still queued at the deadline are cancelled (never sent). Ones
+    already running are reported as pending and counted in the trigger
+    stats if they go through.
+    """
+    app = current_app._get_current_object()
+    
+    def _send_one(recipient: dict) -> dict:
+        with app.app_context():
+            try:
+                return _send_trigger_template(trigger, credentials, recipient)
+            finally:
+                db.session.remove()
+    
+    def _count_late_send(future) -> None:
+        if future.exception() is None and future.result().get("success"):
+            with app.app_context():
+                _record_trigger_fires(trigger.id, 1)
+    
+    futures = [_FANOUT_EXECUTOR.submit(_send_one, recipient) for recipient in recipients]
+    _, not_done = wait(futures, timeout=TRIGGER_SEND_DEADLINE)
+    for future in not_done:
+        # Frees the shared pool for other callers; fails if already running
+        future.cancel()
+    
+    results = []
+    for future in futures:
+        if future.cancelled():
+            results.append({"success": False, "error": "Not sent: deadline passed before the send started"})
+        elif not future.done():
+            future.add_done_callback(_count_late_send)
+            results.append({"success": False, "pending": True, "error": "Still sending at the deadline; delivery unknown"})
+        elif future.exception() is not None:
+            results.append({"success": False, "error": str(future.exception())})
+        else:
+            results.append(future.result())
+    return results
+
+
+def _send_trigger_in_background(app: Flask, trigger: TriggerSpec, credentials: Tuple[str, str], recipients: list) -> None:
+    with app.app_context():
+        try:
+            results, sent = _send_trigger(trigger, credentials, recipients)
+            if sent < len(results):
+                logger.error(f"Async trigger {trigger.id}: {len(results) - sent}/{len(results)} sends failed")
+        except Exception as e:
+            logger.exception(f"Async trigger {trigger.id} failed: {e}")
+        finally:
+            db.session.remove()
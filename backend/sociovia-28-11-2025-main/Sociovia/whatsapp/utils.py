@@ -8,9 +8,20 @@ Utility functions for WhatsApp module.
 import os
 import hmac
 import hashlib
+import math
+import time
 import logging
+import threading
+from array import array
+from functools import lru_cache
 from datetime import datetime, timezone
-from typing import Optional, Dict, Any
+from types import MappingProxyType
+from typing import Optional, Dict, Any, List, Callable, Mapping
+
+try:
+    import redis
+except ImportError:
+    redis = None
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +30,16 @@ logger = logging.getLogger(__name__)
 # Phone Number Utilities
 # ============================================================
 
+# Formatting characters dropped by normalize_phone, in one translate() pass
+_PHONE_STRIP_TABLE = str.maketrans("", "", "+ -()")
+
+
+@lru_cache(maxsize=4096)
+def _strip_phone(phone: str) -> str:
+    # Senders repeat across a batch, so the translated string is memoised
+    return phone.translate(_PHONE_STRIP_TABLE).strip()
+
+
 def normalize_phone(phone: str) -> str:
     """
     Normalize a phone number by removing common formatting characters.
@@ -31,7 +52,7 @@ def normalize_phone(phone: str) -> str:
     """
     if not phone:
         return ""
-    return phone.replace("+", "").replace(" ", "").replace("-", "").replace("(", "").replace(")", "").strip()
+    return _strip_phone(phone)
 
 
 def format_phone_display(phone: str) -> str:
@@ -72,6 +93,17 @@ def is_valid_phone(phone: str) -> bool:
 # Signature Verification
 # ============================================================
 
+SHA256_HEX_LENGTH = 64
+SIGNATURE_PREFIX = "sha256="
+_SIGNATURE_PREFIX_LENGTH = len(SIGNATURE_PREFIX)
+
+
+@lru_cache(maxsize=4)
+def _secret_bytes(secret: str) -> bytes:
+    # The app secret is fixed per process; encode it once
+    return secret.encode("utf-8")
+
+
 def verify_signature(payload: bytes, signature: str, secret: str) -> bool:
     """
     Verify webhook signature from Meta.
@@ -88,20 +120,26 @@ def verify_signature(payload: bytes, signature: str, secret: str) -> bool:
         return False
     
     # Signature format: sha256=xxxxx
-    if not signature.startswith("sha256="):
+    if not signature.startswith(SIGNATURE_PREFIX):
         return False
     
-    expected_signature = signature[7:]  # Remove 'sha256=' prefix
+    expected_signature = signature[_SIGNATURE_PREFIX_LENGTH:]  # Remove 'sha256=' prefix
     
-    # Calculate HMAC
-    computed_signature = hmac.new(
-        secret.encode("utf-8"),
-        payload,
-        hashlib.sha256
-    ).hexdigest()
+    # A SHA-256 hex digest is always 64 chars; the length is public, so
+    # rejecting other lengths before hashing leaks nothing about the secret
+    if len(expected_signature) != SHA256_HEX_LENGTH:
+        return False
+    
+    try:
+        expected_digest = bytes.fromhex(expected_signature)
+    except ValueError:
+        return False
+    
+    # Calculate HMAC (single C call, raw digest - no hex encoding)
+    computed_digest = hmac.digest(_secret_bytes(secret), payload, "sha256")
     
     # Use constant-time comparison
-    return hmac.compare_digest(expected_signature, computed_signature)
+    return hmac.compare_digest(expected_digest, computed_digest)
 
 
 def generate_verify_token() -> str:
@@ -119,21 +157,25 @@ def generate_verify_token() -> str:
 # Environment Helpers
 # ============================================================
 
-def get_whatsapp_config() -> Dict[str, Any]:
+@lru_cache(maxsize=1)
+def get_whatsapp_config() -> Mapping[str, Any]:
     """
     Get WhatsApp configuration from environment variables.
     
+    The environment is read once per process; call
+    ``get_whatsapp_config.cache_clear()`` after changing it.
+    
     Returns:
-        Config dict with all WhatsApp settings
+        Read-only config mapping with all WhatsApp settings
     """
-    return {
+    return MappingProxyType({
         "access_token": os.getenv("WHATSAPP_ACCESS_TOKEN") or os.getenv("WHATSAPP_TEMP_TOKEN", ""),
         "phone_number_id": os.getenv("WHATSAPP_PHONE_NUMBER_ID", ""),
         "waba_id": os.getenv("WHATSAPP_WABA_ID", ""),
         "verify_token": os.getenv("WHATSAPP_VERIFY_TOKEN", ""),
         "app_secret": os.getenv("WHATSAPP_APP_SECRET", ""),
         "api_version": os.getenv("WHATSAPP_API_VERSION", "v22.0"),
-    }
+    })
 
 
 def is_whatsapp_configured() -> bool:
@@ -151,6 +193,30 @@ def is_whatsapp_configured() -> bool:
 # Message Parsing
 # ============================================================
 
+# Shared read-only default for missing sub-objects (no fresh {} per lookup)
+_EMPTY: Mapping[str, Any] = MappingProxyType({})
+
+
+# Interactive reply types whose payload (keyed by the type) carries a title
+_INTERACTIVE_TITLE_TYPES = frozenset({"button_reply", "list_reply"})
+
+
+def _extract_interactive_text(message: Dict[str, Any]) -> Optional[str]:
+    interactive = message.get("interactive") or _EMPTY
+    int_type = interactive.get("type", "")
+    if int_type not in _INTERACTIVE_TITLE_TYPES:
+        return None
+    return (interactive.get(int_type) or _EMPTY).get("title")
+
+
+# Message type -> text extractor
+_TEXT_EXTRACTORS: Dict[str, Callable[[Dict[str, Any]], Optional[str]]] = {
+    "text": lambda m: (m.get("text") or _EMPTY).get("body"),
+    "interactive": _extract_interactive_text,
+    "button": lambda m: (m.get("button") or _EMPTY).get("text"),
+}
+
+
 def extract_message_text(message: Dict[str, Any]) -> Optional[str]:
     """
     Extract text content from a webhook message object.
@@ -161,24 +227,8 @@ def extract_message_text(message: Dict[str, Any]) -> Optional[str]:
     Returns:
         Text content or None
     """
-    msg_type = message.get("type", "")
-    
-    if msg_type == "text":
-        return message.get("text", {}).get("body")
-    
-    elif msg_type == "interactive":
-        interactive = message.get("interactive", {})
-        int_type = interactive.get("type", "")
-        
-        if int_type == "button_reply":
-            return interactive.get("button_reply", {}).get("title")
-        elif int_type == "list_reply":
-            return interactive.get("list_reply", {}).get("title")
-    
-    elif msg_type == "button":
-        return message.get("button", {}).get("text")
-    
-    return None
+    extractor = _TEXT_EXTRACTORS.get(message.get("type", ""))
+    return extractor(message) if extractor else None
 
 
 def get_message_type(message: Dict[str, Any]) -> str:
@@ -207,7 +257,7 @@ def extract_media_info(message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     msg_type = message.get("type", "")
     
     if msg_type in ("image", "video", "audio", "document", "sticker"):
-        media_obj = message.get(msg_type, {})
+        media_obj = message.get(msg_type) or _EMPTY
         return {
             "type": msg_type,
             "id": media_obj.get("id"),
@@ -224,6 +274,15 @@ def extract_media_info(message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
 # Timestamp Utilities
 # ============================================================
 
+_UTC = timezone.utc
+
+
+@lru_cache(maxsize=1024)
+def _parse_epoch_seconds(timestamp: str) -> datetime:
+    # Webhook batches repeat the same second, so results are memoised
+    return datetime.fromtimestamp(int(timestamp), tz=_UTC)
+
+
 def parse_whatsapp_timestamp(timestamp: str) -> Optional[datetime]:
     """
     Parse a WhatsApp timestamp (Unix epoch seconds).
@@ -234,9 +293,16 @@ def parse_whatsapp_timestamp(timestamp: str) -> Optional[datetime]:
     Returns:
         datetime object or None
     """
+    if isinstance(timestamp, str):
+        # WhatsApp always sends plain digits; reject anything else up front
+        # instead of raising and catching a ValueError
+        if timestamp.isdecimal() and len(timestamp) <= 11:
+            return _parse_epoch_seconds(timestamp)
+        return None
+    
     try:
         ts = int(timestamp)
-        return datetime.fromtimestamp(ts, tz=timezone.utc)
+        return datetime.fromtimestamp(ts, tz=_UTC)
     except (ValueError, TypeError):
         return None
 
@@ -251,14 +317,12 @@ def format_timestamp(dt: datetime) -> str:
     Returns:
         ISO format string
     """
-    if not dt:
-        return ""
-    return dt.isoformat()
+    return dt.isoformat() if dt is not None else ""
 
 
 def utcnow() -> datetime:
     """Get current UTC datetime."""
-    return datetime.now(timezone.utc)
+    return datetime.now(_UTC)
 
 
 # ============================================================
@@ -340,20 +404,117 @@ def log_api_call(endpoint: str, method: str, status: int, response_time_ms: floa
     )
 
 
+# ============================================================
+# Process-local Caches
+# ============================================================
+
+def evict_oldest(cache: Dict, max_size: int) -> None:
+    """
+    Make room in an insertion-ordered cache that reached max_size.
+    
+    The oldest tenth is dropped in one go, so a full cache pays for eviction
+    once per max_size // 10 inserts instead of on every insert. list(cache)
+    snapshots the keys atomically, so concurrent writers can't break it.
+    """
+    if len(cache) < max_size:
+        return
+    for key in list(cache)[:max(1, max_size // 10)]:
+        cache.pop(key, None)
+
+
 # ============================================================
 # Deduplication
 # ============================================================
 
-_processed_wamids = set()
-_max_cache_size = 10000
+class WamidDedupCache:
+    """
+    Fixed-size, allocation-free cache of recently processed wamids.
+    
+    A direct-mapped table of packed 64-bit slots: the top 48 bits of the
+    wamid's hash as the tag, the low 16 bits a coarse time bucket so entries
+    expire after ``ttl`` seconds. A colliding wamid simply takes the slot
+    over. Writers lock one of ``shards`` stripes, not the whole table.
+    """
+    
+    _TAG_MASK = ~0xFFFF & 0xFFFFFFFFFFFFFFFF
+    
+    def __init__(self, slots: int = 1 << 18, ttl: int = 86400, bucket_seconds: int = 16, shards: int = 256):
+        self._slots = array("Q", bytes(8 * slots))
+        self._slot_mask = slots - 1  # slots and shards are powers of two
+        self._shard_mask = shards - 1
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self._bucket_seconds = bucket_seconds
+        self._ttl_buckets = ttl // bucket_seconds
+    
+    def _locate(self, wamid: str):
+        h = hash(wamid) & 0xFFFFFFFFFFFFFFFF
+        bucket = int(time.time() // self._bucket_seconds) & 0xFFFF
+        return h & self._slot_mask, h & self._TAG_MASK, bucket
+    
+    def _is_live(self, slot_value: int, tag: int, bucket: int) -> bool:
+        return (
+            slot_value != 0
+            and slot_value & self._TAG_MASK == tag
+            and (bucket - (slot_value & 0xFFFF)) & 0xFFFF <= self._ttl_buckets
+        )
+    
+    def contains(self, wamid: str) -> bool:
+        slot, tag, bucket = self._locate(wamid)
+        return self._is_live(self._slots[slot], tag, bucket)
+    
+    def check_and_set(self, wamid: str) -> bool:
+        """Record the wamid; True if it was already recorded."""
+        slot, tag, bucket = self._locate(wamid)
+        with self._locks[slot & self._shard_mask]:
+            if self._is_live(self._slots[slot], tag, bucket):
+                return True
+            self._slots[slot] = tag | bucket
+        return False
+    
+    def clear(self) -> None:
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            self._slots = array("Q", bytes(8 * len(self._slots)))
+        finally:
+            for lock in self._locks:
+                lock.release()
+
+
+# Shared dedup (and caches) across workers when REDIS_URL is configured
+DEDUP_KEY_PREFIX = "wa:dedup:"
+DEDUP_TTL_SECONDS = 86400
+_redis_client = None
+_redis_initialised = False
+
+# wamids this process has already handled - checked before Redis or the DB
+recent_wamids = WamidDedupCache(ttl=DEDUP_TTL_SECONDS)
+
+
+def get_redis_client():
+    """Return the shared Redis client, or None if Redis is not configured."""
+    global _redis_client, _redis_initialised
+    
+    if not _redis_initialised:
+        _redis_initialised = True
+        redis_url = os.getenv("REDIS_URL")
+        if redis_url and redis is not None:
+            _redis_client = redis.Redis.from_url(
+                redis_url, socket_timeout=0.5, socket_connect_timeout=0.5
+            )
+        elif redis_url:
+            logger.warning("REDIS_URL is set but the redis package is not installed; using in-memory dedup")
+    return _redis_client
 
 
 def is_duplicate_message(wamid: str) -> bool:
     """
-    Check if message has already been processed (in-memory cache).
+    Check if message has already been processed.
     
-    Note: This is a simple in-memory cache. For production,
-    use Redis or database-backed deduplication.
+    wamids this process has already handled are answered from the
+    in-memory cache; anything else is looked up in Redis (shared by every
+    worker) when REDIS_URL is set and reachable. Nothing is recorded here -
+    see mark_messages_processed.
     
     Args:
         wamid: WhatsApp message ID
@@ -361,23 +522,113 @@ def is_duplicate_message(wamid: str) -> bool:
     Returns:
         True if duplicate
     """
-    global _processed_wamids
-    
-    if wamid in _processed_wamids:
+    if recent_wamids.contains(wamid):
         return True
     
-    # Add to cache
-    _processed_wamids.add(wamid)
-    
-    # Clear cache if too large
-    if len(_processed_wamids) > _max_cache_size:
-        # Keep only the most recent half
-        _processed_wamids = set(list(_processed_wamids)[_max_cache_size // 2:])
+    client = get_redis_client()
+    if client is not None:
+        try:
+            return bool(client.exists(f"{DEDUP_KEY_PREFIX}{wamid}"))
+        except Exception as e:
+            logger.warning(f"Redis dedup failed, using in-memory cache: {e}")
     
     return False
 
 
+def mark_messages_processed(wamids: List[str]) -> None:
+    """
+    Record wamids as processed, once the messages are committed.
+    
+    Marking only after the commit means a message whose write was rolled
+    back is not mistaken for a duplicate when it is retried or replayed.
+    """
+    for wamid in wamids:
+        recent_wamids.check_and_set(wamid)
+    
+    client = get_redis_client()
+    if client is not None:
+        try:
+            pipe = client.pipeline(transaction=False)
+            for wamid in wamids:
+                pipe.set(f"{DEDUP_KEY_PREFIX}{wamid}", 1, ex=DEDUP_TTL_SECONDS)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Redis dedup failed, using in-memory cache: {e}")
+
+
 def clear_dedup_cache():
     """Clear the deduplication cache (for testing)."""
-    global _processed_wamids
-    _processed_wamids = set()
+    recent_wamids.clear()
+
+
+# ============================================================
+# Seen-wamid Bloom filter
+# ============================================================
+
+class _BloomBits:
+    """Fixed-size Bloom filter over str keys (k bit positions from one blake2b digest)."""
+    
+    __slots__ = ("size", "hashes", "bits")
+    
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+    
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+    
+    def add(self, key: str) -> None:
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+    
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class SeenWamidFilter:
+    """
+    Bloom filter of the wamids this process has stored.
+    
+    A miss means the wamid was never stored by this process, which only
+    proves it is new if the message is younger than covered_since - anything
+    older may have been stored before the filter existed and still needs the
+    DB lookup. Two generations rotate every ``window`` seconds so the filter
+    stays at its configured error rate.
+    """
+    
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.001, window: int = DEDUP_TTL_SECONDS):
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._window = window
+        self._lock = threading.Lock()
+        self._current = _BloomBits(capacity, error_rate)
+        self._previous: Optional[_BloomBits] = None
+        self._started_at = time.time()
+        self.covered_since = self._started_at
+    
+    def _rotate_if_due(self) -> None:
+        now = time.time()
+        if now - self._started_at >= self._window:
+            self._previous = self._current
+            self._current = _BloomBits(self._capacity, self._error_rate)
+            self.covered_since = self._started_at
+            self._started_at = now
+    
+    def add(self, wamid: str) -> None:
+        with self._lock:
+            self._rotate_if_due()
+            self._current.add(wamid)
+    
+    def might_contain(self, wamid: str) -> bool:
+        with self._lock:
+            self._rotate_if_due()
+            return wamid in self._current or (self._previous is not None and wamid in self._previous)
+
+
+seen_wamids = SeenWamidFilter(
+    capacity=int(os.getenv("WAMID_BLOOM_CAPACITY", "1000000")),
+)
@@ -7,10 +7,22 @@ Provides clean input validation and error messages.
 """
 
 import re
-from typing import Dict, Any, List, Optional, Tuple
+from types import MappingProxyType
+from typing import Dict, Any, List, Mapping, Optional, Tuple
 
-# Phone number validation regex (E.164 without +)
-PHONE_REGEX = re.compile(r"^\d{10,15}$")
+# Phone number length bounds (E.164 without +)
+PHONE_MIN_DIGITS = 10
+PHONE_MAX_DIGITS = 15
+
+# Template names: lowercase letters, digits and underscores only (\Z, unlike $,
+# does not accept a trailing newline)
+TEMPLATE_NAME_REGEX = re.compile(r"\A[a-z0-9_]+\Z")
+
+# Characters removed from phone numbers before validation (+, spaces, dashes)
+_PHONE_STRIP_TABLE = str.maketrans("", "", "+ -")
+
+# Shared read-only default for missing nested request objects
+_EMPTY: Mapping[str, Any] = MappingProxyType({})
 
 
 class ValidationError(Exception):
@@ -48,12 +60,13 @@ def validate_phone_number(phone: str, field: str = "to") -> str:
         raise ValidationError(field, "Phone number is required", "required")
     
     # Normalize: remove +, spaces, dashes
-    normalized = phone.replace("+", "").replace(" ", "").replace("-", "").strip()
+    normalized = phone.translate(_PHONE_STRIP_TABLE).strip()
     
     if not normalized:
         raise ValidationError(field, "Phone number is required", "required")
     
-    if not PHONE_REGEX.match(normalized):
+    # isdecimal() accepts exactly the characters the old \d pattern did
+    if not (PHONE_MIN_DIGITS <= len(normalized) <= PHONE_MAX_DIGITS and normalized.isdecimal()):
         raise ValidationError(
             field,
             "Invalid phone number format. Must be 10-15 digits (E.164 format without +)",
@@ -112,7 +125,7 @@ def validate_template_message(data: Dict[str, Any]) -> Tuple[str, str, str, Opti
         raise ValidationError("template_name", "Template name is required", "required")
     
     # Validate template name format
-    if not re.match(r"^[a-z0-9_]+$", template_name):
+    if not TEMPLATE_NAME_REGEX.match(template_name):
         raise ValidationError(
             "template_name",
             "Template name must contain only lowercase letters, numbers, and underscores",
@@ -168,7 +181,7 @@ def validate_media_message(data: Dict[str, Any]) -> Tuple[str, str, Optional[str
         )
     
     # Get media from nested object or top level
-    media = data.get("media", {})
+    media = data.get("media") or _EMPTY
     url = media.get("url") or data.get("media_url") or data.get("url")
     media_id = media.get("id") or data.get("media_id")
     
@@ -208,7 +221,7 @@ def validate_interactive_buttons(data: Dict[str, Any]) -> Tuple[str, str, List[D
     to = validate_phone_number(data.get("to", ""))
     
     # Get interactive data from nested object or top level
-    interactive = data.get("interactive", {})
+    interactive = data.get("interactive") or _EMPTY
     body_text = interactive.get("body") or data.get("body", "")
     
     if not body_text:
@@ -270,7 +283,7 @@ def validate_interactive_list(data: Dict[str, Any]) -> Tuple[str, str, str, List
     to = validate_phone_number(data.get("to", ""))
     
     # Get interactive data from nested object or top level
-    interactive = data.get("interactive", {})
+    interactive = data.get("interactive") or _EMPTY
     body_text = interactive.get("body") or data.get("body", "")
     
     if not body_text:
@@ -8,10 +8,16 @@ Stores automations with nodes (triggers, messages, buttons) and edges (connectio
 Multi-tenant: All automations scoped by workspace_id and account_id.
 """
 
-from datetime import datetime, timezone
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
 from typing import Dict, Any, Optional, List
 from models import db
-from sqlalchemy import Index, JSON, Text
+from sqlalchemy import Index, JSON, Text, cast, func, text, update
+from sqlalchemy.dialects.postgresql import JSONB, array
+from sqlalchemy.ext.hybrid import hybrid_property
+
+MESSAGING_WINDOW = timedelta(hours=24)  # Customer-service window after the user's last message
 
 
 class WhatsAppVisualAutomation(db.Model):
@@ -25,6 +31,7 @@ class WhatsAppVisualAutomation(db.Model):
         Index("ix_visual_automation_workspace", "workspace_id"),
         Index("ix_visual_automation_account", "account_id"),
         Index("ix_visual_automation_status", "status"),
+        Index("ix_va_trigger_cfg_gin", "trigger_config", postgresql_using="gin"),
         {"extend_existing": True},
     )
 
@@ -34,17 +41,21 @@ class WhatsAppVisualAutomation(db.Model):
     workspace_id = db.Column(db.String(255), nullable=False, index=True)
     account_id = db.Column(db.Integer, db.ForeignKey("whatsapp_accounts.id"), nullable=False)
     
+    # Lazy by default; the webhook reads active flows through the automations cache
+    account = db.relationship("WhatsAppAccount", backref=db.backref("visual_automations", lazy="select"))
+    
     # Basic info
     name = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text, nullable=True)
     
     # Trigger configuration
     trigger_type = db.Column(db.String(32), nullable=False)  # any_message, keyword, template_reply
-    trigger_config = db.Column(JSON, nullable=False, default=dict)
+    trigger_config = db.Column(JSON().with_variant(JSONB(), "postgresql"), nullable=False, default=dict)
     
     # Visual canvas data (React Flow format)
-    nodes = db.Column(JSON, nullable=False, default=list)  # Array of node objects
-    edges = db.Column(JSON, nullable=False, default=list)  # Array of edge objects
+    nodes = db.Column(JSON().with_variant(JSONB(), "postgresql"), nullable=False, default=list)  # Array of node objects
+    edges = db.Column(JSON().with_variant(JSONB(), "postgresql"), nullable=False, default=list)  # Array of edge objects
+    nodes_hash = db.Column(db.String(64), nullable=True)  # sha256 of canonical nodes+edges, see set_flow()
     
     # Viewport state (for restoring canvas position)
     viewport = db.Column(JSON, nullable=True)  # {x, y, zoom}
@@ -62,12 +73,19 @@ class WhatsAppVisualAutomation(db.Model):
     
     # Audit
     created_by = db.Column(db.String(255), nullable=True)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
-    
-    def to_dict(self) -> Dict[str, Any]:
-        """Convert to dictionary for API response."""
-        return {
+    created_at = db.Column(db.DateTime, server_default=func.timezone("utc", func.now()))
+    updated_at = db.Column(db.DateTime, server_default=func.timezone("utc", func.now()), onupdate=func.timezone("utc", func.now()))
+    
+    _DATE_KEYS = ("lastTriggeredAt", "createdAt", "updatedAt")
+    
+    def to_dict(self, serialize_dates: bool = True) -> Dict[str, Any]:
+        """
+        Convert to dictionary for API response.
+        
+        With serialize_dates=False the datetime fields are left as datetime
+        objects for json_provider.iso_json_response() to encode.
+        """
+        data = {
             "id": self.id,
             "workspaceId": self.workspace_id,
             "accountId": self.account_id,
@@ -81,74 +99,63 @@ class WhatsAppVisualAutomation(db.Model):
             "status": self.status,
             "isActive": self.is_active,
             "triggerCount": self.trigger_count,
-            "lastTriggeredAt": self.last_triggered_at.isoformat() if self.last_triggered_at else None,
+            "lastTriggeredAt": self.last_triggered_at,
             "version": self.version,
             "createdBy": self.created_by,
-            "createdAt": self.created_at.isoformat() if self.created_at else None,
-            "updatedAt": self.updated_at.isoformat() if self.updated_at else None,
+            "createdAt": self.created_at,
+            "updatedAt": self.updated_at,
         }
+        if serialize_dates:
+            for key in self._DATE_KEYS:
+                if data[key]:
+                    data[key] = data[key].isoformat()
+        return data
     
     def activate(self):
         """Activate the automation."""
         self.status = "active"
         self.is_active = True
-        self.updated_at = datetime.now(timezone.utc)
     
     def pause(self):
         """Pause the automation."""
         self.status = "paused"
         self.is_active = False
-        self.updated_at = datetime.now(timezone.utc)
     
-    def increment_trigger_count(self):
-        """Increment trigger count and update last triggered time."""
-        self.trigger_count = (self.trigger_count or 0) + 1
-        self.last_triggered_at = datetime.now(timezone.utc)
-
-
-class WhatsAppAutomationNode(db.Model):
-    """
-    Individual node in a visual automation.
-    
-    This is an alternative to storing nodes as JSON in the parent.
-    Useful for more complex querying and indexing.
-    """
-    __tablename__ = "whatsapp_automation_nodes"
-    __table_args__ = (
-        Index("ix_automation_node_automation", "automation_id"),
-        Index("ix_automation_node_type", "node_type"),
-        {"extend_existing": True},
-    )
-    
-    id = db.Column(db.Integer, primary_key=True)
-    automation_id = db.Column(db.Integer, db.ForeignKey("whatsapp_visual_automations.id", ondelete="CASCADE"), nullable=False)
-    
-    # Node identification
-    node_id = db.Column(db.String(64), nullable=False)  # Client-side ID like "message-1"
-    node_type = db.Column(db.String(32), nullable=False)  # trigger, message, buttons, delay, flow, condition
-    
-    # Position on canvas
-    position_x = db.Column(db.Float, default=0)
-    position_y = db.Column(db.Float, default=0)
-    
-    # Node data (type-specific)
-    data = db.Column(JSON, nullable=False, default=dict)
-    
-    # Order (for sequential execution)
-    execution_order = db.Column(db.Integer, default=0)
-    
-    # Audit
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    
-    def to_dict(self) -> Dict[str, Any]:
-        """Convert to React Flow node format."""
-        return {
-            "id": self.node_id,
-            "type": self.node_type,
-            "position": {"x": self.position_x, "y": self.position_y},
-            "data": self.data,
-        }
+    @staticmethod
+    def compute_nodes_hash(nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]]) -> str:
+        """sha256 of the flow in canonical JSON form (sorted keys, no whitespace)."""
+        canonical = json.dumps([nodes, edges], sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+    
+    def set_flow(self, nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]]) -> bool:
+        """
+        Store the canvas nodes and edges.
+        
+        Returns False without touching the columns when the flow is unchanged,
+        so re-saving an identical canvas does not rewrite the JSON.
+        """
+        nodes_hash = self.compute_nodes_hash(nodes, edges)
+        if self.nodes_hash == nodes_hash:
+            return False
+        self.nodes = nodes
+        self.edges = edges
+        self.nodes_hash = nodes_hash
+        return True
+    
+    @classmethod
+    def bump_trigger(cls, session, automation_id: int):
+        """
+        Increment trigger count and update last triggered time.
+        
+        Single UPDATE ... SET trigger_count = trigger_count + 1, so concurrent
+        webhook workers cannot overwrite each other's counts.
+        """
+        session.execute(
+            update(cls)
+            .where(cls.id == automation_id)
+            .values(trigger_count=func.coalesce(cls.trigger_count, 0) + 1, last_triggered_at=func.timezone("utc", func.now()))
+            .execution_options(synchronize_session=False)
+        )
 
 
 class WhatsAppConversationState(db.Model):
@@ -161,7 +168,11 @@ class WhatsAppConversationState(db.Model):
     __table_args__ = (
         Index("ix_conv_state_conversation", "conversation_id"),
         Index("ix_conv_state_automation", "automation_id"),
-        Index("ix_conv_state_active", "is_active"),
+        # Active-state lookups; partial so completed states stay out of the index
+        Index("ix_conv_state_ws_phone_active", "workspace_id", "phone_number", "is_active",
+              postgresql_where=text("is_active")),
+        Index("ix_conv_state_conv_active", "conversation_id", "is_active",
+              postgresql_where=text("is_active")),
         {"extend_existing": True},
     )
     
@@ -182,19 +193,51 @@ class WhatsAppConversationState(db.Model):
     last_button_clicked = db.Column(db.String(64), nullable=True)  # For button tracking
     
     # State data (for complex flows)
-    state_data = db.Column(JSON, default=dict)  # Collected inputs, variables, etc.
+    state_data = db.Column(JSON().with_variant(JSONB(), "postgresql"), default=dict)  # Collected inputs, variables, etc.
     
     # 24-hour window tracking
-    last_user_message_at = db.Column(db.DateTime, nullable=True)
-    is_within_24h_window = db.Column(db.Boolean, default=True)
+    last_user_message_at = db.Column(db.DateTime, nullable=True)  # UTC
     
     # Status
     is_active = db.Column(db.Boolean, default=True)
     completed_at = db.Column(db.DateTime, nullable=True)
     
     # Audit
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime, server_default=func.timezone("utc", func.now()))
+    updated_at = db.Column(db.DateTime, server_default=func.timezone("utc", func.now()), onupdate=func.timezone("utc", func.now()))
+    
+    @classmethod
+    def set_state_key(cls, session, state_id: int, key: str, value: Any):
+        """
+        Set one key of state_data in place.
+        
+        UPDATE ... SET state_data = jsonb_set(state_data, '{key}', value), so
+        only the changed key is sent and written instead of the whole blob.
+        """
+        session.execute(
+            update(cls)
+            .where(cls.id == state_id)
+            .values(state_data=func.jsonb_set(
+                func.coalesce(cls.state_data, cast({}, JSONB)),
+                array([key]),
+                cast(value, JSONB),
+            ))
+            .execution_options(synchronize_session=False)
+        )
+    
+    @hybrid_property
+    def is_within_24h_window(self) -> bool:
+        """Derived from last_user_message_at; nothing is stored."""
+        last_message = self.last_user_message_at
+        if last_message is None:
+            return False
+        if last_message.tzinfo is None:
+            last_message = last_message.replace(tzinfo=timezone.utc)
+        return datetime.now(timezone.utc) - last_message < MESSAGING_WINDOW
+    
+    @is_within_24h_window.expression
+    def is_within_24h_window(cls):
+        return cls.last_user_message_at > func.timezone("utc", func.now()) - text("interval '24 hours'")
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary for debugging/API."""
@@ -213,15 +256,12 @@ class WhatsAppConversationState(db.Model):
     def advance_to_node(self, node_id: str):
         """Move to the next node in the automation."""
         self.current_node_id = node_id
-        self.updated_at = datetime.now(timezone.utc)
     
     def record_button_click(self, button_id: str):
         """Record which button was clicked."""
         self.last_button_clicked = button_id
-        self.updated_at = datetime.now(timezone.utc)
     
     def complete(self):
         """Mark this conversation state as completed."""
         self.is_active = False
-        self.completed_at = datetime.now(timezone.utc)
-        self.updated_at = datetime.now(timezone.utc)
+        self.completed_at = func.timezone("utc", func.now())
@@ -20,12 +20,24 @@ Features:
 """
 
 import os
-import json
+import gzip
+import hmac
+import atexit
 import logging
-from datetime import datetime, timezone
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict, Any, Tuple, List
 
+import orjson
+from flask import Flask, current_app
+from sqlalchemy import insert, select, text, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+
 from models import db
+from ctwa.attribution import parse_referral
 from .models import (
     WhatsAppAccount,
     WhatsAppConversation,
@@ -33,6 +45,7 @@ from .models import (
     WhatsAppWebhookLog,
     MessageStatusEvent,
 )
+from .visual_automation_models import WhatsAppVisualAutomation
 from .utils import (
     verify_signature,
     normalize_phone,
@@ -41,6 +54,10 @@ from .utils import (
     get_message_type,
     extract_media_info,
     is_duplicate_message,
+    mark_messages_processed,
+    seen_wamids,
+    recent_wamids,
+    evict_oldest,
 )
 
 logger = logging.getLogger(__name__)
@@ -87,14 +104,346 @@ def verify_webhook_challenge(mode: str, token: str, challenge: str) -> Optional[
         logger.error("WHATSAPP_VERIFY_TOKEN not configured!")
         return None
     
-    if mode == "subscribe" and token == verify_token:
+    # Constant-time comparison so the token can't be recovered byte by byte
+    token_match = hmac.compare_digest((token or "").encode(), verify_token.encode())
+    
+    if mode == "subscribe" and token_match:
         logger.info("Webhook verification successful")
         return challenge
     
-    logger.warning(f"Webhook verification failed: mode={mode}, token_match={token == verify_token}")
+    logger.warning(f"Webhook verification failed: mode={mode}, token_match={token_match}")
     return None
 
 
+# ============================================================
+# Account Resolution Cache (per process)
+# ============================================================
+
+@dataclass(frozen=True)
+class AccountSpec:
+    """The account fields webhook processing needs, detached from the session."""
+    id: int
+    workspace_id: str
+
+
+# phone_number_id -> (spec, or None for unknown/inactive accounts, cached_at).
+# The TTL bounds how long an unlinked or newly linked account goes unnoticed.
+_ACCOUNT_CACHE: Dict[str, Tuple[Optional[AccountSpec], float]] = {}
+_ACCOUNT_CACHE_LOCK = threading.Lock()
+ACCOUNT_CACHE_TTL = 60
+ACCOUNT_CACHE_MAX = 1024
+
+# Customer service window opened by every inbound message
+SESSION_WINDOW = timedelta(hours=24)
+
+
+# ============================================================
+# Message Content Extraction
+# ============================================================
+
+# One extractor per message type, each filling in the content dict;
+# looked up by type instead of walking an if/elif chain per message.
+
+def _extract_text_content(message: Dict[str, Any], content: Dict[str, Any]):
+    content["text"] = message.get("text", {}).get("body", "")
+
+
+def _extract_media_content(message: Dict[str, Any], content: Dict[str, Any]):
+    media_info = extract_media_info(message)
+    if media_info:
+        content.update(media_info)
+
+
+def _extract_location_content(message: Dict[str, Any], content: Dict[str, Any]):
+    location = message.get("location", {})
+    content.update({
+        "latitude": location.get("latitude"),
+        "longitude": location.get("longitude"),
+        "name": location.get("name"),
+        "address": location.get("address"),
+    })
+
+
+def _extract_contacts_content(message: Dict[str, Any], content: Dict[str, Any]):
+    content["contacts"] = message.get("contacts", [])
+
+
+def _extract_interactive_content(message: Dict[str, Any], content: Dict[str, Any]):
+    interactive = message.get("interactive", {})
+    int_type = interactive.get("type", "")
+    content["interactive_type"] = int_type
+    
+    if int_type == "button_reply":
+        reply = interactive.get("button_reply", {})
+        content["button_id"] = reply.get("id")
+        content["button_title"] = reply.get("title")
+    elif int_type == "list_reply":
+        reply = interactive.get("list_reply", {})
+        content["list_id"] = reply.get("id")
+        content["list_title"] = reply.get("title")
+        content["list_description"] = reply.get("description")
+
+
+def _extract_button_content(message: Dict[str, Any], content: Dict[str, Any]):
+    button = message.get("button", {})
+    content["button_text"] = button.get("text", "")
+    content["button_payload"] = button.get("payload", "")
+
+
+def _extract_reaction_content(message: Dict[str, Any], content: Dict[str, Any]):
+    reaction = message.get("reaction", {})
+    content["emoji"] = reaction.get("emoji")
+    content["message_id"] = reaction.get("message_id")
+
+
+def _extract_raw_content(message: Dict[str, Any], content: Dict[str, Any]):
+    # Store raw for unknown types
+    content["raw"] = message
+
+
+_CONTENT_EXTRACTORS = {
+    "text": _extract_text_content,
+    "image": _extract_media_content,
+    "video": _extract_media_content,
+    "audio": _extract_media_content,
+    "document": _extract_media_content,
+    "sticker": _extract_media_content,
+    "location": _extract_location_content,
+    "contacts": _extract_contacts_content,
+    "interactive": _extract_interactive_content,
+    "button": _extract_button_content,
+    "reaction": _extract_reaction_content,
+}
+
+
+# ============================================================
+# Batched Webhook Log Writes
+# ============================================================
+
+# Webhook log rows waiting for the next drain. The table is audit-only, so
+# rows are written in the background in large batches instead of inside
+# every webhook's transaction.
+_pending_webhook_logs: List[Dict[str, Any]] = []
+_pending_webhook_logs_lock = threading.Lock()
+_log_drainer_started = False
+WEBHOOK_LOG_DRAIN_INTERVAL = float(os.getenv("WEBHOOK_LOG_DRAIN_INTERVAL", "0.5"))  # Seconds between drains
+WEBHOOK_LOG_BATCH_SIZE = int(os.getenv("WEBHOOK_LOG_BATCH_SIZE", "500"))  # Rows per INSERT
+WEBHOOK_LOG_QUEUE_MAX = 100_000  # Oldest rows are dropped beyond this (e.g. DB down)
+
+
+def _skip_commit_flush(session) -> None:
+    """
+    Let the current transaction commit without waiting for the WAL flush.
+    
+    Only used for audit rows (webhook logs, status events): a crash can
+    lose the last few hundred ms of them, but never corrupts anything.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        session.execute(text("SET LOCAL synchronous_commit TO OFF"))
+
+
+def _queue_webhook_logs(rows: List[Dict[str, Any]]) -> None:
+    """Queue webhook log rows for the background drainer."""
+    with _pending_webhook_logs_lock:
+        _pending_webhook_logs.extend(rows)
+        overflow = len(_pending_webhook_logs) - WEBHOOK_LOG_QUEUE_MAX
+        if overflow > 0:
+            del _pending_webhook_logs[:overflow]
+            logger.warning(f"Webhook log queue full, dropped {overflow} oldest rows")
+    _ensure_log_drainer(current_app._get_current_object())
+
+
+def _drain_webhook_logs(app: Flask) -> None:
+    """Write queued log rows, WEBHOOK_LOG_BATCH_SIZE per INSERT."""
+    with _pending_webhook_logs_lock:
+        if not _pending_webhook_logs:
+            return
+        rows = _pending_webhook_logs[:]
+        _pending_webhook_logs.clear()
+    
+    written = 0
+    with app.app_context():
+        try:
+            while written < len(rows):
+                batch = rows[written:written + WEBHOOK_LOG_BATCH_SIZE]
+                _skip_commit_flush(db.session)
+                db.session.execute(insert(WhatsAppWebhookLog), batch)
+                db.session.commit()
+                written += len(batch)
+        except Exception as e:
+            db.session.rollback()
+            logger.exception(f"Failed to write webhook logs, requeueing: {e}")
+            with _pending_webhook_logs_lock:
+                _pending_webhook_logs[:0] = rows[written:]
+        finally:
+            db.session.remove()
+
+
+def _ensure_log_drainer(app: Flask) -> None:
+    global _log_drainer_started
+    if _log_drainer_started:
+        return
+    with _pending_webhook_logs_lock:
+        if _log_drainer_started:
+            return
+        _log_drainer_started = True
+    
+    def _loop():
+        partitions_checked_at = None
+        while True:
+            time.sleep(WEBHOOK_LOG_DRAIN_INTERVAL)
+            _drain_webhook_logs(app)
+            now = time.monotonic()
+            if partitions_checked_at is None or now - partitions_checked_at >= WEBHOOK_LOG_PARTITION_CHECK_INTERVAL:
+                partitions_checked_at = now
+                _ensure_webhook_log_partitions(app)
+    
+    threading.Thread(target=_loop, name="webhook-log-drainer", daemon=True).start()
+    atexit.register(_drain_webhook_logs, app)
+
+
+# Monthly partitions of whatsapp_webhook_logs kept ahead of the calendar
+WEBHOOK_LOG_PARTITION_MONTHS_AHEAD = 3
+WEBHOOK_LOG_PARTITION_CHECK_INTERVAL = 86400  # Seconds between checks
+
+
+def ensure_webhook_log_partitions(months_ahead: int = WEBHOOK_LOG_PARTITION_MONTHS_AHEAD) -> None:
+    """
+    Create the monthly whatsapp_webhook_logs partitions for this month and
+    the next ``months_ahead`` months (Postgres, partitioned table only).
+    
+    Rows that already landed in the DEFAULT partition for a month are moved
+    into its new partition: the partition is built detached, filled, and
+    attached, because creating it in place fails while DEFAULT holds rows
+    in its range.
+    """
+    if db.session.get_bind().dialect.name != "postgresql":
+        return
+    partitioned = db.session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('whatsapp_webhook_logs')"
+    )).first()
+    if not partitioned:
+        return
+    
+    # One worker at a time; the lock is released at commit
+    db.session.execute(text("SELECT pg_advisory_xact_lock(hashtext('whatsapp_webhook_logs_partitions'))"))
+    month = datetime.now(timezone.utc).date().replace(day=1)
+    for _ in range(months_ahead + 1):
+        next_month = (month + timedelta(days=32)).replace(day=1)
+        name = f"whatsapp_webhook_logs_{month:%Y_%m}"
+        if db.session.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is None:
+            db.session.execute(text(f"CREATE TABLE {name} (LIKE whatsapp_webhook_logs INCLUDING DEFAULTS)"))
+            db.session.execute(text(
+                f"WITH moved AS ("
+                f" DELETE FROM whatsapp_webhook_logs_default"
+                f" WHERE received_at >= :start AND received_at < :end RETURNING *"
+                f") INSERT INTO {name} SELECT * FROM moved"
+            ), {"start": month, "end": next_month})
+            db.session.execute(text(
+                f"ALTER TABLE whatsapp_webhook_logs ATTACH PARTITION {name} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}')"
+            ))
+            logger.info(f"Created webhook log partition {name}")
+        month = next_month
+    db.session.commit()
+
+
+def _ensure_webhook_log_partitions(app: Flask) -> None:
+    with app.app_context():
+        try:
+            ensure_webhook_log_partitions()
+        except Exception as e:
+            db.session.rollback()
+            logger.exception(f"Failed to create webhook log partitions: {e}")
+        finally:
+            db.session.remove()
+
+
+# ============================================================
+# Webhook Receipts
+# ============================================================
+
+# (id, received_at) of a "received" webhook log row - its full primary key
+WebhookReceipt = Tuple[int, datetime]
+
+# A receipt still unfinished after this many seconds lost its worker
+# (restart, deploy, crash) and is replayed
+WEBHOOK_REPLAY_AFTER = int(os.getenv("WEBHOOK_REPLAY_AFTER", "600"))
+
+
+def store_webhook_receipt(raw_body: bytes) -> WebhookReceipt:
+    """
+    Durably store a webhook's raw body before Meta gets its 200.
+    
+    The row stays unfinished (processed_at IS NULL) until
+    mark_webhook_receipt runs, so a webhook whose processing dies with the
+    process is found again by claim_lost_webhook_receipts.
+    """
+    receipt = db.session.execute(
+        insert(WhatsAppWebhookLog)
+        .values(
+            raw_json_gz=WhatsAppWebhookLog.compress_payload(raw_body),
+            event_type="received",
+            processed=False,
+        )
+        .returning(WhatsAppWebhookLog.id, WhatsAppWebhookLog.received_at)
+    ).one()
+    db.session.commit()
+    return receipt[0], receipt[1]
+
+
+def mark_webhook_receipt(receipt: WebhookReceipt, error: Optional[str] = None) -> None:
+    """Record that a stored webhook finished processing (with error, if any)."""
+    log_id, received_at = receipt
+    db.session.execute(
+        update(WhatsAppWebhookLog)
+        .where(WhatsAppWebhookLog.id == log_id, WhatsAppWebhookLog.received_at == received_at)
+        .values(processed=error is None, error_message=error, processed_at=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def claim_lost_webhook_receipts(limit: int = 50) -> List[Tuple[WebhookReceipt, bytes]]:
+    """
+    Claim unfinished receipts older than WEBHOOK_REPLAY_AFTER for replay.
+    
+    Claiming sets processed_at, so a receipt is replayed at most once even
+    with several workers polling (SKIP LOCKED on Postgres). The replay
+    finishes it again through mark_webhook_receipt.
+    
+    Returns:
+        List of (receipt, raw_body)
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=WEBHOOK_REPLAY_AFTER)
+    lost = (
+        select(WhatsAppWebhookLog.id, WhatsAppWebhookLog.received_at)
+        .where(
+            WhatsAppWebhookLog.event_type == "received",
+            WhatsAppWebhookLog.processed_at.is_(None),
+            WhatsAppWebhookLog.received_at < cutoff,
+        )
+        .order_by(WhatsAppWebhookLog.received_at)
+        .limit(limit)
+    )
+    if db.session.get_bind().dialect.name == "postgresql":
+        lost = lost.with_for_update(skip_locked=True)
+    keys = [tuple(row) for row in db.session.execute(lost)]
+    if not keys:
+        db.session.commit()
+        return []
+    
+    claimed = db.session.execute(
+        update(WhatsAppWebhookLog)
+        .where(tuple_(WhatsAppWebhookLog.id, WhatsAppWebhookLog.received_at).in_(keys))
+        .values(processed_at=datetime.now(timezone.utc))
+        .returning(WhatsAppWebhookLog.id, WhatsAppWebhookLog.received_at, WhatsAppWebhookLog.raw_json_gz)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.session.commit()
+    return [((row[0], row[1]), gzip.decompress(row[2])) for row in claimed]
+
+
 # ============================================================
 # Webhook Processor
 # ============================================================
@@ -112,116 +461,304 @@ class WebhookProcessor:
             db_session: SQLAlchemy session (optional)
         """
         self.db_session = db_session or db.session
-        self._processed_wamids = set()  # In-memory dedup cache
+        # Rows buffered during one webhook and written as multi-row INSERTs
+        self._pending_logs: List[Dict[str, Any]] = []
+        self._pending_status_events: List[Dict[str, Any]] = []
+        # wamids already stored, loaded once per webhook
+        self._existing_wamids: set = set()
+        # wamids written since the last commit; marked as processed (dedup
+        # cache, Redis, Bloom filter) only once that commit succeeds
+        self._uncommitted_wamids: List[str] = []
+        # Entries and messages of this webhook that could not be stored
+        self._failures: List[str] = []
+        # Accounts and their active automations resolved during this webhook
+        self._accounts: Dict[str, Optional[AccountSpec]] = {}
+        self._automations: Dict[int, List[WhatsAppVisualAutomation]] = {}
+        # (account_id, user_phone) -> conversation, prefetched per change;
+        # _prefetched_phones also covers senders with no conversation yet
+        self._conversations: Dict[Tuple[int, str], WhatsAppConversation] = {}
+        self._prefetched_phones: set = set()
+        # Clock read once per entry and shared by every row it writes
+        self._now = datetime.now(timezone.utc)
     
-    def process_webhook(self, payload: Dict[str, Any]) -> Tuple[bool, str]:
+    def process_webhook(self, payload: Dict[str, Any], raw_body: Optional[bytes] = None) -> Tuple[bool, str]:
         """
         Process incoming webhook payload.
         
         Args:
             payload: Webhook JSON payload
+            raw_body: Request body the payload was parsed from (optional).
+                Logged as-is, which saves re-serializing the payload.
             
         Returns:
             Tuple of (success, message)
         """
+        self._now = datetime.now(timezone.utc)
         try:
             # Log raw webhook
-            raw_json = json.dumps(payload)
+            if raw_body is None:
+                raw_body = orjson.dumps(payload)
+            # Compressed once; every log row of this webhook shares the bytes
+            raw_payload = WhatsAppWebhookLog.compress_payload(raw_body)
             
             # Validate structure
             if payload.get("object") != "whatsapp_business_account":
-                self._log_webhook(raw_json, "unknown", None, "Invalid object type")
+                self._log_webhook(raw_payload, "unknown", None, "Invalid object type")
                 return False, "Invalid webhook object type"
             
             entries = payload.get("entry", [])
             if not entries:
-                self._log_webhook(raw_json, "empty", None, "No entries")
+                self._log_webhook(raw_payload, "empty", None, "No entries")
                 return False, "No entries in webhook"
             
-            # Process each entry
+            self._existing_wamids = self._load_existing_wamids(entries)
+            self._accounts = {}
+            self._automations = {}
+            self._conversations = {}
+            self._prefetched_phones = set()
+            
+            # Process each entry; a failed entry doesn't stop the rest
+            self._failures = []
             for entry in entries:
-                self._process_entry(entry, raw_json)
+                try:
+                    self._process_entry(entry, raw_payload)
+                except Exception as e:
+                    logger.exception(f"Webhook entry {entry.get('id')} failed: {e}")
+                    self._failures.append(f"entry {entry.get('id')}: {e}")
             
+            if self._failures:
+                return False, "; ".join(self._failures)
             return True, "Webhook processed successfully"
             
         except Exception as e:
             logger.exception(f"Webhook processing error: {e}")
             return False, str(e)
+        finally:
+            self._flush_pending_rows()
     
-    def _process_entry(self, entry: Dict[str, Any], raw_json: str):
+    def _process_entry(self, entry: Dict[str, Any], raw_payload: bytes):
         """
         Process a single entry from the webhook.
         
+        Everything the entry writes is committed once at the end (messages
+        that go on to automations are committed earlier, see _process_message).
+        Each message is written in its own savepoint, so one bad message is
+        logged and skipped without losing the others.
+        
         Args:
             entry: Entry object from webhook
-            raw_json: Original raw JSON for logging
+            raw_payload: Gzip-compressed raw JSON for logging
         """
-        changes = entry.get("changes", [])
-        
-        for change in changes:
-            value = change.get("value", {})
-            field = change.get("field", "")
-            
-            if field != "messages":
-                # Not a messages field, skip
-                continue
-            
-            phone_number_id = value.get("metadata", {}).get("phone_number_id")
-            
-            # Process statuses (delivery receipts)
-            statuses = value.get("statuses", [])
-            for status in statuses:
-                self._process_status(status, phone_number_id)
-                self._log_webhook(raw_json, "status", phone_number_id)
-            
-            # Process messages
-            messages = value.get("messages", [])
-            contacts = value.get("contacts", [])
+        self._now = datetime.now(timezone.utc)
+        try:
+            changes = entry.get("changes", [])
             
-            for message in messages:
-                contact = self._find_contact(message.get("from"), contacts)
-                self._process_message(message, contact, phone_number_id)
-                self._log_webhook(raw_json, "message", phone_number_id)
+            for change in changes:
+                value = change.get("value", {})
+                field = change.get("field", "")
+                
+                if field != "messages":
+                    # Not a messages field, skip
+                    continue
+                
+                phone_number_id = value.get("metadata", {}).get("phone_number_id")
+                
+                # Process statuses (delivery receipts)
+                statuses = value.get("statuses", [])
+                if statuses:
+                    self._process_statuses_batch(statuses, phone_number_id)
+                    for _ in statuses:
+                        self._log_webhook(raw_payload, "status", phone_number_id)
+                
+                # Process messages
+                messages = value.get("messages", [])
+                # wa_id -> contact, built once per change (first contact wins)
+                contact_by_wa_id = {}
+                for contact in value.get("contacts", []):
+                    contact_by_wa_id.setdefault(contact.get("wa_id"), contact)
+                
+                if messages:
+                    self._prefetch_conversations(messages, phone_number_id)
+                
+                for message in messages:
+                    contact = contact_by_wa_id.get(message.get("from"))
+                    error = self._process_message(message, contact, phone_number_id)
+                    self._log_webhook(raw_payload, "message", phone_number_id, error)
+                    if error:
+                        self._failures.append(f"message {message.get('id')}: {error}")
+                
+                # Process errors
+                errors = value.get("errors", [])
+                for error in errors:
+                    self._process_error(error, phone_number_id)
+                    self._log_webhook(raw_payload, "error", phone_number_id)
             
-            # Process errors
-            errors = value.get("errors", [])
-            for error in errors:
-                self._process_error(error, phone_number_id)
-                self._log_webhook(raw_json, "error", phone_number_id)
+            self._commit()
+        except Exception:
+            self.db_session.rollback()
+            self._forget_uncommitted()
+            raise
+    
+    def _commit(self):
+        """Commit, then mark the wamids it stored as processed."""
+        self.db_session.commit()
+        if self._uncommitted_wamids:
+            mark_messages_processed(self._uncommitted_wamids)
+            for wamid in self._uncommitted_wamids:
+                seen_wamids.add(wamid)
+            self._uncommitted_wamids = []
+    
+    def _forget_uncommitted(self):
+        """
+        Drop state that a rollback invalidated: uncommitted wamids stay
+        unmarked, and conversations created since the last commit are gone.
+        """
+        self._uncommitted_wamids = []
+        self._forget_conversations()
+    
+    def _load_existing_wamids(self, entries: List[Dict[str, Any]]) -> set:
+        """
+        Return the wamids in this payload that are already stored or were
+        already handled by this process.
+        
+        One IN query for the whole webhook instead of a lookup per message,
+        limited to wamids the seen-wamid Bloom filter cannot rule out. In
+        steady state every message is new and the query is skipped.
+        """
+        covered_since = seen_wamids.covered_since
+        existing = set()
+        wamids = []
+        for entry in entries:
+            for change in entry.get("changes", []):
+                for message in change.get("value", {}).get("messages", []):
+                    wamid = message.get("id")
+                    if not wamid:
+                        continue
+                    if recent_wamids.contains(wamid):
+                        # Already handled by this process - no lookup needed
+                        existing.add(wamid)
+                    elif seen_wamids.might_contain(wamid) or not self._is_recent(message.get("timestamp"), covered_since):
+                        wamids.append(wamid)
+        if not wamids:
+            return existing
+        
+        rows = self.db_session.execute(
+            select(WhatsAppMessage.wamid).where(WhatsAppMessage.wamid.in_(wamids))
+        )
+        existing.update(row[0] for row in rows)
+        return existing
+    
+    @staticmethod
+    def _is_recent(timestamp: Optional[str], since: float) -> bool:
+        """True if a webhook epoch-seconds timestamp is at or after ``since``."""
+        try:
+            return int(timestamp) >= since
+        except (TypeError, ValueError):
+            return False
     
     def _process_message(
         self,
         message: Dict[str, Any],
         contact: Optional[Dict[str, Any]],
         phone_number_id: str,
-    ):
+    ) -> Optional[str]:
         """
         Process an incoming message.
         
+        The message is written inside a savepoint. If that fails only this
+        message is rolled back, and it is not marked as processed, so a
+        replay or retry can still store it.
+        
         Args:
             message: Message object from webhook
             contact: Contact info (name, etc.)
             phone_number_id: Our phone number ID
+            
+        Returns:
+            Error message if the message could not be stored, else None
+        """
+        wamid = message.get("id")
+        try:
+            with self.db_session.begin_nested():
+                stored = self._store_message(message, contact, phone_number_id)
+        except IntegrityError:
+            # wamid is unique - another worker stored the same message
+            if self.db_session.execute(
+                select(WhatsAppMessage.id).where(WhatsAppMessage.wamid == wamid)
+            ).first():
+                logger.debug(f"Duplicate message (stored concurrently): {wamid}")
+                return None
+            logger.exception(f"Failed to store message {wamid}")
+            self._forget_conversations()
+            return "Failed to store message"
+        except Exception as e:
+            logger.exception(f"Failed to store message {wamid}: {e}")
+            self._forget_conversations()
+            return str(e)
+        
+        if stored is None:
+            return None
+        self._uncommitted_wamids.append(wamid)
+        
+        msg_record, account, conversation, from_phone, automation_input = stored
+        if not automation_input:
+            # Committed with the rest of the entry
+            return None
+        
+        # Automations commit (and may roll back) the session themselves,
+        # so the message is stored before they run
+        self._commit()
+        message_text, is_button_reply, button_payload = automation_input
+        self._process_automation(
+            account=account,
+            conversation=conversation,
+            message_text=message_text,
+            message_id=msg_record.id,
+            from_phone=from_phone,
+            is_button_reply=is_button_reply,
+            button_payload=button_payload
+        )
+        return None
+    
+    def _forget_conversations(self):
+        # A rolled-back savepoint may have dropped conversations this
+        # webhook created; look them up again instead of reusing them
+        self._conversations = {}
+        self._prefetched_phones = set()
+    
+    def _store_message(
+        self,
+        message: Dict[str, Any],
+        contact: Optional[Dict[str, Any]],
+        phone_number_id: str,
+    ) -> Optional[Tuple[WhatsAppMessage, AccountSpec, WhatsAppConversation, str, Optional[Tuple[str, bool, Optional[str]]]]]:
+        """
+        Write an incoming message and update its conversation (no commit).
+        
+        Returns:
+            (message, account, conversation, from_phone, automation_input),
+            or None if the message was skipped
         """
         wamid = message.get("id")
         from_phone = message.get("from")
         msg_type = get_message_type(message)
         timestamp = message.get("timestamp")
         
-        # DEBUG: Print message processing info
-        print(f"📩 Processing message: wamid={wamid}, from={from_phone}, type={msg_type}")
-        print(f"   phone_number_id: {phone_number_id}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Processing message: wamid=%s, from=%s, type=%s, phone_number_id=%s",
+                wamid, from_phone, msg_type, phone_number_id,
+            )
         
         if not wamid or not from_phone:
-            print("⚠️ Message missing wamid or from")
             logger.warning("Message missing wamid or from")
             return
         
-        # Deduplicate by wamid
-        existing = WhatsAppMessage.query.filter_by(wamid=wamid).first()
-        if existing:
+        # Deduplicate by wamid (stored rows were loaded in one query up front)
+        if wamid in self._existing_wamids:
             logger.debug(f"Duplicate message skipped: {wamid}")
             return
+        self._existing_wamids.add(wamid)  # Repeats within this payload
         
         # In-memory dedup check
         if is_duplicate_message(wamid):
@@ -235,7 +772,7 @@ class WebhookProcessor:
         account = self._get_or_create_account(phone_number_id)
         
         if not account:
-            print(f"⚠️ Skipping message - no active account for phone_number_id: {phone_number_id}")
+            logger.debug("Skipping message - no active account for phone_number_id: %s", phone_number_id)
             return
         
         # Get or create conversation
@@ -246,8 +783,7 @@ class WebhookProcessor:
         content = self._extract_content(message, msg_type)
         
         # Parse message timestamp
-        from datetime import timedelta
-        msg_timestamp = parse_whatsapp_timestamp(timestamp) or datetime.now(timezone.utc)
+        msg_timestamp = parse_whatsapp_timestamp(timestamp) or self._now
         
         # Create message record
         msg_record = WhatsAppMessage(
@@ -264,78 +800,87 @@ class WebhookProcessor:
         # Update conversation with session tracking
         conversation.last_message_at = msg_timestamp
         conversation.last_inbound_at = msg_timestamp
-        conversation.session_expires_at = msg_timestamp + timedelta(hours=24)  # 24h window
+        conversation.session_expires_at = msg_timestamp + SESSION_WINDOW
         conversation.status = "open"  # Open on new message
         conversation.unread_count = (conversation.unread_count or 0) + 1
         
-        # Process CTWA attribution if this is from an ad
-        self._process_attribution(message, conversation)
+        # Process CTWA attribution if this is from an ad (most messages are not)
+        if "referral" in message:
+            self._process_attribution(message, conversation)
         
-        self.db_session.commit()
-        print(f"✅ Stored message: id={msg_record.id}, type={msg_type}, content={content}")
+        # Assigns the id (and surfaces constraint errors inside the savepoint)
+        self.db_session.flush()
         logger.info(f"Stored incoming message: {wamid} from {from_phone}")
         
-        # Process automation rules (after commit to avoid blocking)
-        # Handle both text messages and interactive button replies
+        # Automations handle text messages and interactive button replies
+        return msg_record, account, conversation, from_phone, self._automation_input(content)
+    
+    def _automation_input(self, content: Dict[str, Any]) -> Optional[Tuple[str, bool, Optional[str]]]:
+        """
+        (message_text, is_button_reply, button_payload) for messages that
+        automations handle, or None for everything else.
+        
+        Read from the content _extract_content already pulled out of the
+        message, so the webhook JSON is only walked once.
+        """
+        msg_type = content["type"]
         if msg_type == "text":
-            text_content = extract_message_text(message)
-            if text_content:
-                self._process_automation(
-                    account=account,
-                    conversation=conversation,
-                    message_text=text_content,
-                    message_id=msg_record.id,
-                    from_phone=from_phone,
-                    is_button_reply=False,
-                    button_payload=None
-                )
+            if content["text"]:
+                return content["text"], False, None
         elif msg_type == "interactive":
             # Handle button replies from interactive messages
-            interactive = message.get("interactive", {})
-            int_type = interactive.get("type", "")
-            
-            button_payload = None
-            button_title = ""
-            
+            int_type = content["interactive_type"]
             if int_type == "button_reply":
-                reply = interactive.get("button_reply", {})
-                button_payload = reply.get("id")
-                button_title = reply.get("title", "")
+                button_payload, button_title = content["button_id"], content["button_title"]
             elif int_type == "list_reply":
-                reply = interactive.get("list_reply", {})
-                button_payload = reply.get("id")
-                button_title = reply.get("title", "")
+                button_payload, button_title = content["list_id"], content["list_title"]
+            else:
+                return None
             
             if button_payload:
-                self._process_automation(
-                    account=account,
-                    conversation=conversation,
-                    message_text=button_title,
-                    message_id=msg_record.id,
-                    from_phone=from_phone,
-                    is_button_reply=True,
-                    button_payload=button_payload
-                )
+                return button_title or "", True, button_payload
+        return None
     
-    def _process_status(self, status: Dict[str, Any], phone_number_id: str):
+    def _process_statuses_batch(self, statuses: List[Dict[str, Any]], phone_number_id: str):
         """
-        Process a delivery status update.
+        Process the delivery status updates of one change.
+        
+        The messages they refer to are loaded with one IN query instead of a
+        SELECT per status, and the updates are committed with the rest of the
+        entry. Statuses are applied in webhook order.
         
         Args:
-            status: Status object from webhook
+            statuses: Status objects from webhook
             phone_number_id: Our phone number ID
         """
-        from datetime import timedelta
+        wamids = {status.get("id") for status in statuses if status.get("id")}
+        if not wamids:
+            return
+        
+        query = select(WhatsAppMessage).where(WhatsAppMessage.wamid.in_(wamids))
+        if any(status.get("status") == "sent" for status in statuses):
+            query = query.options(selectinload(WhatsAppMessage.conversation))
+        messages = {message.wamid: message for message in self.db_session.execute(query).scalars()}
+        
+        for status in statuses:
+            self._process_status(status, messages.get(status.get("id")))
+    
+    def _process_status(self, status: Dict[str, Any], message: Optional[WhatsAppMessage]):
+        """
+        Apply one delivery status update.
         
+        Args:
+            status: Status object from webhook
+            message: Stored message the status refers to, if any
+        """
         wamid = status.get("id")
         status_value = status.get("status")  # sent, delivered, read, failed
         timestamp = status.get("timestamp")
-        recipient = status.get("recipient_id")
         
         if not wamid or not status_value:
             return
         
-        ts = parse_whatsapp_timestamp(timestamp) if timestamp else datetime.now(timezone.utc)
+        ts = parse_whatsapp_timestamp(timestamp) if timestamp else self._now
         
         # Log status event for debugging/history (always log for audit)
         error_code = None
@@ -347,22 +892,18 @@ class WebhookProcessor:
                 error_code = str(error.get("code", ""))
                 error_message = error.get("title", error.get("message", "Unknown error"))
         
-        status_event = MessageStatusEvent(
-            wamid=wamid,
-            status=status_value,
-            timestamp=ts,
-            error_code=error_code,
-            error_message=error_message,
-            raw_event=status,  # Store full event for debugging
-        )
-        self.db_session.add(status_event)
-        
-        # Find the message by wamid
-        message = WhatsAppMessage.query.filter_by(wamid=wamid).first()
+        self._pending_status_events.append({
+            "wamid": wamid,
+            "status": status_value,
+            "timestamp": ts,
+            "error_code": error_code,
+            "error_message": error_message,
+            "raw_event": status,  # Store full event for debugging
+        })
         
         if not message:
+            # The status event is still written by _flush_pending_rows
             logger.debug(f"Status update for unknown message: {wamid}")
-            self.db_session.commit()  # Still commit the status event
             return
         
         # Update status
@@ -382,7 +923,6 @@ class WebhookProcessor:
             message.error_code = error_code
             message.error_message = error_message
         
-        self.db_session.commit()
         logger.debug(f"Updated message status: {wamid} {old_status} -> {status_value}")
     
     def _process_error(self, error: Dict[str, Any], phone_number_id: str):
@@ -415,91 +955,91 @@ class WebhookProcessor:
             Content dict
         """
         content = {"type": msg_type}
-        
-        if msg_type == "text":
-            content["text"] = message.get("text", {}).get("body", "")
-        
-        elif msg_type in ("image", "video", "audio", "document", "sticker"):
-            media_info = extract_media_info(message)
-            if media_info:
-                content.update(media_info)
-        
-        elif msg_type == "location":
-            location = message.get("location", {})
-            content.update({
-                "latitude": location.get("latitude"),
-                "longitude": location.get("longitude"),
-                "name": location.get("name"),
-                "address": location.get("address"),
-            })
-        
-        elif msg_type == "contacts":
-            content["contacts"] = message.get("contacts", [])
-        
-        elif msg_type == "interactive":
-            interactive = message.get("interactive", {})
-            int_type = interactive.get("type", "")
-            content["interactive_type"] = int_type
-            
-            if int_type == "button_reply":
-                reply = interactive.get("button_reply", {})
-                content["button_id"] = reply.get("id")
-                content["button_title"] = reply.get("title")
-            elif int_type == "list_reply":
-                reply = interactive.get("list_reply", {})
-                content["list_id"] = reply.get("id")
-                content["list_title"] = reply.get("title")
-                content["list_description"] = reply.get("description")
-        
-        elif msg_type == "button":
-            content["button_text"] = message.get("button", {}).get("text", "")
-            content["button_payload"] = message.get("button", {}).get("payload", "")
-        
-        elif msg_type == "reaction":
-            reaction = message.get("reaction", {})
-            content["emoji"] = reaction.get("emoji")
-            content["message_id"] = reaction.get("message_id")
-        
-        else:
-            # Store raw for unknown types
-            content["raw"] = message
-        
+        _CONTENT_EXTRACTORS.get(msg_type, _extract_raw_content)(message, content)
         return content
     
-    def _get_or_create_account(self, phone_number_id: str) -> Optional[WhatsAppAccount]:
+    def _get_or_create_account(self, phone_number_id: str) -> Optional[AccountSpec]:
         """
         Get WhatsApp account by phone_number_id.
         
         Returns None if:
         - Account doesn't exist (don't auto-create for incoming webhooks)
         - Account exists but is inactive (unlinked)
+        
+        Resolved from a per-process TTL cache, so a steady stream of webhooks
+        for one number needs no account SELECT.
         """
-        account = WhatsAppAccount.query.filter_by(phone_number_id=phone_number_id).first()
+        if phone_number_id in self._accounts:
+            return self._accounts[phone_number_id]
         
-        if not account:
+        now = time.monotonic()
+        cached = _ACCOUNT_CACHE.get(phone_number_id)
+        if cached and now - cached[1] < ACCOUNT_CACHE_TTL:
+            self._accounts[phone_number_id] = cached[0]
+            return cached[0]
+        
+        row = self.db_session.execute(
+            select(WhatsAppAccount.id, WhatsAppAccount.workspace_id, WhatsAppAccount.is_active)
+            .where(WhatsAppAccount.phone_number_id == phone_number_id)
+            .limit(1)
+        ).one_or_none()
+        
+        account = None
+        if not row:
             # Don't auto-create accounts for incoming webhooks
             # Accounts should be created via OAuth flow
             logger.warning(f"No account found for phone_number_id: {phone_number_id}")
-            return None
-        
-        if not account.is_active:
+        elif not row.is_active:
             # Skip inactive (unlinked) accounts
             logger.info(f"Skipping inactive account: {phone_number_id}")
-            return None
+        else:
+            account = AccountSpec(id=row.id, workspace_id=row.workspace_id)
         
+        with _ACCOUNT_CACHE_LOCK:
+            evict_oldest(_ACCOUNT_CACHE, ACCOUNT_CACHE_MAX)
+            _ACCOUNT_CACHE[phone_number_id] = (account, now)
+        
+        self._accounts[phone_number_id] = account
         return account
     
+    def _prefetch_conversations(self, messages: List[Dict[str, Any]], phone_number_id: str):
+        """Load the conversations of every sender in a change with one IN query."""
+        account = self._get_or_create_account(phone_number_id)
+        if not account:
+            return
+        
+        user_phones = {normalize_phone(message["from"]) for message in messages if message.get("from")}
+        user_phones = {phone for phone in user_phones if (account.id, phone) not in self._prefetched_phones}
+        if not user_phones:
+            return
+        self._prefetched_phones.update((account.id, phone) for phone in user_phones)
+        
+        conversations = self.db_session.execute(
+            select(WhatsAppConversation).where(
+                WhatsAppConversation.account_id == account.id,
+                WhatsAppConversation.user_phone.in_(user_phones),
+            )
+        ).scalars()
+        for conversation in conversations:
+            self._conversations.setdefault((account.id, conversation.user_phone), conversation)
+    
     def _get_or_create_conversation(
         self,
         account_id: int,
         user_phone: str,
         user_name: Optional[str] = None,
     ) -> WhatsAppConversation:
-        """Get or create conversation."""
-        conversation = WhatsAppConversation.query.filter_by(
-            account_id=account_id,
-            user_phone=user_phone,
-        ).first()
+        """Get or create conversation (prefetched ones are a dict lookup)."""
+        conversation = self._conversations.get((account_id, user_phone))
+        if conversation is None and (account_id, user_phone) not in self._prefetched_phones:
+            conversation = self.db_session.execute(
+                select(WhatsAppConversation)
+                .where(
+                    WhatsAppConversation.account_id == account_id,
+                    WhatsAppConversation.user_phone == user_phone,
+                )
+                .limit(1)
+            ).scalar_one_or_none()
         
         if not conversation:
             conversation = WhatsAppConversation(
@@ -512,6 +1052,7 @@ class WebhookProcessor:
             self.db_session.add(conversation)
             self.db_session.flush()
             logger.info(f"Created conversation with: {user_phone}")
+            self._conversations[(account_id, user_phone)] = conversation
         elif user_name and conversation.user_name != user_name:
             # Update name if it changed or was missing
             conversation.user_name = user_name
@@ -544,15 +1085,13 @@ class WebhookProcessor:
             return
         
         try:
-            from ctwa.attribution import parse_referral
-            
             attribution = parse_referral(message)
             if attribution:
                 conversation.entry_source = "ctwa"
                 conversation.ctwa_clid = attribution.ctwa_clid
                 conversation.ad_id = attribution.ad_id
                 conversation.attribution_data = attribution.to_dict()
-                conversation.attributed_at = datetime.now(timezone.utc)
+                conversation.attributed_at = self._now
                 
                 logger.info(
                     f"Attributed conversation {conversation.id} to ad {attribution.ad_id}"
@@ -560,16 +1099,9 @@ class WebhookProcessor:
         except Exception as e:
             logger.exception(f"Failed to process attribution: {e}")
     
-    def _find_contact(self, phone: str, contacts: List[Dict]) -> Optional[Dict]:
-        """Find contact info by phone number."""
-        for contact in contacts:
-            if contact.get("wa_id") == phone:
-                return contact
-        return None
-    
     def _process_automation(
         self,
-        account: WhatsAppAccount,
+        account: AccountSpec,
         conversation: WhatsAppConversation,
         message_text: str,
         message_id: int,
@@ -595,7 +1127,10 @@ class WebhookProcessor:
         try:
             # --- INTERACTIVE AUTOMATIONS (Visual Flow Builder) ---
             # Process these FIRST as they track conversation state
-            from .interactive_automation_engine import process_interactive_automation
+            from .interactive_automation_engine import process_interactive_automation, load_active_automations
+            
+            if account.id not in self._automations:
+                self._automations[account.id] = load_active_automations(account.id)
             
             interactive_result = process_interactive_automation(
                 account=account,
@@ -604,11 +1139,11 @@ class WebhookProcessor:
                 from_phone=from_phone,
                 is_button_reply=is_button_reply,
                 button_payload=button_payload,
+                automations=self._automations[account.id],
             )
             
             if interactive_result:
                 logger.info(f"Interactive automation triggered: {interactive_result}")
-                print(f"🔄 Interactive automation triggered")
                 return  # Don't continue to regular automation if interactive handled it
             
             # --- REGULAR AUTOMATIONS (Rule-based: welcome, keyword, etc.) ---
@@ -637,7 +1172,6 @@ class WebhookProcessor:
             
             if result:
                 logger.info(f"Automation rule matched: {result.get('rule_name')}")
-                print(f"🤖 Automation triggered: {result.get('rule_name')}")
                 
                 # Get response config and inject the incoming message for AI responses
                 response_config = result.get("response_config", {}).copy()
@@ -663,37 +1197,54 @@ class WebhookProcessor:
                 
                 if success:
                     logger.info(f"Automation response sent successfully")
-                    print(f"✅ Automation response sent")
                 else:
                     logger.warning(f"Automation response failed: {error}")
-                    print(f"⚠️ Automation response failed: {error}")
             
         except Exception as e:
             # CRITICAL: Never let automation errors break message processing
             logger.exception(f"Automation processing error (non-fatal): {e}")
-            print(f"⚠️ Automation error (non-fatal): {e}")
     
     def _log_webhook(
         self,
-        raw_json: str,
+        raw_payload: bytes,
         event_type: str,
         phone_number_id: Optional[str],
         error: Optional[str] = None,
     ):
-        """Log webhook to database."""
+        """Buffer a webhook log row; written by _flush_pending_rows."""
+        self._pending_logs.append({
+            "raw_json_gz": raw_payload,
+            "event_type": event_type,
+            "phone_number_id": phone_number_id,
+            "processed": error is None,
+            "error_message": error,
+            "processed_at": self._now if error is None else None,
+        })
+    
+    def _flush_pending_rows(self):
+        """
+        Write buffered status events and hand webhook logs to the drainer.
+        
+        Status events get one executemany INSERT, which SQLAlchemy sends as
+        multi-row INSERT ... VALUES batches instead of one statement per event,
+        committed without waiting for the WAL flush.
+        """
+        if self._pending_logs:
+            _queue_webhook_logs(self._pending_logs)
+            self._pending_logs = []
+        
+        if not self._pending_status_events:
+            return
+        
         try:
-            log = WhatsAppWebhookLog(
-                raw_json=raw_json,
-                event_type=event_type,
-                phone_number_id=phone_number_id,
-                processed=error is None,
-                error_message=error,
-                processed_at=datetime.now(timezone.utc) if error is None else None,
-            )
-            self.db_session.add(log)
+            _skip_commit_flush(self.db_session)
+            self.db_session.execute(insert(MessageStatusEvent), self._pending_status_events)
             self.db_session.commit()
         except Exception as e:
-            logger.error(f"Failed to log webhook: {e}")
+            self.db_session.rollback()
+            logger.error(f"Failed to write status events: {e}")
+        finally:
+            self._pending_status_events = []
 
 
 # ============================================================